@@ -1,194 +1,484 @@
 from airflow.models import DAG
 from airflow.operators.dummy_operator import DummyOperator
+from airflow.operators.postgres_operator import PostgresOperator
 
-from operators import (RedshiftStagingOperator, LoadFactOperator, LoadDimensionOperator, DataQualityOperator)
+from operators import (RedshiftStagingOperator, LoadFactOperator, LoadDimensionOperator, DataQualityOperator,
+                       CompactFilesOperator, ExtractEventsOperator, ValidateRecordsOperator, TableMaintenanceOperator,
+                       LoadRollupOperator)
 
-from helpers import SqlQueries
+from helpers import SqlQueries, default_checks, build_tasks, partition_days, HOUR_MS, DAY_MS
 
 import datetime
+import os
 
+# Root of a local copy of the resources folder. Only used when the "redshift" connection points to a plain Postgres.
+LOCAL_DATA = os.environ.get("SPARKIFY_LOCAL_DATA", "")
+# s3://bucket/prefix or local directory where the pipeline writes its intermediate files. Enables the compaction and
+# validation steps.
+STAGING_ROOT = os.environ.get("SPARKIFY_STAGING_ROOT", "")
+# Format the compaction step converts the song files to: json (merged as they are), csv or parquet.
+COPY_FORMAT = os.environ.get("SPARKIFY_COPY_FORMAT", "csv")
+# First and last day (YYYY-MM-DD) to reload with the sparkify_backfill DAG, and how many tasks of it run at once.
+BACKFILL_START = os.environ.get("SPARKIFY_BACKFILL_START", "")
+BACKFILL_END = os.environ.get("SPARKIFY_BACKFILL_END", BACKFILL_START)
+BACKFILL_PARALLELISM = int(os.environ.get("SPARKIFY_BACKFILL_PARALLELISM", "8"))
 
 default_args = {
     'owner': 'Luis Alfredo Leon',
     'depends_on_past': False,
-    'start_date': datetime.datetime.now(),
+    'start_date': datetime.datetime(2018, 11, 1),
     'retries': 2,
-    'retry_delay': datetime.timedelta(minutes=3),
-    'catchup': False
+    'retry_delay': datetime.timedelta(minutes=3)
 }
 
-""" 
-DAG DECLARATION 
+"""
+DAG DECLARATION
 """
 dag = DAG(
     "sparkify",
     max_active_runs=1,
     default_args=default_args,
-    schedule_interval=datetime.timedelta(days=1)
-)
-
-"""
-STEP BEGIN EXECUTION.
-"""
-step_begin_execution = DummyOperator(
-    task_id="begin_execution",
-    dag=dag
+    schedule_interval=datetime.timedelta(days=1),
+    catchup=False
 )
 
 """
-STAGING STEPS
+TABLE NAMES
 """
+compacted_songs = f"{STAGING_ROOT}/song_data/"
+song_chunks = "song_data_chunks"
+validated_logs = f"{STAGING_ROOT}/log_data/{{ds}}/"
+log_quarantine = f"{STAGING_ROOT}/quarantine/log_data/{{ds}}/"
+log_chunks = "log_data_chunks"
 staging_songs = "songs_raw_data"
-step_stage_songs_into_db = RedshiftStagingOperator(
-    task_id="stage_songs_into_db",
-    dag=dag,
-    table=staging_songs,
-    db_conn_id="redshift",
-    aws_credentials_id="aws_credentials",
-    s3_bucket="udacity-dend",
-    s3_key="song_data/",
-    clean=False,
-    staging_type="songs",
-    skip=False
-)
-
 staging_logs = "logs_raw_data"
-step_stage_logs_into_db = RedshiftStagingOperator(
-    task_id="stage_logs_into_db",
-    dag=dag,
-    table=staging_logs,
-    db_conn_id="redshift",
-    aws_credentials_id="aws_credentials",
-    s3_bucket="udacity-dend",
-    s3_key="log_data/",
-    clean=False,
-    json_conf="s3://udacity-dend/log_json_path.json",
-    staging_type="logs",
-    skip=False
-)
+song_match_keys = "song_match_keys"
+song_events = "song_events"
+facts_table = "songplays"
+dimension_time = "dimension_time"
+dimension_user = "dimension_user"
+dimension_artist = "dimension_artist"
+dimension_song = "dimension_song"
+dimension_calendar = "dimension_calendar"
+quality_report = "data_quality_report"
+rollup_song = "rollup_daily_song_plays"
+rollup_artist = "rollup_daily_artist_plays"
+rollup_level = "rollup_daily_level_plays"
+rollup_concurrency = "rollup_hourly_concurrency"
 
-"""
-LOAD FACT STAGE
-"""
-facts_table="songplays"
-step_create_and_populate_facts_table = LoadFactOperator(
-    task_id="create_and_populate_facts_table",
-    dag=dag,
-    table=facts_table,
-    raw_songs_table=staging_songs,
-    raw_logs_table=staging_logs,
-    db_conn_id="redshift",
-    skip=False
-)
+dims = {dimension_song: "song_id",
+        dimension_time: "start_time",
+        dimension_user: "user_id",
+        dimension_artist: "artist_id"}
+
+# Rollup table: (create_func, insert_func, bucket column, grain of a bucket in milliseconds).
+rollups = {rollup_song: (SqlQueries.rollup_daily_song_create, SqlQueries.rollup_daily_song_insert, "day_start", DAY_MS),
+           rollup_artist: (SqlQueries.rollup_daily_artist_create, SqlQueries.rollup_daily_artist_insert, "day_start",
+                           DAY_MS),
+           rollup_level: (SqlQueries.rollup_daily_level_create, SqlQueries.rollup_daily_level_insert, "day_start",
+                          DAY_MS),
+           rollup_concurrency: (SqlQueries.rollup_hourly_concurrency_create,
+                                SqlQueries.rollup_hourly_concurrency_insert, "hour_start", HOUR_MS)}
 
 """
-LOAD DIMENSIONS STAGES
+TABLE SPECS. EVERY TASK DECLARES THE TABLE IT PRODUCES AND THE TABLES IT READS, AND THE DEPENDENCIES ARE INFERRED
+FROM THAT LINEAGE (see helpers.lineage).
 """
-dimension_time="dimension_time"
-step_create_and_populate_dim_time = LoadDimensionOperator(
-    task_id="create_and_populate_dim_time",
-    dag=dag,
-    table=dimension_time,
-    raw_table=staging_logs,
-    create_func=SqlQueries.dimension_time_create,
-    insert_func=SqlQueries.dimension_time_insert,
-    skip=False,
-    db_conn_id="redshift",
-    delete_first=True
-)
+compaction_specs = [
+    {
+        "task_id": "compact_songs",
+        "table": song_chunks,
+        "sources": [],
+        "operator": CompactFilesOperator,
+        "kwargs": dict(
+            db_conn_id="redshift",
+            aws_credentials_id="aws_credentials",
+            source=f"{LOCAL_DATA}/song_data" if LOCAL_DATA else "s3://udacity-dend/song_data/",
+            staging_prefix=compacted_songs,
+            output_format=COPY_FORMAT,
+            staging_type="songs",
+            ledger_table="staging_loaded_files",
+            target_table=staging_songs,
+            skip=False
+        )
+    }
+] if STAGING_ROOT else []
 
-dimension_user="dimension_user"
-step_create_and_populate_dim_user = LoadDimensionOperator(
-    task_id="create_and_populate_dim_user",
-    dag=dag,
-    table=dimension_user,
-    raw_table=staging_logs,
-    create_func=SqlQueries.dimension_user_create,
-    insert_func=SqlQueries.dimension_user_insert,
-    skip=False,
-    db_conn_id="redshift",
-    delete_first=True
-)
+validation_specs = [
+    {
+        "task_id": "validate_logs",
+        "table": log_chunks,
+        "sources": [],
+        "operator": ValidateRecordsOperator,
+        "kwargs": dict(
+            db_conn_id="redshift",
+            aws_credentials_id="aws_credentials",
+            source=f"{LOCAL_DATA}/log-data/{{ds}}-events.json" if LOCAL_DATA else
+            "s3://udacity-dend/log_data/{execution_date.year}/{execution_date.month:02d}/{ds}-events.json",
+            staging_prefix=validated_logs,
+            quarantine_prefix=log_quarantine,
+            staging_type="logs",
+            table=staging_logs,
+            batched=True,
+            sample_size=1000,
+            skip=False
+        )
+    }
+] if STAGING_ROOT else []
 
-dimension_artist="dimension_artist"
-step_create_and_populate_dim_artist = LoadDimensionOperator(
-    task_id="create_and_populate_dim_artist",
-    dag=dag,
-    table=dimension_artist,
-    raw_table=staging_songs,
-    create_func=SqlQueries.dimension_artist_create,
-    insert_func=SqlQueries.dimension_artist_insert,
-    delete_first=True,
-    skip=False,
-    db_conn_id="redshift"
-)
+staging_specs = [
+    {
+        "task_id": "stage_songs_into_db",
+        "table": staging_songs,
+        "sources": [song_chunks],
+        "operator": RedshiftStagingOperator,
+        "kwargs": dict(
+            table=staging_songs,
+            db_conn_id="redshift",
+            aws_credentials_id="aws_credentials",
+            s3_bucket="udacity-dend",
+            s3_key="song_data/",
+            clean=False,
+            staging_type="songs",
+            incremental=True,
+            sample_size=1000,
+            chunk_size=500,
+            match_keys_table=song_match_keys,
+            local_path=f"{LOCAL_DATA}/song_data" if LOCAL_DATA else "",
+            copy_manifest=f"{compacted_songs}chunks.manifest" if STAGING_ROOT else "",
+            copy_format=COPY_FORMAT,
+            skip_unchanged=True
+        )
+    },
+    {
+        "task_id": "stage_logs_into_db",
+        "table": staging_logs,
+        "sources": [log_chunks],
+        "operator": RedshiftStagingOperator,
+        "kwargs": dict(
+            table=staging_logs,
+            db_conn_id="redshift",
+            aws_credentials_id="aws_credentials",
+            s3_bucket="udacity-dend",
+            s3_key="log_data/{execution_date.year}/{execution_date.month:02d}/{ds}-events.json",
+            clean=False,
+            json_conf="s3://udacity-dend/log_json_path.json",
+            staging_type="logs",
+            batched=True,
+            retention_days=7,
+            sample_size=1000,
+            local_path=f"{LOCAL_DATA}/log-data/{{ds}}-events.json" if LOCAL_DATA else "",
+            copy_manifest=f"{validated_logs}chunks.manifest" if STAGING_ROOT else "",
+            skip_unchanged=True
+        )
+    }
+]
 
-dimension_song="dimension_song"
-step_create_and_populate_dim_song = LoadDimensionOperator(
-    task_id="create_and_populate_dim_song",
-    dag=dag,
-    table=dimension_song,
-    raw_table=staging_songs,
-    create_func=SqlQueries.dimension_song_create,
-    insert_func=SqlQueries.dimension_song_insert,
-    delete_first=True,
-    skip=False,
-    db_conn_id="redshift",
-)
+events_specs = [
+    {
+        "task_id": "extract_song_events",
+        "table": song_events,
+        "sources": [staging_logs],
+        "operator": ExtractEventsOperator,
+        "kwargs": dict(
+            table=song_events,
+            raw_logs_table=f"{staging_logs}_{{ds_nodash}}",
+            db_conn_id="redshift",
+            skip_unchanged=True
+        )
+    }
+]
 
+fact_specs = [
+    {
+        "task_id": "create_and_populate_facts_table",
+        "table": facts_table,
+        "sources": [staging_songs, song_events],
+        "operator": LoadFactOperator,
+        "kwargs": dict(
+            table=facts_table,
+            raw_songs_table=staging_songs,
+            raw_logs_table=song_events,
+            match_keys_table=song_match_keys,
+            db_conn_id="redshift",
+            strategy="match_key",
+            mode="merge",
+            skip_unchanged=True
+        )
+    }
+]
 
-"""
-DATA QUALITY STAGE
-"""
-dims = {dimension_song: "song_id",
-        dimension_time: "start_time",
-        dimension_user: "user_id",
-        dimension_artist: "artist_id"}
+dimension_specs = [
+    {
+        "task_id": "create_and_populate_dim_time",
+        "table": dimension_time,
+        "sources": [song_events],
+        "operator": LoadDimensionOperator,
+        "kwargs": dict(
+            table=dimension_time,
+            raw_table=song_events,
+            create_func=SqlQueries.dimension_time_create,
+            insert_func=SqlQueries.dimension_time_insert_events,
+            skip_unchanged=True,
+            db_conn_id="redshift",
+            mode="incremental",
+            windowed=True,
+            calendar_table=dimension_calendar,
+            calendar_days=366
+        )
+    },
+    {
+        "task_id": "create_and_populate_dim_user",
+        "table": dimension_user,
+        "sources": [song_events],
+        "operator": LoadDimensionOperator,
+        "kwargs": dict(
+            table=dimension_user,
+            raw_table=song_events,
+            create_func=SqlQueries.dimension_user_create,
+            insert_func=SqlQueries.dimension_user_insert_latest,
+            skip_unchanged=True,
+            db_conn_id="redshift",
+            mode="merge",
+            key_columns=("user_id",),
+            columns=("user_id", "first_name", "last_name", "gender", "level"),
+            windowed=True
+        )
+    },
+    {
+        "task_id": "create_and_populate_dim_artist",
+        "table": dimension_artist,
+        "sources": [staging_songs],
+        "operator": LoadDimensionOperator,
+        "kwargs": dict(
+            table=dimension_artist,
+            raw_table=staging_songs,
+            create_func=SqlQueries.dimension_artist_create,
+            insert_func=SqlQueries.dimension_artist_insert,
+            mode="merge",
+            key_columns=("artist_id",),
+            columns=("artist_id", "name", "location", "latitude", "longitude"),
+            skip_unchanged=True,
+            db_conn_id="redshift"
+        )
+    },
+    {
+        "task_id": "create_and_populate_dim_song",
+        "table": dimension_song,
+        "sources": [staging_songs],
+        "operator": LoadDimensionOperator,
+        "kwargs": dict(
+            table=dimension_song,
+            raw_table=staging_songs,
+            create_func=SqlQueries.dimension_song_create,
+            insert_func=SqlQueries.dimension_song_insert,
+            mode="merge",
+            key_columns=("song_id",),
+            columns=("song_id", "title", "artist_id", "year", "duration"),
+            skip_unchanged=True,
+            db_conn_id="redshift",
+        )
+    }
+]
 
-step_data_quality = DataQualityOperator(
-    task_id="data_quality_check",
-    dag=dag,
-    dims=dims,
-    db_conn_id="redshift",
-    test=SqlQueries.data_quality_check_unique,
-    retries=2,
-    skip=False
-)
+rollup_specs = [
+    {
+        "task_id": f"update_{table}",
+        "table": table,
+        "sources": [facts_table],
+        "operator": LoadRollupOperator,
+        "kwargs": dict(
+            table=table,
+            fact_table=facts_table,
+            create_func=create_func,
+            insert_func=insert_func,
+            bucket_column=bucket_column,
+            grain_ms=grain_ms,
+            incremental=True,
+            db_conn_id="redshift",
+            skip_unchanged=True
+        )
+    } for table, (create_func, insert_func, bucket_column, grain_ms) in rollups.items()
+]
+
+quality_specs = [
+    {
+        "task_id": "data_quality_check",
+        "table": quality_report,
+        "sources": [facts_table] + list(dims),
+        "operator": DataQualityOperator,
+        "kwargs": dict(
+            dims=dims,
+            fact=facts_table,
+            db_conn_id="redshift",
+            checks=default_checks(dims, facts_table, freshness_column="start_time", max_age_hours=24,
+                                  approximate=True),
+            retries=2,
+            skip=False
+        )
+    }
+]
+
+maintenance_specs = [
+    {
+        "task_id": "table_maintenance",
+        "table": None,
+        "sources": [quality_report] + list(rollups),
+        "operator": TableMaintenanceOperator,
+        "kwargs": dict(
+            db_conn_id="redshift",
+            tables=([facts_table] + list(dims) + list(rollups) +
+                    [dimension_calendar, staging_songs, song_match_keys, song_events]),
+            thresholds={"unsorted": 10.0, "stats_off": 10.0, "deleted": 10.0},
+            time_budget=1800,
+            skip=False
+        )
+    }
+]
 
+table_specs = (compaction_specs + validation_specs + staging_specs + events_specs + fact_specs + dimension_specs +
+               rollup_specs + quality_specs + maintenance_specs)
 
 """
-EXIT STAGE
+DAG ORDER DEFINITION. INFERRED FROM THE LINEAGE, IT IS:
+
+                                     STAGE_SONGS ------------------|-> LOAD_DIM_SONG   -|
+                                                                   |-> LOAD_DIM_ARTIST -|
+BEGIN_EXEC ->                                                      |-> LOAD_FACT       -|-> DATA_QUALITY_CHECK -|
+              (VALIDATE_LOGS) -> STAGE_LOGS -> EXTRACT_SONG_EVENTS -|-> LOAD_DIM_USER   -|                      |
+                                                                   |-> LOAD_DIM_TIME   -|                       |
+                                                   LOAD_FACT -> UPDATE_ROLLUP_* (SONG, ARTIST, LEVEL, HOUR) ----|
+                                                                               END_EXEC <- TABLE_MAINTENANCE <-|
+
 """
+step_begin_execution = DummyOperator(
+    task_id="begin_execution",
+    dag=dag
+)
+
 step_exit = DummyOperator(
     task_id="exit",
     dag=dag
 )
 
+tasks = build_tasks(dag, table_specs, begin=step_begin_execution, end=step_exit)
 
 """
-DAG ORDER DEFINITION. SHOULD BE:
-
-                                    LOAD_DIM_SONG       -|
-                STAGE_SONGS -|      LOAD_DIM_USER       -|
-BEGIN_EXEC ->                    ->                         -> DATA_QUALITY_CHECK -> END_EXEC
-                STAGE_LOGS  -|      LOAD_DIM_ARTIST     -|
-                                    LOAD_DIM_TIME       -|
+BACKFILL DAG. RELOADS THE DAYS BETWEEN SPARKIFY_BACKFILL_START AND SPARKIFY_BACKFILL_END IN A SINGLE, MANUALLY
+TRIGGERED RUN. EVERY DAY GETS ITS OWN GROUP (STAGING INTO A TABLE OF ITS OWN, SONG EVENTS, FACT MERGE), THE GROUPS
+RUN CONCURRENTLY UP TO SPARKIFY_BACKFILL_PARALLELISM TASKS, AND ONLY THE DIMENSION MERGES RUN ONE DAY AFTER THE
+OTHER, IN DATE ORDER, SO THE LATEST STATE OF EVERY USER WINS. THE ROLLUPS ARE RECOMPUTED ONCE, AFTER THE LAST FACT
+MERGE:
 
+                                       |-> LOAD_DIM_SONG, LOAD_DIM_ARTIST ----------------------------------|
+BEGIN -> STAGE_SONGS ------------------|-> LOAD_FACT_D1 ... LOAD_FACT_DN                                    |-> QUALITY
+BEGIN -> STAGE_LOGS_DX -> EXTRACT_DX --|-> LOAD_FACT_DX -------------------------------> DROP_PARTITION_DX  |
+                                       |-> LOAD_DIM_TIME_D1 -> LOAD_DIM_USER_D1 -> LOAD_DIM_TIME_D2 -> ... -|   -> MAINTENANCE
+                                       |-> LOAD_FACT_D1 ... LOAD_FACT_DN -> UPDATE_ROLLUP_* ----------------|
 """
-step_begin_execution >> step_stage_songs_into_db >> step_create_and_populate_facts_table \
-    >> step_create_and_populate_dim_artist >> step_data_quality >> step_exit
-step_begin_execution >> step_stage_songs_into_db >> step_create_and_populate_facts_table \
-    >> step_create_and_populate_dim_song >> step_data_quality >> step_exit
-step_begin_execution >> step_stage_songs_into_db >> step_create_and_populate_facts_table \
-    >> step_create_and_populate_dim_time >> step_data_quality >> step_exit
-step_begin_execution >> step_stage_songs_into_db >> step_create_and_populate_facts_table \
-    >> step_create_and_populate_dim_user >> step_data_quality >> step_exit
-
-step_begin_execution >> step_stage_logs_into_db >> step_create_and_populate_facts_table \
-    >> step_create_and_populate_dim_artist >> step_data_quality >> step_exit
-step_begin_execution >> step_stage_logs_into_db >> step_create_and_populate_facts_table \
-    >> step_create_and_populate_dim_song >> step_data_quality >> step_exit
-step_begin_execution >> step_stage_logs_into_db >> step_create_and_populate_facts_table \
-    >> step_create_and_populate_dim_time >> step_data_quality >> step_exit
-step_begin_execution >> step_stage_logs_into_db >> step_create_and_populate_facts_table \
-    >> step_create_and_populate_dim_user >> step_data_quality >> step_exit
+
+
+def backfill_day_specs(day):
+    """
+    Table specs of the group of a day. The staging and song events tables are scoped to the day: the logs are
+    loaded into the batch table of the day, logs_raw_data_YYYYMMDD, and the retention is left to the drop_partition
+    tasks, so a group does not drop the batch of an older day still being merged.
+    """
+    day_nodash = day.replace("-", "")
+    day_chunks = f"{log_chunks}_{day_nodash}"
+    day_logs = f"{staging_logs}_{day_nodash}"
+    day_events = f"{song_events}_{day_nodash}"
+    return [
+        {
+            "task_id": f"validate_logs_{day_nodash}",
+            "table": day_chunks,
+            "sources": [],
+            "operator": ValidateRecordsOperator,
+            "kwargs": dict(spec["kwargs"], partition=day)
+        } for spec in validation_specs
+    ] + [
+        {
+            "task_id": f"stage_logs_{day_nodash}",
+            "table": day_logs,
+            "sources": [day_chunks],
+            "operator": RedshiftStagingOperator,
+            "kwargs": dict(staging_specs[1]["kwargs"], retention_days=None, partition=day)
+        },
+        {
+            "task_id": f"extract_song_events_{day_nodash}",
+            "table": day_events,
+            "sources": [day_logs],
+            "operator": ExtractEventsOperator,
+            "kwargs": dict(events_specs[0]["kwargs"], table=day_events, retention_days=0, partition=day)
+        },
+        {
+            "task_id": f"create_and_populate_facts_table_{day_nodash}",
+            "table": None,
+            "sources": [staging_songs, day_events],
+            "operator": LoadFactOperator,
+            "kwargs": dict(fact_specs[0]["kwargs"], raw_logs_table=day_events, partition=day)
+        },
+        {
+            "task_id": f"create_and_populate_dim_time_{day_nodash}",
+            "table": None,
+            "sources": [day_events],
+            "operator": LoadDimensionOperator,
+            "kwargs": dict(dimension_specs[0]["kwargs"], raw_table=day_events, partition=day)
+        },
+        {
+            "task_id": f"create_and_populate_dim_user_{day_nodash}",
+            "table": None,
+            "sources": [day_events],
+            "operator": LoadDimensionOperator,
+            "kwargs": dict(dimension_specs[1]["kwargs"], raw_table=day_events, partition=day)
+        },
+    ]
+
+
+if BACKFILL_START:
+    backfill_dag = DAG(
+        "sparkify_backfill",
+        max_active_runs=1,
+        concurrency=BACKFILL_PARALLELISM,
+        default_args=default_args,
+        schedule_interval=None,
+        catchup=False
+    )
+    backfill_begin = DummyOperator(task_id="begin_execution", dag=backfill_dag)
+    backfill_exit = DummyOperator(task_id="exit", dag=backfill_dag)
+    backfill_songs = build_tasks(backfill_dag, compaction_specs + staging_specs[:1] + dimension_specs[2:],
+                                 begin=backfill_begin)
+    backfill_rollup_specs = [dict(spec, kwargs=dict(spec["kwargs"], incremental=False)) for spec in rollup_specs]
+    backfill_final = build_tasks(backfill_dag, backfill_rollup_specs + quality_specs + maintenance_specs,
+                                 end=backfill_exit)
+    backfill_quality = backfill_final["data_quality_check"]
+    backfill_rollups = [backfill_final[spec["task_id"]] for spec in backfill_rollup_specs]
+    for task_id in ("create_and_populate_dim_artist", "create_and_populate_dim_song"):
+        backfill_songs[task_id] >> backfill_quality
+
+    previous_dimension = None
+    first_fact = None
+    for backfill_day in partition_days(BACKFILL_START, BACKFILL_END, f"{LOCAL_DATA}/log-data" if LOCAL_DATA else ""):
+        day_specs = backfill_day_specs(backfill_day)
+        day_tasks = build_tasks(backfill_dag, day_specs, begin=backfill_begin)
+        fact, dim_time, dim_user = [day_tasks[spec["task_id"]] for spec in day_specs[-3:]]
+        backfill_songs["stage_songs_into_db"] >> fact
+        fact >> backfill_rollups
+        # The first fact merge creates the fact table, so the concurrent merges do not race to create it.
+        if first_fact is None:
+            first_fact = fact
+        else:
+            first_fact >> fact
+        # The dimension merges of the days are chained in date order, the rest of the groups run concurrently.
+        if previous_dimension is not None:
+            previous_dimension >> dim_time
+        dim_time >> dim_user
+        previous_dimension = dim_user
+        drop_partition = PostgresOperator(
+            task_id=f"drop_partition_{backfill_day.replace('-', '')}",
+            postgres_conn_id="redshift",
+            sql=[SqlQueries.delete_table(spec["table"]) for spec in day_specs[-5:-3]],
+            dag=backfill_dag
+        )
+        [fact, dim_user] >> drop_partition
+        drop_partition >> backfill_quality
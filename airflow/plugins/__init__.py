@@ -13,7 +13,12 @@ class UdacityPlugin(AirflowPlugin):
         operators.RedshiftStagingOperator,
         operators.LoadFactOperator,
         operators.LoadDimensionOperator,
-        operators.DataQualityOperator
+        operators.DataQualityOperator,
+        operators.CompactFilesOperator,
+        operators.ExtractEventsOperator,
+        operators.ValidateRecordsOperator,
+        operators.TableMaintenanceOperator,
+        operators.LoadRollupOperator
     ]
     helpers = [
         helpers.SqlQueries
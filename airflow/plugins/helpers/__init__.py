@@ -1,5 +1,97 @@
 from helpers.queries import SqlQueries
+from helpers.s3_ledger import (list_s3_objects, pending_objects, ledger_entries, build_copy_manifest, replaced_loads,
+                               reloaded_keys, read_ledger, add_load_key)
+from helpers.dialects import is_redshift, adapt_sql
+from helpers.local_loader import (STAGING_COLUMNS, list_source_objects, iter_json_records, iter_staging_lines, copy_lines,
+                                  record_fields)
+from helpers.staging_schema import (StagingColumn, StagingSchema, STAGING_SCHEMAS, WIDTHS_KEY, sample_widths,
+                                    schema_widths, apply_widths)
+from helpers.checkpoints import plan_load_chunks, chunk_manifest
+from helpers.compaction import plan_chunks, chunk_etag, compact_files
+from helpers.conversion import OUTPUT_FORMATS, convert_files, copy_converted
+from helpers.validation import record_errors, validate_files
+from helpers.match_keys import match_key, normalized_text
+from helpers.batch_window import (HOUR_MS, DAY_MS, epoch_ms, execution_window, window_filter, align_window,
+                                  calendar_hours, partition_context, partition_days, batch_table, expired_batches)
+from helpers.quality_checks import CheckResult, default_checks, run_checks, stream_column
+from helpers.hll import HyperLogLog
+from helpers.fingerprints import (FINGERPRINT_KEY, SKIP_REASON_KEY, objects_fingerprint, combine_fingerprints,
+                                  derived_fingerprint, check_fingerprint, save_fingerprint)
+from helpers.maintenance import TableHealth, MaintenanceTask, DEFAULT_THRESHOLDS, health_query, plan_maintenance
+from helpers.lineage import infer_dependencies, critical_path, build_tasks
+from helpers.instrumentation import StatsdClient, InstrumentedHook, instrument, publish_metrics, record_metric
 
 __all__ = [
     'SqlQueries',
+    'list_s3_objects',
+    'pending_objects',
+    'ledger_entries',
+    'replaced_loads',
+    'reloaded_keys',
+    'read_ledger',
+    'add_load_key',
+    'build_copy_manifest',
+    'is_redshift',
+    'adapt_sql',
+    'STAGING_COLUMNS',
+    'list_source_objects',
+    'iter_json_records',
+    'iter_staging_lines',
+    'copy_lines',
+    'record_fields',
+    'StagingColumn',
+    'StagingSchema',
+    'STAGING_SCHEMAS',
+    'WIDTHS_KEY',
+    'sample_widths',
+    'schema_widths',
+    'apply_widths',
+    'plan_load_chunks',
+    'chunk_manifest',
+    'plan_chunks',
+    'chunk_etag',
+    'compact_files',
+    'OUTPUT_FORMATS',
+    'convert_files',
+    'copy_converted',
+    'record_errors',
+    'validate_files',
+    'match_key',
+    'normalized_text',
+    'epoch_ms',
+    'execution_window',
+    'window_filter',
+    'align_window',
+    'HOUR_MS',
+    'DAY_MS',
+    'calendar_hours',
+    'partition_context',
+    'partition_days',
+    'batch_table',
+    'expired_batches',
+    'CheckResult',
+    'default_checks',
+    'run_checks',
+    'stream_column',
+    'HyperLogLog',
+    'FINGERPRINT_KEY',
+    'SKIP_REASON_KEY',
+    'objects_fingerprint',
+    'combine_fingerprints',
+    'derived_fingerprint',
+    'check_fingerprint',
+    'save_fingerprint',
+    'TableHealth',
+    'MaintenanceTask',
+    'DEFAULT_THRESHOLDS',
+    'health_query',
+    'plan_maintenance',
+    'infer_dependencies',
+    'critical_path',
+    'build_tasks',
+    'StatsdClient',
+    'InstrumentedHook',
+    'instrument',
+    'publish_metrics',
+    'record_metric',
 ]
\ No newline at end of file
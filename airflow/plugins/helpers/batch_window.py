@@ -0,0 +1,128 @@
+import datetime
+import os
+import re
+
+HOUR_MS = 3600 * 1000
+DAY_MS = 24 * HOUR_MS
+_LOG_FILE_DATE = re.compile(r"^(\d{4}-\d{2}-\d{2})-events\.json(\.gz)?$")
+
+
+def epoch_ms(dt):
+    """
+    Converts a datetime into epoch milliseconds, the unit of the ts column of the logs.
+    :param dt: Timezone aware datetime (naive datetimes are taken as UTC).
+    :return: Integer epoch milliseconds.
+    """
+    if dt.tzinfo is None:
+        dt = dt.replace(tzinfo=datetime.timezone.utc)
+    return int(dt.timestamp() * 1000)
+
+
+def execution_window(context):
+    """
+    Returns the window of event timestamps covered by a run, from its execution_date to its next_execution_date.
+    :param context:
+    :return: Tuple with the start (inclusive) and end (exclusive) of the window, in epoch milliseconds.
+    """
+    return epoch_ms(context["execution_date"]), epoch_ms(context["next_execution_date"])
+
+
+def window_filter(column, window):
+    """
+    Builds the SQL condition that restricts an epoch milliseconds column to a window.
+    :param column: BIGINT column (or expression) holding epoch milliseconds, like the ts column of the logs.
+    :param window: Tuple with the start and end of the window, or None for no restriction.
+    :return: The condition, or TRUE if there is no window.
+    """
+    if window is None:
+        return "TRUE"
+    start, end = window
+    return f"{column} >= {start} AND {column} < {end}"
+
+
+def align_window(window, grain_ms):
+    """
+    Widens a window to whole buckets of a grain, so every bucket it touches is covered in full.
+    :param window: Tuple with the start and end of the window, in epoch milliseconds, or None.
+    :param grain_ms: Size of a bucket in milliseconds, like HOUR_MS or DAY_MS.
+    :return: The widened window, or None if there is no window.
+    """
+    if window is None:
+        return None
+    start, end = window
+    return start - start % grain_ms, end + (-end) % grain_ms
+
+
+def calendar_hours(start, end):
+    """
+    Computes the calendar attributes of every hour of a range, with the same conventions as EXTRACT (ISO week,
+    weekday 0 for Sunday).
+    :param start: Start of the range (inclusive), in epoch milliseconds. Rounded down to the hour.
+    :param end: End of the range (exclusive), in epoch milliseconds.
+    :return: List of (hour_start, hour, day, week, month, year, weekday) tuples, hour_start in epoch milliseconds.
+    """
+    hours = []
+    for hour_start in range(start - start % HOUR_MS, end, HOUR_MS):
+        dt = datetime.datetime.fromtimestamp(hour_start / 1000, tz=datetime.timezone.utc)
+        hours.append((hour_start, dt.hour, dt.day, dt.isocalendar()[1], dt.month, dt.year, (dt.weekday() + 1) % 7))
+    return hours
+
+
+def partition_context(context, partition):
+    """
+    Scopes a context to a one-day partition, as if the run had been scheduled for that day: execution_date,
+    next_execution_date, ds, ds_nodash, ts and ts_nodash are replaced, so the keys, paths and windows rendered from
+    the context point to the partition.
+    :param context:
+    :param partition: Day of the partition, as YYYY-MM-DD. If empty, the context is returned as it is.
+    :return: The scoped context.
+    """
+    if not partition:
+        return context
+    day = datetime.datetime.strptime(partition, "%Y-%m-%d").replace(tzinfo=datetime.timezone.utc)
+    scoped = dict(context)
+    scoped.update(execution_date=day, next_execution_date=day + datetime.timedelta(days=1), ds=partition,
+                  ds_nodash=day.strftime("%Y%m%d"), ts=day.isoformat(), ts_nodash=day.strftime("%Y%m%dT%H%M%S"))
+    return scoped
+
+
+def partition_days(start, end, log_dir=""):
+    """
+    Lists the days of a range, following the YYYY-MM-DD-events.json naming of the log files.
+    :param start: First day, as YYYY-MM-DD.
+    :param end: Last day (inclusive), as YYYY-MM-DD.
+    :param log_dir: Optional local directory with the log files. If set, only the days with a file are returned.
+    :return: Sorted list of days, as YYYY-MM-DD.
+    """
+    first = datetime.date.fromisoformat(start)
+    last = datetime.date.fromisoformat(end)
+    days = [(first + datetime.timedelta(days=i)).isoformat() for i in range((last - first).days + 1)]
+    if log_dir and os.path.isdir(log_dir):
+        available = {match.group(1) for match in map(_LOG_FILE_DATE.match, os.listdir(log_dir)) if match}
+        days = [day for day in days if day in available]
+    return days
+
+
+def batch_table(table, batch_id):
+    """
+    Name of the table holding one batch of a batch-scoped staging table.
+    :param table: Base name of the staging table.
+    :param batch_id: Id of the batch, the ds_nodash (YYYYMMDD) of the run.
+    :return: The table name.
+    """
+    return f"{table}_{batch_id}"
+
+
+def expired_batches(table, tables, batch_id, retention_days):
+    """
+    Picks the batch tables of a staging table that fall out of the retention, relative to the current batch.
+    :param table: Base name of the staging table.
+    :param tables: Names of the existing tables, as listed by SqlQueries.batch_tables.
+    :param batch_id: Id of the current batch, as YYYYMMDD.
+    :param retention_days: Number of days of batches kept before the current one.
+    :return: Sorted list of the table names to drop.
+    """
+    pattern = re.compile(rf"^{re.escape(table.lower())}_(\d{{8}})$")
+    oldest = datetime.datetime.strptime(batch_id, "%Y%m%d") - datetime.timedelta(days=retention_days)
+    matches = [(name, pattern.match(name.lower())) for name in tables]
+    return sorted(name for name, match in matches if match and match.group(1) < oldest.strftime("%Y%m%d"))
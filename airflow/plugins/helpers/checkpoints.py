@@ -0,0 +1,30 @@
+import hashlib
+import json
+
+
+def plan_load_chunks(objects, chunk_size):
+    """
+    Splits the files of a load into chunks of chunk_size files, in key order, and fingerprints every chunk from the
+    keys and etags of its files, so a retry of the same run finds the same chunks.
+    :param objects: List of objects as returned by list_source_objects.
+    :param chunk_size: Number of files per chunk.
+    :return: List of (chunk_id, objects) tuples.
+    """
+    objects = sorted(objects, key=lambda obj: obj["key"])
+    chunks = []
+    for start in range(0, len(objects), chunk_size):
+        chunk = objects[start:start + chunk_size]
+        digest = hashlib.sha1("\n".join(f"{obj['key']} {obj['etag']}" for obj in chunk).encode("utf-8"))
+        chunks.append((digest.hexdigest()[:16], chunk))
+    return chunks
+
+
+def chunk_manifest(objects):
+    """
+    Builds a Redshift COPY manifest for a chunk of files given by their full s3 paths. The content length is set
+    for every entry, as COPY requires it for Parquet files.
+    :param objects: List of objects as returned by list_source_objects for an s3 source.
+    :return: The manifest as a json string.
+    """
+    entries = [{"url": obj["key"], "mandatory": True, "meta": {"content_length": obj["size"]}} for obj in objects]
+    return json.dumps({"entries": entries})
@@ -0,0 +1,179 @@
+import gzip
+import hashlib
+import io
+import json
+import math
+import os
+from concurrent.futures import ProcessPoolExecutor
+
+from helpers.local_loader import split_s3_path, iter_object_lines, manifest_sources_path
+
+
+def plan_chunks(objects, slices, target_chunk_size):
+    """
+    Groups small files into chunks of roughly target_chunk_size bytes (uncompressed). The number of chunks is
+    always a multiple of the number of slices, so every slice gets the same amount of files to load.
+    :param objects: List of objects as returned by list_source_objects.
+    :param slices: Number of slices of the cluster.
+    :param target_chunk_size: Target size of a chunk in bytes, before compression.
+    :return: List of chunks, every chunk being a list of keys.
+    """
+    slices = max(1, slices)
+    total_size = sum(obj["size"] for obj in objects)
+    n_chunks = max(1, math.ceil(total_size / target_chunk_size))
+    n_chunks = min(math.ceil(n_chunks / slices) * slices, max(len(objects), 1))
+    chunks = [[] for _ in range(n_chunks)]
+    sizes = [0] * n_chunks
+    for obj in sorted(objects, key=lambda obj: obj["size"], reverse=True):
+        smallest = sizes.index(min(sizes))
+        chunks[smallest].append(obj["key"])
+        sizes[smallest] += obj["size"]
+    return [sorted(chunk) for chunk in chunks if chunk]
+
+
+def chunk_etag(objects):
+    """
+    Fingerprints a chunk from the keys and etags of its source files, so the same files always give the same chunk
+    name and etag, whatever the day the chunk is written.
+    :param objects: List of the objects of the chunk, as returned by list_source_objects.
+    :return: Hex md5 digest, the length of an s3 etag.
+    """
+    lines = sorted(f"{obj['key']} {obj['etag']}" for obj in objects)
+    return hashlib.md5("\n".join(lines).encode("utf-8")).hexdigest()
+
+
+def plan_named_chunks(objects, staging_prefix, slices, target_chunk_size, extension):
+    """
+    Plans the chunks of a set of files with plan_chunks, and names every chunk after its etag, so unchanged inputs
+    are written to the same paths.
+    :param objects: List of objects as returned by list_source_objects.
+    :param staging_prefix: Local directory or s3://bucket/prefix/ of the chunks, ending in /.
+    :param slices: Number of slices of the cluster.
+    :param target_chunk_size: Target size of a chunk in bytes, before compression.
+    :param extension: Extension of the chunk files.
+    :return: List of dicts with the keys, the sources, the etag and the destination of every chunk.
+    """
+    by_key = {obj["key"]: obj for obj in objects}
+    chunks = []
+    for keys in plan_chunks(objects, slices, target_chunk_size):
+        sources = [by_key[key] for key in keys]
+        etag = chunk_etag(sources)
+        chunks.append({"keys": keys, "sources": sources, "etag": etag,
+                       "destination": f"{staging_prefix}part-{etag[:16]}.{extension}"})
+    return chunks
+
+
+def _s3_client(client_kwargs):
+    import boto3
+    return boto3.client("s3", **client_kwargs)
+
+
+def compact_chunk(keys, destination, client_kwargs=None):
+    """
+    Merges a list of json-lines files into a single gzip-compressed json-lines file. The gzip header carries no
+    timestamp, so the same files always give the same bytes. Runs in a worker process, so it opens its own s3 client.
+    :param keys: Local paths or full s3 paths of the files to merge.
+    :param destination: Local path or full s3 path of the chunk.
+    :param client_kwargs: Keyword arguments for boto3.client, needed if any path is in s3.
+    :return: Dict with the destination, the number of records and the bytes read and written.
+    """
+    uses_s3 = destination.startswith("s3://") or any(key.startswith("s3://") for key in keys)
+    s3_client = _s3_client(client_kwargs or {}) if uses_s3 else None
+    buffer = io.BytesIO()
+    records = 0
+    bytes_in = 0
+    with gzip.GzipFile(fileobj=buffer, mode="wb", mtime=0) as gz:
+        for key in keys:
+            for line in iter_object_lines(key, s3_client):
+                line = line.strip()
+                if not line:
+                    continue
+                data = (line + "\n").encode("utf-8")
+                bytes_in += len(data)
+                records += 1
+                gz.write(data)
+    payload = buffer.getvalue()
+    write_object(destination, payload, s3_client)
+    return {"url": destination, "records": records, "bytes_in": bytes_in, "bytes_out": len(payload)}
+
+
+def write_object(destination, payload, s3_client=None):
+    """
+    Writes bytes to a local path or to s3.
+    :param destination: Local path or full s3 path.
+    :param payload: Bytes to write.
+    :param s3_client: boto3 s3 client, only needed for s3 destinations.
+    :return:
+    """
+    if destination.startswith("s3://"):
+        bucket, key = split_s3_path(destination)
+        s3_client.put_object(Bucket=bucket, Key=key, Body=payload)
+    else:
+        os.makedirs(os.path.dirname(destination) or ".", exist_ok=True)
+        with open(destination, "wb") as f:
+            f.write(payload)
+
+
+def delete_object(path, s3_client=None):
+    """
+    Deletes a local file or an s3 object, if it exists.
+    :param path: Local path or full s3 path.
+    :param s3_client: boto3 s3 client, only needed for s3 paths.
+    :return:
+    """
+    if path.startswith("s3://"):
+        bucket, key = split_s3_path(path)
+        s3_client.delete_object(Bucket=bucket, Key=key)
+    elif os.path.exists(path):
+        os.remove(path)
+
+
+def write_manifest(results, staging_prefix, client_kwargs=None):
+    """
+    Writes the COPY manifest of the chunks written under a prefix. When the results carry the etag and the source
+    files of their chunk, they are written next to the manifest (chunks.sources.json), for read_manifest_objects.
+    Otherwise the sources file of an earlier manifest is deleted, so it is not read for chunks it does not describe.
+    :param results: List of chunk results, with their url and bytes_out, and optionally their etag and sources.
+    :param staging_prefix: Local directory or s3://bucket/prefix/ of the chunks.
+    :param client_kwargs: Keyword arguments for boto3.client, needed for s3 prefixes.
+    :return: The path of the manifest.
+    """
+    manifest = json.dumps({"entries": [
+        {"url": result["url"], "mandatory": True, "meta": {"content_length": result["bytes_out"]}}
+        for result in results
+    ]})
+    manifest_path = f"{staging_prefix}chunks.manifest"
+    s3_client = _s3_client(client_kwargs or {}) if manifest_path.startswith("s3://") else None
+    write_object(manifest_path, manifest.encode("utf-8"), s3_client)
+    if results and all("sources" in result for result in results):
+        sources = {result["url"]: {"etag": result["etag"], "sources": result["sources"]} for result in results}
+        write_object(manifest_sources_path(manifest_path), json.dumps(sources).encode("utf-8"), s3_client)
+    else:
+        delete_object(manifest_sources_path(manifest_path), s3_client)
+    return manifest_path
+
+
+def compact_files(objects, staging_prefix, slices=1, target_chunk_size=64 * 1024 * 1024, workers=None,
+                  client_kwargs=None):
+    """
+    Compacts small files into gzip-compressed chunks with a process pool, and writes a COPY manifest for them. The
+    chunks are named after the etag of their source files (see chunk_etag), so compacting the same files into the
+    same prefix again rewrites the same chunks byte for byte.
+    :param objects: List of objects as returned by list_source_objects.
+    :param staging_prefix: Local directory or s3://bucket/prefix/ where the chunks and the manifest are written.
+    :param slices: Number of slices of the cluster.
+    :param target_chunk_size: Target size of a chunk in bytes, before compression.
+    :param workers: Number of worker processes. Defaults to the number of cpus.
+    :param client_kwargs: Keyword arguments for boto3.client, needed for s3 sources or destinations.
+    :return: Tuple with the manifest path and the list of chunk results.
+    """
+    if not staging_prefix.endswith("/"):
+        staging_prefix += "/"
+    chunks = plan_named_chunks(objects, staging_prefix, slices, target_chunk_size, "json.gz")
+    with ProcessPoolExecutor(max_workers=workers) as executor:
+        futures = [executor.submit(compact_chunk, chunk["keys"], chunk["destination"], client_kwargs)
+                   for chunk in chunks]
+        results = [future.result() for future in futures]
+    for chunk, result in zip(chunks, results):
+        result.update(etag=chunk["etag"], sources=chunk["sources"])
+    return write_manifest(results, staging_prefix, client_kwargs), results
@@ -0,0 +1,221 @@
+import gzip
+import io
+import json
+from concurrent.futures import ProcessPoolExecutor
+
+from helpers.compaction import plan_named_chunks, write_object, write_manifest, _s3_client
+from helpers.local_loader import split_s3_path, iter_object_lines, format_value, copy_lines
+from helpers.staging_schema import column_kind
+
+OUTPUT_FORMATS = ("csv", "parquet")
+EXTENSIONS = {"csv": "csv.gz", "parquet": "parquet"}
+_INTEGER_TYPES = ("SMALLINT", "INTEGER", "BIGINT")
+
+
+def typed_value(value, column):
+    """
+    Converts a json value into the python value of its staging column. Empty strings of numeric columns are NULL,
+    as with COPY.
+    :param value: Value read from the json record.
+    :param column: StagingColumn.
+    :return: str, int, float or None
+    """
+    if value is None:
+        return None
+    if column.sql_type == "VARCHAR":
+        return str(value)
+    if value == "":
+        return None
+    if column.sql_type in _INTEGER_TYPES:
+        return int(float(value)) if isinstance(value, str) and "." in value else int(value)
+    return float(value)
+
+
+def iter_rows(keys, columns, fields, s3_client=None):
+    """
+    Streams the records of json-lines files as rows of typed values, in column order.
+    :param keys: Local paths or full s3 paths of the files.
+    :param columns: StagingColumns of the staging table.
+    :param fields: Json field read for every column (see local_loader.record_fields).
+    :param s3_client: boto3 s3 client, only needed for s3 files.
+    :return: Generator of lists.
+    """
+    mapping = list(zip(columns, fields))
+    for key in keys:
+        for line in iter_object_lines(key, s3_client):
+            line = line.strip()
+            if line:
+                record = json.loads(line)
+                yield [typed_value(record.get(field), column) for column, field in mapping]
+
+
+def _arrow_schema(columns):
+    import pyarrow as pa
+    types = {"VARCHAR": pa.string(), "SMALLINT": pa.int16(), "INTEGER": pa.int32(), "BIGINT": pa.int64(),
+             "DOUBLE PRECISION": pa.float64()}
+    return pa.schema([(column.name, types[column.sql_type]) for column in columns])
+
+
+def csv_field(value):
+    """
+    Formats a value as a CSV field. NULLs are unquoted empty fields and strings are always quoted (the csv module
+    quotes None too under QUOTE_NONNUMERIC). Both COPYs load empty fields as NULL: Postgres does it for unquoted
+    fields in csv format, Redshift needs EMPTYASNULL (see SqlQueries.staging_table_copy_converted).
+    :param value: str, int, float or None
+    :return: The field.
+    """
+    if value is None:
+        return ""
+    if isinstance(value, str):
+        return '"' + value.replace('"', '""') + '"'
+    return str(value)
+
+
+def write_csv(rows):
+    """
+    Writes rows as gzip-compressed CSV.
+    :param rows: Iterable of rows.
+    :return: Tuple with the compressed bytes and the number of rows.
+    """
+    buffer = io.BytesIO()
+    count = 0
+    lines = []
+    with gzip.GzipFile(fileobj=buffer, mode="wb", mtime=0) as gz:
+        for row in rows:
+            lines.append(",".join(csv_field(value) for value in row))
+            count += 1
+            if len(lines) == 1000:
+                gz.write(("\n".join(lines) + "\n").encode("utf-8"))
+                lines = []
+        if lines:
+            gz.write(("\n".join(lines) + "\n").encode("utf-8"))
+    return buffer.getvalue(), count
+
+
+def write_parquet(rows, columns, row_group_size=100000):
+    """
+    Writes rows as a snappy-compressed Parquet file, in row groups of row_group_size rows. Needs pyarrow.
+    :param rows: Iterable of rows.
+    :param columns: StagingColumns of the staging table.
+    :param row_group_size: Number of rows per row group.
+    :return: Tuple with the file bytes and the number of rows.
+    """
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+    schema = _arrow_schema(columns)
+    buffer = io.BytesIO()
+    count = 0
+    with pq.ParquetWriter(buffer, schema, compression="snappy") as writer:
+        batch = []
+        for row in rows:
+            batch.append(row)
+            if len(batch) == row_group_size:
+                writer.write_table(pa.Table.from_arrays([list(values) for values in zip(*batch)], schema=schema))
+                count += len(batch)
+                batch = []
+        if batch:
+            writer.write_table(pa.Table.from_arrays([list(values) for values in zip(*batch)], schema=schema))
+            count += len(batch)
+    return buffer.getvalue(), count
+
+
+def convert_chunk(keys, destination, columns, fields, output_format, client_kwargs=None):
+    """
+    Converts a list of json-lines files into a single gzip CSV or Parquet file, in the column order of the staging
+    table. Runs in a worker process, so it opens its own s3 client.
+    :param keys: Local paths or full s3 paths of the files to convert.
+    :param destination: Local path or full s3 path of the converted file.
+    :param columns: StagingColumns of the staging table.
+    :param fields: Json field read for every column.
+    :param output_format: csv or parquet
+    :param client_kwargs: Keyword arguments for boto3.client, needed if any path is in s3.
+    :return: Dict with the destination, the number of records and the bytes read and written.
+    """
+    uses_s3 = destination.startswith("s3://") or any(key.startswith("s3://") for key in keys)
+    s3_client = _s3_client(client_kwargs or {}) if uses_s3 else None
+    if output_format == "csv":
+        payload, records = write_csv(iter_rows(keys, columns, fields, s3_client))
+    elif output_format == "parquet":
+        payload, records = write_parquet(iter_rows(keys, columns, fields, s3_client), columns)
+    else:
+        raise ValueError(f"Unknown output format {output_format}, expected one of {OUTPUT_FORMATS}.")
+    write_object(destination, payload, s3_client)
+    return {"url": destination, "records": records, "bytes_out": len(payload)}
+
+
+def convert_files(objects, staging_prefix, schema, fields, output_format="csv", slices=1,
+                  target_chunk_size=64 * 1024 * 1024, workers=None, client_kwargs=None):
+    """
+    Converts json files into gzip CSV or Parquet chunks with a process pool, and writes a COPY manifest for them.
+    :param objects: List of objects as returned by list_source_objects.
+    :param staging_prefix: Local directory or s3://bucket/prefix/ where the chunks and the manifest are written.
+    :param schema: StagingSchema of the staging table.
+    :param fields: Json field read for every column (the jsonpaths mapping for the logs).
+    :param output_format: csv or parquet
+    :param slices: Number of slices of the cluster.
+    :param target_chunk_size: Target size of a chunk in bytes, before conversion.
+    :param workers: Number of worker processes. Defaults to the number of cpus.
+    :param client_kwargs: Keyword arguments for boto3.client, needed for s3 sources or destinations.
+    :return: Tuple with the manifest path and the list of chunk results.
+    """
+    if not staging_prefix.endswith("/"):
+        staging_prefix += "/"
+    chunks = plan_named_chunks(objects, staging_prefix, slices, target_chunk_size, EXTENSIONS[output_format])
+    with ProcessPoolExecutor(max_workers=workers) as executor:
+        futures = [executor.submit(convert_chunk, chunk["keys"], chunk["destination"], schema.columns, fields,
+                                   output_format, client_kwargs)
+                   for chunk in chunks]
+        results = [future.result() for future in futures]
+    for chunk, result in zip(chunks, results):
+        result.update(bytes_in=sum(obj["size"] for obj in chunk["sources"]), etag=chunk["etag"],
+                      sources=chunk["sources"])
+    return write_manifest(results, staging_prefix, client_kwargs), results
+
+
+def _open_object(key, s3_client=None):
+    if key.startswith("s3://"):
+        bucket, s3_key = split_s3_path(key)
+        return io.BytesIO(s3_client.get_object(Bucket=bucket, Key=s3_key)["Body"].read())
+    return open(key, "rb")
+
+
+def iter_parquet_lines(key, columns, s3_client=None):
+    """
+    Reads a Parquet file back, row group after row group, as lines of the COPY text format.
+    :param key: Local path or full s3 path of the file.
+    :param columns: StagingColumns of the staging table.
+    :param s3_client: boto3 s3 client, only needed for s3 files.
+    :return: Generator of lines.
+    """
+    import pyarrow.parquet as pq
+    kinds = [column_kind(column) for column in columns]
+    with _open_object(key, s3_client) as source:
+        parquet_file = pq.ParquetFile(source)
+        for group in range(parquet_file.num_row_groups):
+            for row in parquet_file.read_row_group(group).to_pylist():
+                yield "\t".join(format_value(row[column.name], kind) for column, kind in zip(columns, kinds)) + "\n"
+
+
+def copy_converted(conn, table, columns, keys, output_format, s3_client=None, batch_size=10000):
+    """
+    Loads converted files into a plain Postgres database. The CSV files are streamed as they are through
+    COPY FROM STDIN WITH (FORMAT csv), the Parquet files through copy_lines. Does not commit.
+    :param conn: psycopg2 connection.
+    :param table: Target table.
+    :param columns: StagingColumns of the staging table.
+    :param keys: Local paths or full s3 paths of the converted files.
+    :param output_format: csv or parquet
+    :param s3_client: boto3 s3 client, only needed for s3 files.
+    :param batch_size: Number of lines per buffer, for the Parquet files.
+    :return: Number of rows loaded.
+    """
+    names = [column.name for column in columns]
+    total = 0
+    for key in keys:
+        if output_format == "parquet":
+            total += copy_lines(conn, table, names, iter_parquet_lines(key, columns, s3_client), batch_size)
+            continue
+        with _open_object(key, s3_client) as raw, gzip.GzipFile(fileobj=raw) as source, conn.cursor() as cursor:
+            cursor.copy_expert(f"COPY {table} ({', '.join(names)}) FROM STDIN WITH (FORMAT csv)", source)
+            total += cursor.rowcount
+    return total
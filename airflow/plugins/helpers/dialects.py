@@ -0,0 +1,47 @@
+import re
+
+REDSHIFT_HOST_SUFFIX = "redshift.amazonaws.com"
+
+_POSTGRES_REWRITES = [
+    (re.compile(r"\bBIGINT\s+IDENTITY\s*\([^)]*\)", re.IGNORECASE), "BIGSERIAL"),
+    (re.compile(r"\bINTEGER\s+IDENTITY\s*\([^)]*\)", re.IGNORECASE), "SERIAL"),
+    (re.compile(r"\b(COMPOUND\s+|INTERLEAVED\s+)?SORTKEY\s*\([^)]*\)", re.IGNORECASE), ""),
+    (re.compile(r"\bDISTKEY\s*\([^)]*\)", re.IGNORECASE), ""),
+    (re.compile(r"\bDISTSTYLE\s+\w+", re.IGNORECASE), ""),
+    (re.compile(r"[ \t]+ENCODE\s+\w+", re.IGNORECASE), ""),
+    (re.compile(r"[ \t]+(DISTKEY|SORTKEY)\b", re.IGNORECASE), ""),
+    (re.compile(r"\bGETDATE\(\)", re.IGNORECASE), "now()"),
+    (re.compile(r"\bFNV_HASH\(", re.IGNORECASE), "hashtextextended("),
+]
+
+
+def is_redshift(db):
+    """
+    Tells whether a hook points to Redshift or to a plain Postgres database.
+    :param db: PostgresHook to the database.
+    :return: True if the connection type is redshift or the host is a Redshift endpoint.
+    """
+    conn = db.get_connection(db.postgres_conn_id)
+    return conn.conn_type == "redshift" or REDSHIFT_HOST_SUFFIX in (conn.host or "")
+
+
+def postgres_compatible(sql):
+    """
+    Strips the Redshift only clauses (DISTSTYLE, DISTKEY, SORTKEY, ENCODE, IDENTITY) from a statement, and maps
+    its Redshift only functions (GETDATE, FNV_HASH) to their Postgres counterparts.
+    :param sql: Statement written for Redshift.
+    :return: The same statement, runnable on Postgres.
+    """
+    for pattern, replacement in _POSTGRES_REWRITES:
+        sql = pattern.sub(replacement, sql)
+    return sql
+
+
+def adapt_sql(sql, redshift):
+    """
+    Adapts a statement to the dialect of the target database.
+    :param sql: Statement written for Redshift.
+    :param redshift: Bool, whether the target database is Redshift.
+    :return: The statement to run.
+    """
+    return sql if redshift else postgres_compatible(sql)
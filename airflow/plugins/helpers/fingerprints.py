@@ -0,0 +1,112 @@
+import datetime
+import hashlib
+import json
+
+from helpers.dialects import is_redshift, adapt_sql
+from helpers.queries import SqlQueries
+
+FINGERPRINT_KEY = "input_fingerprint"
+SKIP_REASON_KEY = "skip_reason"
+
+
+def objects_fingerprint(objects):
+    """
+    Fingerprints a listing of source files from their keys, etags and sizes, so it changes whenever a file is added,
+    removed or rewritten, but not when the same files are listed again.
+    :param objects: List of objects as returned by list_source_objects.
+    :return: Hex sha1 digest.
+    """
+    lines = sorted(f"{obj['key']} {obj['etag']} {obj['size']}" for obj in objects)
+    return hashlib.sha1("\n".join(lines).encode("utf-8")).hexdigest()
+
+
+def combine_fingerprints(inputs):
+    """
+    Fingerprints the inputs of a task: the fingerprints of its upstream tasks and the settings that change its
+    output, like the target table or the window of the run.
+    :param inputs: Dictionary with json serializable values.
+    :return: Hex sha1 digest.
+    """
+    return hashlib.sha1(json.dumps(inputs, sort_keys=True, default=str).encode("utf-8")).hexdigest()
+
+
+def upstream_fingerprints(operator, context):
+    """
+    Reads the fingerprints and skip reasons pushed to XCom by the upstream tasks of an operator in the current run.
+    :param operator: The operator.
+    :param context:
+    :return: Tuple with a dictionary of the upstream fingerprints and one of the skip reasons, by task_id. The first
+    is None if any upstream task did not push a fingerprint, as the inputs of the operator are then unknown.
+    """
+    task_instance = context.get("ti") or context.get("task_instance")
+    task_ids = sorted(operator.upstream_task_ids)
+    if task_instance is None or not task_ids:
+        return None, {}
+    fingerprints = {task_id: task_instance.xcom_pull(task_ids=task_id, key=FINGERPRINT_KEY) for task_id in task_ids}
+    reasons = {task_id: task_instance.xcom_pull(task_ids=task_id, key=SKIP_REASON_KEY) for task_id in task_ids}
+    reasons = {task_id: reason for task_id, reason in reasons.items() if reason}
+    if any(fingerprint is None for fingerprint in fingerprints.values()):
+        return None, reasons
+    return fingerprints, reasons
+
+
+def derived_fingerprint(operator, context, settings):
+    """
+    Fingerprints an operator that reads the tables of its upstream tasks from their fingerprints and its settings.
+    :param operator: The operator.
+    :param context:
+    :param settings: Dictionary with the settings that change the output of the operator.
+    :return: Tuple with the fingerprint (None if an upstream fingerprint is missing) and the upstream skip reasons.
+    """
+    fingerprints, reasons = upstream_fingerprints(operator, context)
+    if fingerprints is None:
+        return None, reasons
+    return combine_fingerprints({"upstream": fingerprints, "settings": settings}), reasons
+
+
+def check_fingerprint(operator, db, context, fingerprint, table="", upstream_reasons=None):
+    """
+    Compares the fingerprint of an operator's inputs with the one of its last successful run, stored in the
+    operator's state_table, and pushes the fingerprint and the skip reason to XCom (keys input_fingerprint and
+    skip_reason) for the downstream tasks.
+    :param operator: The operator. Uses its state_table and task_id.
+    :param db: PostgresHook to the database.
+    :param context:
+    :param fingerprint: Fingerprint of the inputs of the run, or None if they are unknown.
+    :param table: Optional table the operator produces. The work is only skipped if it exists.
+    :param upstream_reasons: Dictionary with the skip reasons of the upstream tasks, by task_id.
+    :return: The skip reason, or None if the operator has to run.
+    """
+    reason = None
+    if fingerprint is not None:
+        db.run(adapt_sql(SqlQueries.fingerprint_create(operator.state_table), is_redshift(db)))
+        previous = db.get_first(SqlQueries.fingerprint_select(operator.state_table, operator.dag_id,
+                                                              operator.task_id))
+        if previous and previous[0] == fingerprint and (not table or db.get_first(SqlQueries.table_exists(table))[0]):
+            reason = f"Inputs unchanged since run {previous[1]} (fingerprint {fingerprint[:12]})"
+            if upstream_reasons:
+                reason += f". Skipped upstream: {', '.join(sorted(upstream_reasons))}"
+    task_instance = context.get("ti") or context.get("task_instance")
+    if task_instance is not None:
+        task_instance.xcom_push(key=FINGERPRINT_KEY, value=fingerprint)
+        task_instance.xcom_push(key=SKIP_REASON_KEY, value=reason)
+    return reason
+
+
+def save_fingerprint(operator, db, context, fingerprint):
+    """
+    Records the fingerprint of a successful run in the operator's state_table, replacing the previous one.
+    :param operator: The operator. Uses its state_table and task_id.
+    :param db: PostgresHook to the database.
+    :param context:
+    :param fingerprint: Fingerprint of the inputs of the run. Nothing is recorded if None.
+    :return:
+    """
+    if fingerprint is None:
+        return
+    updated_at = datetime.datetime.utcnow().strftime("%Y-%m-%d %H:%M:%S")
+    db.run([
+        SqlQueries.fingerprint_delete(operator.state_table, operator.dag_id, operator.task_id),
+        SqlQueries.fingerprint_insert(operator.state_table, operator.dag_id, operator.task_id, fingerprint,
+                                      context["run_id"], updated_at)
+    ])
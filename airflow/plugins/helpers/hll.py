@@ -0,0 +1,46 @@
+import hashlib
+import math
+
+
+class HyperLogLog:
+    """
+    HyperLogLog distinct counter, used to estimate COUNT(DISTINCT ...) on the client side when the database has no
+    approximate count of its own (plain Postgres).
+    """
+
+    def __init__(self, error=0.01):
+        """
+        Initiates the counter.
+        :param error: Target relative standard error. The number of registers is chosen so that 1.04 / sqrt(m) is
+        at most this value.
+        """
+        self.p = max(4, min(18, math.ceil(math.log2((1.04 / error) ** 2))))
+        self.m = 1 << self.p
+        self.registers = bytearray(self.m)
+
+    @property
+    def error(self):
+        return 1.04 / math.sqrt(self.m)
+
+    def add(self, value):
+        x = int.from_bytes(hashlib.blake2b(str(value).encode("utf-8"), digest_size=8).digest(), "big")
+        index = x >> (64 - self.p)
+        rest = x & ((1 << (64 - self.p)) - 1)
+        rank = (64 - self.p) - rest.bit_length() + 1
+        if rank > self.registers[index]:
+            self.registers[index] = rank
+
+    def count(self):
+        if self.m == 16:
+            alpha = 0.673
+        elif self.m == 32:
+            alpha = 0.697
+        elif self.m == 64:
+            alpha = 0.709
+        else:
+            alpha = 0.7213 / (1 + 1.079 / self.m)
+        estimate = alpha * self.m * self.m / sum(2.0 ** -register for register in self.registers)
+        zeros = self.registers.count(0)
+        if estimate <= 2.5 * self.m and zeros:
+            estimate = self.m * math.log(self.m / zeros)
+        return estimate
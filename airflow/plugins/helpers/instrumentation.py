@@ -0,0 +1,172 @@
+import re
+import socket
+import time
+from contextlib import closing
+
+from helpers.dialects import is_redshift
+
+XCOM_KEY = "query_metrics"
+_EXPLAINABLE = re.compile(r"^\s*(SELECT|INSERT|UPDATE|DELETE|WITH)\b", re.IGNORECASE)
+_FIRST_WORD = re.compile(r"[A-Za-z]+")
+
+
+class StatsdClient:
+    """
+    Minimal StatsD client, sending plain-text metrics over UDP.
+    """
+
+    def __init__(self, host, port=8125, prefix="sparkify"):
+        self.address = (host, int(port))
+        self.prefix = prefix
+
+    def send(self, metrics):
+        """
+        Sends a list of (name, value, type) metrics, one datagram each. Errors are swallowed: metrics must never
+        fail a load.
+        :param metrics: List of tuples like ("stage_songs_into_db.00_copy.duration_ms", 1234, "ms").
+        :return:
+        """
+        with closing(socket.socket(socket.AF_INET, socket.SOCK_DGRAM)) as sock:
+            for name, value, metric_type in metrics:
+                try:
+                    sock.sendto(f"{self.prefix}.{name}:{value}|{metric_type}".encode("utf-8"), self.address)
+                except OSError:
+                    pass
+
+
+def statement_label(sql, index):
+    """
+    Builds a short label for a statement, from its position and first keyword.
+    :param sql: Statement.
+    :param index: Position of the statement in the task.
+    :return: String like 03_insert
+    """
+    match = _FIRST_WORD.search(sql)
+    return f"{index:02d}_{match.group(0).lower() if match else 'statement'}"
+
+
+class InstrumentedHook:
+    """
+    Wraps a PostgresHook so every statement is timed, its cursor.rowcount is captured and, optionally, its EXPLAIN
+    plan and Redshift query id. Everything else is delegated to the wrapped hook, so operators use it as a hook.
+    """
+
+    def __init__(self, hook, task_id, explain=False, statsd=None):
+        self.hook = hook
+        self.task_id = task_id
+        self.explain = explain
+        self.statsd = statsd
+        self.statements = []
+        self._redshift = None
+
+    def __getattr__(self, name):
+        return getattr(self.hook, name)
+
+    @property
+    def redshift(self):
+        if self._redshift is None:
+            self._redshift = is_redshift(self.hook)
+        return self._redshift
+
+    def record(self, sql, seconds, rows, query_id=None, plan=None):
+        """
+        Records the metrics of a statement run outside of run/get_records (e.g. a COPY FROM STDIN).
+        """
+        self.statements.append({"label": statement_label(sql, len(self.statements)), "sql": sql.strip()[:500],
+                                "seconds": seconds, "rows": rows, "query_id": query_id, "plan": plan})
+
+    def run(self, sql, autocommit=False, parameters=None):
+        """
+        Same as DbApiHook.run: a list of statements runs in a single transaction.
+        """
+        statements = [sql] if isinstance(sql, str) else sql
+        with closing(self.hook.get_conn()) as conn:
+            if self.hook.supports_autocommit:
+                self.hook.set_autocommit(conn, autocommit)
+            with closing(conn.cursor()) as cursor:
+                args = () if parameters is None else (parameters,)
+                for statement in statements:
+                    plan = None
+                    if self.explain and _EXPLAINABLE.match(statement):
+                        cursor.execute(f"EXPLAIN {statement}", *args)
+                        plan = "\n".join(str(row[0]) for row in cursor.fetchall())
+                    start = time.perf_counter()
+                    cursor.execute(statement, *args)
+                    seconds = time.perf_counter() - start
+                    rows = cursor.rowcount
+                    query_id = None
+                    if self.redshift:
+                        cursor.execute("SELECT pg_last_query_id();")
+                        query_id = cursor.fetchone()[0]
+                    self.record(statement, seconds, rows, query_id, plan)
+            if not autocommit:
+                conn.commit()
+
+    def get_records(self, sql, parameters=None):
+        start = time.perf_counter()
+        records = self.hook.get_records(sql, parameters)
+        self.record(sql, time.perf_counter() - start, len(records))
+        return records
+
+    def get_first(self, sql, parameters=None):
+        start = time.perf_counter()
+        first = self.hook.get_first(sql, parameters)
+        self.record(sql, time.perf_counter() - start, 0 if first is None else 1)
+        return first
+
+    def payload(self):
+        return {"task_id": self.task_id, "statements": self.statements,
+                "total_seconds": sum(statement["seconds"] for statement in self.statements)}
+
+    def publish(self, context):
+        """
+        Pushes the metrics to XCom (key query_metrics) and, if configured, to StatsD.
+        :param context:
+        :return:
+        """
+        payload = self.payload()
+        task_instance = context.get("ti") or context.get("task_instance")
+        if task_instance is not None:
+            task_instance.xcom_push(key=XCOM_KEY, value=payload)
+        if self.statsd is not None:
+            metrics = [(f"{self.task_id}.total_ms", int(payload["total_seconds"] * 1000), "ms")]
+            for statement in self.statements:
+                metrics.append((f"{self.task_id}.{statement['label']}.duration_ms",
+                                int(statement["seconds"] * 1000), "ms"))
+                if statement["rows"] is not None and statement["rows"] >= 0:
+                    metrics.append((f"{self.task_id}.{statement['label']}.rows", statement["rows"], "g"))
+            self.statsd.send(metrics)
+
+
+def statsd_from_config():
+    """
+    Builds a StatsdClient from the [scheduler] statsd_* settings of Airflow, or None if statsd_on is False.
+    """
+    from airflow.configuration import conf
+    if not conf.getboolean("scheduler", "statsd_on"):
+        return None
+    return StatsdClient(conf.get("scheduler", "statsd_host"), conf.getint("scheduler", "statsd_port"),
+                        conf.get("scheduler", "statsd_prefix"))
+
+
+def instrument(operator, hook):
+    """
+    Wraps the hook of an operator if its instrument flag is set. Otherwise the hook is returned untouched, so the
+    instrumentation costs nothing when disabled.
+    :param operator: Operator with the instrument and explain attributes.
+    :param hook: PostgresHook of the operator.
+    :return: The hook to use.
+    """
+    if not getattr(operator, "instrument", False):
+        return hook
+    return InstrumentedHook(hook, operator.task_id, getattr(operator, "explain", False), statsd_from_config())
+
+
+def publish_metrics(db, context):
+    if isinstance(db, InstrumentedHook):
+        db.publish(context)
+
+
+def record_metric(db, sql, seconds, rows):
+    if isinstance(db, InstrumentedHook):
+        db.record(sql, seconds, rows)
@@ -0,0 +1,79 @@
+def infer_dependencies(specs):
+    """
+    Infers the minimal task dependencies from the lineage of the tables. A task depends on the tasks producing
+    the tables it reads, and the dependencies already implied through another upstream task are dropped
+    (transitive reduction).
+    :param specs: List of table specs. Every spec is a dictionary with:
+        task_id: Id of the task.
+        table: Table (or dataset) the task produces, or None if it produces nothing downstream tasks read.
+        sources: Tables the task reads. Sources not produced by any spec are external (s3, ...).
+        operator: Operator class of the task.
+        kwargs: Keyword arguments of the operator, like the SqlQueries builders.
+    :return: Dictionary with the task_id:set of upstream task_ids pairs.
+    """
+    producers = {spec["table"]: spec["task_id"] for spec in specs if spec.get("table")}
+    direct = {spec["task_id"]: {producers[source] for source in spec.get("sources", ()) if source in producers}
+              for spec in specs}
+    for task_id, upstream in direct.items():
+        if task_id in upstream:
+            raise ValueError(f"Task {task_id} reads the table it produces.")
+    ancestors = {}
+
+    def collect(task_id, path=()):
+        if task_id in path:
+            raise ValueError(f"Cycle in the table lineage: {' -> '.join(path + (task_id,))}")
+        if task_id not in ancestors:
+            found = set()
+            for upstream in direct[task_id]:
+                found |= {upstream} | collect(upstream, path + (task_id,))
+            ancestors[task_id] = found
+        return ancestors[task_id]
+
+    minimal = {}
+    for task_id, upstream in direct.items():
+        implied = set().union(*(collect(parent) for parent in upstream)) if upstream else set()
+        minimal[task_id] = upstream - implied
+    return minimal
+
+
+def critical_path(dependencies):
+    """
+    Returns the longest chain of tasks of a dependency graph.
+    :param dependencies: Dictionary with the task_id:set of upstream task_ids pairs.
+    :return: List of task_ids, from the first to the last task of the chain.
+    """
+    longest = {}
+
+    def chain(task_id):
+        if task_id not in longest:
+            upstream = [chain(parent) for parent in sorted(dependencies[task_id])]
+            longest[task_id] = max(upstream, key=len, default=[]) + [task_id]
+        return longest[task_id]
+
+    return max((chain(task_id) for task_id in sorted(dependencies)), key=len, default=[])
+
+
+def build_tasks(dag, specs, begin=None, end=None):
+    """
+    Instantiates the operators of the table specs and wires them with the minimal dependencies.
+    :param dag: DAG the tasks belong to.
+    :param specs: List of table specs, see infer_dependencies.
+    :param begin: Optional task every task without upstream tasks waits for.
+    :param end: Optional task that waits for every task without downstream tasks.
+    :return: Dictionary with the task_id:task pairs.
+    """
+    dependencies = infer_dependencies(specs)
+    tasks = {spec["task_id"]: spec["operator"](task_id=spec["task_id"], dag=dag, **spec.get("kwargs", {}))
+             for spec in specs}
+    has_downstream = set()
+    for task_id, upstream in dependencies.items():
+        for parent in upstream:
+            tasks[parent] >> tasks[task_id]
+            has_downstream.add(parent)
+        if not upstream and begin is not None:
+            begin >> tasks[task_id]
+    if end is not None:
+        for task_id in tasks:
+            if task_id not in has_downstream:
+                tasks[task_id] >> end
+    return tasks
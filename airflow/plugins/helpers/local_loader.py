@@ -0,0 +1,234 @@
+import gzip
+import hashlib
+import io
+import json
+import os
+
+from helpers.s3_ledger import list_s3_objects
+from helpers.staging_schema import STAGING_SCHEMAS, column_kind
+
+# Same order as the entries of s3://udacity-dend/log_json_path.json, which is also the column order of the logs table.
+LOG_JSON_PATHS = ["artist", "auth", "firstName", "gender", "itemInSession", "lastName", "length", "level",
+                  "location", "method", "page", "registration", "sessionId", "song", "status", "ts", "userAgent",
+                  "userId"]
+
+# (name, text or number) pairs of the staging tables, in column order.
+STAGING_COLUMNS = {staging_type: [(column.name, column_kind(column)) for column in schema.columns]
+                   for staging_type, schema in STAGING_SCHEMAS.items()}
+
+NULL = "\\N"
+_ESCAPES = str.maketrans({"\\": "\\\\", "\t": "\\t", "\n": "\\n", "\r": "\\r"})
+
+
+def split_s3_path(path):
+    """
+    Splits an s3://bucket/key path.
+    :param path: Full s3 path.
+    :return: Tuple with the bucket and the key.
+    """
+    bucket, _, key = path[len("s3://"):].partition("/")
+    return bucket, key
+
+
+def list_source_objects(source, s3_client=None):
+    """
+    Lists the json files under a local or s3 source.
+    :param source: s3://bucket/prefix, a local directory, a local file, a local path prefix, or a COPY manifest
+    (local or s3, ending in .manifest).
+    :param s3_client: boto3 s3 client, only needed for s3 sources.
+    :return: List of dicts with the key, etag and size of each file, sorted by key.
+    """
+    if source.endswith(".manifest"):
+        return read_manifest_objects(source, s3_client)
+    if source.startswith("s3://"):
+        bucket, prefix = split_s3_path(source)
+        objects = list_s3_objects(s3_client, bucket, prefix)
+        for obj in objects:
+            obj["key"] = f"s3://{bucket}/{obj['key']}"
+        return sorted(objects, key=lambda obj: obj["key"])
+    if os.path.isdir(source):
+        paths = [os.path.join(root, name) for root, _, names in os.walk(source) for name in names]
+    elif os.path.isfile(source):
+        paths = [source]
+    else:
+        directory, prefix = os.path.split(source)
+        paths = [os.path.join(directory, name) for name in os.listdir(directory or ".") if name.startswith(prefix)]
+    objects = []
+    for path in sorted(paths):
+        if not (path.endswith(".json") or path.endswith(".json.gz")):
+            continue
+        stat = os.stat(path)
+        objects.append({"key": path, "etag": f"{stat.st_size}-{stat.st_mtime_ns}", "size": stat.st_size})
+    return objects
+
+
+def manifest_sources_path(manifest_path):
+    """
+    Path of the file listing the source files of the chunks of a manifest written by CompactFilesOperator.
+    :param manifest_path: Local path or full s3 path of the manifest.
+    :return: The path, next to the manifest.
+    """
+    return f"{manifest_path[:-len('.manifest')]}.sources.json"
+
+
+def read_manifest_sources(manifest_path, s3_client=None):
+    """
+    Reads the etag and the source files of every chunk of a manifest, if they were written with it.
+    :param manifest_path: Local path or full s3 path of the manifest.
+    :param s3_client: boto3 s3 client, only needed for s3 manifests.
+    :return: Dictionary with a dict of the etag and the sources (objects as returned by list_source_objects) of every
+    chunk, by url. Empty if the manifest has no sources file.
+    """
+    path = manifest_sources_path(manifest_path)
+    if path.startswith("s3://"):
+        bucket, key = split_s3_path(path)
+        if not s3_client.list_objects_v2(Bucket=bucket, Prefix=key).get("KeyCount"):
+            return {}
+    elif not os.path.exists(path):
+        return {}
+    return json.loads("".join(iter_object_lines(path, s3_client)))
+
+
+def read_manifest_objects(manifest_path, s3_client=None):
+    """
+    Reads the files listed in a COPY manifest. The chunks written by CompactFilesOperator keep the etag of their
+    source files and the sources themselves (key sources), so the ledger can record the source files; other files
+    get an etag from their url and size.
+    :param manifest_path: Local path or full s3 path of the manifest.
+    :param s3_client: boto3 s3 client, only needed for s3 manifests.
+    :return: List of dicts with the key, etag and size of each file.
+    """
+    manifest = json.loads("".join(iter_object_lines(manifest_path, s3_client)))
+    chunk_sources = read_manifest_sources(manifest_path, s3_client)
+    objects = []
+    for entry in manifest["entries"]:
+        size = entry.get("meta", {}).get("content_length", 0)
+        chunk = chunk_sources.get(entry["url"])
+        if chunk:
+            objects.append({"key": entry["url"], "etag": chunk["etag"], "size": size, "sources": chunk["sources"]})
+        else:
+            etag = hashlib.md5(f"{entry['url']} {size}".encode("utf-8")).hexdigest()
+            objects.append({"key": entry["url"], "etag": etag, "size": size})
+    return objects
+
+
+def iter_object_lines(key, s3_client=None):
+    """
+    Streams the lines of a local or s3 file, decompressing it if it is gzipped.
+    :param key: Local path or full s3 path of the file.
+    :param s3_client: boto3 s3 client, only needed for s3 files.
+    :return: Generator of text lines.
+    """
+    if key.startswith("s3://"):
+        bucket, s3_key = split_s3_path(key)
+        raw = s3_client.get_object(Bucket=bucket, Key=s3_key)["Body"]
+    else:
+        raw = open(key, "rb")
+    try:
+        if key.endswith(".gz"):
+            stream = io.TextIOWrapper(gzip.GzipFile(fileobj=raw), encoding="utf-8")
+        elif key.startswith("s3://"):
+            stream = (line.decode("utf-8") for line in raw.iter_lines())
+        else:
+            stream = io.TextIOWrapper(raw, encoding="utf-8")
+        for line in stream:
+            yield line
+    finally:
+        raw.close()
+
+
+def iter_json_records(objects, s3_client=None):
+    """
+    Streams the records of a list of json-lines files, one record at a time.
+    :param objects: List of objects as returned by list_source_objects.
+    :param s3_client: boto3 s3 client, only needed for s3 sources.
+    :return: Generator of dicts.
+    """
+    for obj in objects:
+        for line in iter_object_lines(obj["key"], s3_client):
+            line = line.strip()
+            if line:
+                yield json.loads(line)
+
+
+def load_jsonpaths(json_conf):
+    """
+    Reads the field names of a local jsonpaths file. Falls back to LOG_JSON_PATHS for remote or missing files.
+    :param json_conf: Path to the jsonpaths file.
+    :return: List of field names in column order.
+    """
+    if json_conf and os.path.isfile(json_conf):
+        with open(json_conf) as f:
+            paths = json.load(f)["jsonpaths"]
+        return [path.split("'")[1] if "'" in path else path.split(".")[-1] for path in paths]
+    return list(LOG_JSON_PATHS)
+
+
+def record_fields(staging_type, json_conf=""):
+    """
+    Returns the json fields to read for every column, following the same rules as Redshift COPY:
+    the jsonpaths file, by position, for the logs, and 'auto', by column name, for the songs.
+    :param staging_type: songs or logs
+    :param json_conf: Path to the jsonpaths file, for the logs.
+    :return: List of field names in column order.
+    """
+    if staging_type == "songs":
+        return [name for name, _ in STAGING_COLUMNS["songs"]]
+    return load_jsonpaths(json_conf)
+
+
+def format_value(value, column_type):
+    """
+    Formats a json value as a field of the COPY text format.
+    :param value: Value read from the json record.
+    :param column_type: text or number
+    :return: The escaped field.
+    """
+    if value is None or (column_type == "number" and value == ""):
+        return NULL
+    return str(value).translate(_ESCAPES)
+
+
+def iter_staging_lines(records, staging_type, json_conf=""):
+    """
+    Maps json records into lines of the COPY text format, in the column order of the staging table.
+    :param records: Generator of json records.
+    :param staging_type: songs or logs
+    :param json_conf: Path to the jsonpaths file, for the logs.
+    :return: Generator of lines.
+    """
+    fields = list(zip(record_fields(staging_type, json_conf), [t for _, t in STAGING_COLUMNS[staging_type]]))
+    for record in records:
+        yield "\t".join(format_value(record.get(field), column_type) for field, column_type in fields) + "\n"
+
+
+def copy_lines(conn, table, columns, lines, batch_size=10000):
+    """
+    Bulk-loads lines of the COPY text format with COPY FROM STDIN, in batches of batch_size lines,
+    so memory stays bounded no matter how big the input is. Does not commit.
+    :param conn: psycopg2 connection.
+    :param table: Target table.
+    :param columns: Column names in the order of the lines.
+    :param lines: Generator of lines.
+    :param batch_size: Number of lines per buffer.
+    :return: Number of rows loaded.
+    """
+    copy_query = f"COPY {table} ({', '.join(columns)}) FROM STDIN"
+    total = 0
+    with conn.cursor() as cursor:
+        buffer = io.StringIO()
+        buffered = 0
+        for line in lines:
+            buffer.write(line)
+            buffered += 1
+            if buffered == batch_size:
+                buffer.seek(0)
+                cursor.copy_expert(copy_query, buffer)
+                total += buffered
+                buffer = io.StringIO()
+                buffered = 0
+        if buffered:
+            buffer.seek(0)
+            cursor.copy_expert(copy_query, buffer)
+            total += buffered
+    return total
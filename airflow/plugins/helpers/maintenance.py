@@ -0,0 +1,71 @@
+from collections import namedtuple
+
+# Health of a table, in percents. unsorted is the share of the rows outside of the sort order (always 0 on Postgres),
+# stats_off how stale the planner statistics are, deleted the share of the rows deleted but not reclaimed yet.
+TableHealth = namedtuple("TableHealth", ["table", "rows", "unsorted", "stats_off", "deleted"])
+MaintenanceTask = namedtuple("MaintenanceTask", ["table", "action", "statement", "reason", "severity"])
+
+DEFAULT_THRESHOLDS = {"unsorted": 10.0, "stats_off": 10.0, "deleted": 10.0}
+
+
+def health_query(tables, redshift):
+    """
+    Builds the query of the health of a list of tables: SVV_TABLE_INFO on Redshift, pg_stat_user_tables on Postgres.
+    The deleted rows of Redshift are the difference between the rows stored and the estimated visible rows.
+    :param tables: Table names.
+    :param redshift: Bool, whether the database is Redshift.
+    :return: Query returning table, rows, unsorted, stats_off and deleted, the last three in percents.
+    """
+    names = ", ".join(f"'{table.lower()}'" for table in tables)
+    if redshift:
+        return f"""
+            SELECT
+                "table",
+                tbl_rows,
+                COALESCE(unsorted, 0),
+                COALESCE(stats_off, 0),
+                CASE WHEN tbl_rows > 0
+                    THEN 100.0 * (tbl_rows - COALESCE(estimated_visible_rows, tbl_rows)) / tbl_rows ELSE 0 END
+            FROM svv_table_info
+            WHERE "table" IN ({names});
+        """
+    return f"""
+        SELECT
+            relname,
+            n_live_tup,
+            0,
+            CASE WHEN n_live_tup > 0 THEN 100.0 * n_mod_since_analyze / n_live_tup
+                 WHEN n_mod_since_analyze > 0 THEN 100 ELSE 0 END,
+            CASE WHEN n_live_tup + n_dead_tup > 0 THEN 100.0 * n_dead_tup / (n_live_tup + n_dead_tup) ELSE 0 END
+        FROM pg_stat_user_tables
+        WHERE relname IN ({names});
+    """
+
+
+def plan_maintenance(health, thresholds=None, redshift=True):
+    """
+    Picks the maintenance of every table past a threshold, the worst first: VACUUM DELETE ONLY for the deleted rows,
+    VACUUM SORT ONLY for the unsorted rows (Redshift only) and ANALYZE for stale statistics. Postgres has no sort
+    order to restore, and its plain VACUUM reclaims the deleted rows.
+    :param health: List of TableHealth.
+    :param thresholds: Dictionary with the unsorted, stats_off and deleted thresholds, in percents. Missing keys
+    default to DEFAULT_THRESHOLDS.
+    :param redshift: Bool, whether the database is Redshift.
+    :return: List of MaintenanceTask, sorted by decreasing severity (how far past its threshold the table is).
+    """
+    thresholds = dict(DEFAULT_THRESHOLDS, **(thresholds or {}))
+    tasks = []
+    for table in health:
+        if table.deleted > thresholds["deleted"]:
+            statement = f"VACUUM DELETE ONLY {table.table};" if redshift else f"VACUUM {table.table};"
+            tasks.append(MaintenanceTask(table.table, "vacuum_delete", statement,
+                                         f"{table.deleted:.1f}% deleted rows", table.deleted / thresholds["deleted"]))
+        if redshift and table.unsorted > thresholds["unsorted"]:
+            tasks.append(MaintenanceTask(table.table, "vacuum_sort", f"VACUUM SORT ONLY {table.table};",
+                                         f"{table.unsorted:.1f}% unsorted rows",
+                                         table.unsorted / thresholds["unsorted"]))
+        if table.stats_off > thresholds["stats_off"]:
+            tasks.append(MaintenanceTask(table.table, "analyze", f"ANALYZE {table.table};",
+                                         f"statistics {table.stats_off:.1f}% off",
+                                         table.stats_off / thresholds["stats_off"]))
+    return sorted(tasks, key=lambda task: task.severity, reverse=True)
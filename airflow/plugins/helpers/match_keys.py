@@ -0,0 +1,33 @@
+# FNV-1a 64 bits offset basis (the default seed of Redshift's FNV_HASH), as a signed BIGINT. Passing it explicitly
+# keeps the call rewritable to Postgres' hashtextextended(text, seed) by helpers.dialects.
+FNV_OFFSET_BASIS = -3750763034362895579
+# Accented lowercase latin letters folded to their base letter, then the combining marks left by decomposed (NFD)
+# strings, which TRANSLATE deletes since they have no counterpart.
+_ACCENTED = "àáâãäåāăąçćčďèéêëēėęěìíîïīįłñńňòóôõöøōőŕřśšşťùúûüūůűųýÿźżž"
+_FOLDED = "aaaaaaaaacccdeeeeeeeeiiiiiilnnnoooooooorrssstuuuuuuuuyyzzz"
+_COMBINING_MARKS = "\u0300\u0301\u0302\u0303\u0304\u0306\u0307\u0308\u030a\u030b\u030c\u0327\u0328"
+_WHITESPACE = " \t\r\n\u00a0"
+
+
+def normalized_text(column):
+    """
+    Builds the SQL expression that normalises a text column for matching: lowercased, accents folded and whitespace
+    removed, so "Clementina Santafè", "clementina  santafe" and its NFD form give the same value.
+    :param column: VARCHAR column (or expression).
+    :return: The expression.
+    """
+    to_remove = _COMBINING_MARKS + _WHITESPACE
+    return f"TRANSLATE(LOWER({column}), '{_ACCENTED}{to_remove}', '{_FOLDED}')"
+
+
+def match_key(title, artist, duration):
+    """
+    Builds the SQL expression of the match key of a song: a 64 bits FNV hash of its normalised title and artist and
+    of its duration rounded to the second. NULL if any of them is NULL.
+    :param title: Column of the song title.
+    :param artist: Column of the artist name.
+    :param duration: Column of the duration, in seconds.
+    :return: The BIGINT expression.
+    """
+    return (f"FNV_HASH({normalized_text(title)} || '|' || {normalized_text(artist)} || '|' || "
+            f"CAST(CAST(ROUND({duration}) AS BIGINT) AS VARCHAR(20)), {FNV_OFFSET_BASIS})")
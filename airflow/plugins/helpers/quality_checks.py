@@ -0,0 +1,233 @@
+import itertools
+from collections import namedtuple
+from concurrent.futures import ThreadPoolExecutor
+
+from helpers.hll import HyperLogLog
+
+CheckResult = namedtuple("CheckResult", ["check_id", "passed", "observed", "reference", "message"])
+
+_cursor_ids = itertools.count()
+
+
+def check_id(check):
+    """
+    Builds a readable identifier for a check.
+    :param check: Dictionary describing the check.
+    :return: String like unique:dimension_user.user_id
+    """
+    target = f"{check['table']}.{check['column']}" if check.get("column") else check["table"]
+    if check["type"] == "referential":
+        target += f"->{check['ref_table']}.{check['ref_column']}"
+    return f"{check['type']}:{target}"
+
+
+def probe_query(check, context_values=None, approximate=False):
+    """
+    Builds the single-row aggregate probe of a check. Every probe returns the same three columns
+    (check_id, observed, reference), so any number of them can be combined with UNION ALL.
+    :param check: Dictionary describing the check. The supported types are:
+        unique: {"type": "unique", "table", "column", "max_duplicate_ratio" (default 0), "approximate" (default
+            False), "error" (default 0.01)}
+        not_null: {"type": "not_null", "table", "column", "max_null_ratio" (default 0)}
+        row_count: {"type": "row_count", "table", "min_rows" (default 1)}
+        freshness: {"type": "freshness", "table", "column" (epoch ms), "max_age_hours" (default 24)}
+        referential: {"type": "referential", "table", "column", "ref_table", "ref_column"}
+    :param context_values: Dictionary with values taken from the run, like the reference_ms of the freshness checks.
+    :param approximate: Bool, if set to True, the unique checks use Redshift's APPROXIMATE COUNT(DISTINCT ...).
+    :return: The probe query, without a trailing semicolon.
+    """
+    name = check_id(check)
+    table = check["table"]
+    column = check.get("column")
+    check_type = check["type"]
+    if check_type == "unique":
+        distinct = "APPROXIMATE COUNT(DISTINCT" if approximate else "COUNT(DISTINCT"
+        return (f"SELECT '{name}' AS check_id, CAST({distinct} {column}) AS BIGINT) AS observed, "
+                f"CAST(COUNT({column}) AS BIGINT) AS reference FROM {table}")
+    if check_type == "not_null":
+        return (f"SELECT '{name}' AS check_id, CAST(COUNT(*) - COUNT({column}) AS BIGINT) AS observed, "
+                f"CAST(COUNT(*) AS BIGINT) AS reference FROM {table}")
+    if check_type == "row_count":
+        return (f"SELECT '{name}' AS check_id, CAST(COUNT(*) AS BIGINT) AS observed, "
+                f"CAST({int(check.get('min_rows', 1))} AS BIGINT) AS reference FROM {table}")
+    if check_type == "freshness":
+        reference_ms = (context_values or {})["reference_ms"]
+        return (f"SELECT '{name}' AS check_id, CAST(MAX(CAST({column} AS BIGINT)) AS BIGINT) AS observed, "
+                f"CAST({reference_ms} AS BIGINT) AS reference FROM {table}")
+    if check_type == "referential":
+        return (f"SELECT '{name}' AS check_id, CAST(COUNT(*) AS BIGINT) AS observed, "
+                f"CAST(0 AS BIGINT) AS reference FROM {table} t "
+                f"LEFT JOIN {check['ref_table']} r ON t.{column} = r.{check['ref_column']} "
+                f"WHERE t.{column} IS NOT NULL AND r.{check['ref_column']} IS NULL")
+    raise ValueError(f"Unknown check type {check_type}.")
+
+
+def evaluate(check, observed, reference):
+    """
+    Decides whether a check passed from the values returned by its probe.
+    :param check: Dictionary describing the check.
+    :param observed: First value returned by the probe.
+    :param reference: Second value returned by the probe.
+    :return: CheckResult.
+    """
+    name = check_id(check)
+    check_type = check["type"]
+    if check_type == "unique":
+        passed = reference - observed <= check.get("max_duplicate_ratio", 0.0) * reference
+        message = f"{observed} unique values out of {reference}"
+    elif check_type == "not_null":
+        ratio = observed / reference if reference else 0.0
+        passed = ratio <= check.get("max_null_ratio", 0.0)
+        message = f"{observed} nulls out of {reference} rows ({ratio:.4%})"
+    elif check_type == "row_count":
+        passed = observed >= reference
+        message = f"{observed} rows, at least {reference} expected"
+    elif check_type == "freshness":
+        max_age_ms = check.get("max_age_hours", 24) * 3600 * 1000
+        passed = observed is not None and reference - observed <= max_age_ms
+        message = f"latest value {observed}, reference {reference}"
+    else:
+        passed = observed == 0
+        message = f"{observed} rows without a match"
+    return CheckResult(name, passed, observed, reference, message)
+
+
+def evaluate_approximate(check, estimate, reference):
+    """
+    Decides whether an approximate unique check passed. The estimate is trusted only when it is more than three
+    standard errors ("error" of the check) away from the threshold; otherwise the check is ambiguous and has to be
+    escalated to the exact count. With max_duplicate_ratio 0 (zero tolerance), an estimate clearly below the number
+    of values fails fast, but a pass is always confirmed by the exact count.
+    :param check: Dictionary describing the check.
+    :param estimate: Approximate number of distinct values.
+    :param reference: Exact number of non-null values.
+    :return: CheckResult, or None if the estimate falls inside the ambiguity band.
+    """
+    threshold = reference * (1 - check.get("max_duplicate_ratio", 0.0))
+    margin = 3 * check.get("error", 0.01) * reference
+    message = f"~{estimate:.0f} unique values out of {reference} (approximate)"
+    if estimate - margin >= threshold and check.get("max_duplicate_ratio", 0.0) > 0:
+        return CheckResult(check_id(check), True, estimate, reference, message)
+    if estimate + margin < threshold:
+        return CheckResult(check_id(check), False, estimate, reference, message)
+    return None
+
+
+def estimate_distinct(stream_values, check):
+    """
+    Estimates the distinct and total non-null values of a column with a client-side HyperLogLog, streaming the
+    column from a server-side cursor so memory stays constant.
+    :param stream_values: Function that runs a query and yields the first column of every row.
+    :param check: Dictionary describing a unique check.
+    :return: Tuple with the estimated distinct count and the exact non-null count.
+    """
+    hll = HyperLogLog(check.get("error", 0.01))
+    total = 0
+    for value in stream_values(f"SELECT {check['column']} FROM {check['table']} WHERE {check['column']} IS NOT NULL"):
+        hll.add(value)
+        total += 1
+    return hll.count(), total
+
+
+def stream_column(get_conn, query, itersize=10000):
+    """
+    Streams the first column of a query through a psycopg2 server-side (named) cursor.
+    :param get_conn: Function that returns a new psycopg2 connection, like PostgresHook.get_conn.
+    :param query: Query to run.
+    :param itersize: Number of rows fetched per round-trip.
+    :return: Generator of values.
+    """
+    conn = get_conn()
+    try:
+        with conn.cursor(name=f"quality_stream_{next(_cursor_ids)}") as cursor:
+            cursor.itersize = itersize
+            cursor.execute(query)
+            for row in cursor:
+                yield row[0]
+    finally:
+        conn.close()
+
+
+def default_checks(dims, fact="", freshness_column="", max_age_hours=24, approximate=False):
+    """
+    Builds the standard checks of the star schema: uniqueness and a row count floor for every dimension, and,
+    if a fact table is given, a row count floor, not-null keys, referential integrity to every dimension and,
+    optionally, freshness.
+    :param dims: Dictionary with the table_name:key_column pairs of the dimensions. The fact table is expected to
+    use the same column names for its foreign keys.
+    :param fact: Name of the fact table.
+    :param freshness_column: Epoch ms column of the fact table to check for freshness. Empty to skip the check.
+    :param max_age_hours: Maximum age of the latest fact row, relative to the end of the run's window.
+    :param approximate: Bool, if set to True, the uniqueness checks of the dimensions run an approximate distinct
+    count first. They keep zero tolerance for duplicates: a clear failure is reported from the estimate alone, and
+    anything else is confirmed by the exact count.
+    :return: List of checks.
+    """
+    checks = []
+    for dim, column in dims.items():
+        if approximate:
+            checks.append({"type": "unique", "table": dim, "column": column, "approximate": True})
+        else:
+            checks.append({"type": "unique", "table": dim, "column": column})
+        checks.append({"type": "row_count", "table": dim, "min_rows": 1})
+    if fact:
+        checks.append({"type": "row_count", "table": fact, "min_rows": 1})
+        for dim, column in dims.items():
+            checks.append({"type": "not_null", "table": fact, "column": column, "max_null_ratio": 0.0})
+            checks.append({"type": "referential", "table": fact, "column": column, "ref_table": dim,
+                           "ref_column": column})
+        if freshness_column:
+            checks.append({"type": "freshness", "table": fact, "column": freshness_column,
+                           "max_age_hours": max_age_hours})
+    return checks
+
+
+def _run_probes(executor, get_records, checks, context_values, batch_size, approximate=False):
+    batches = [checks[i:i + batch_size] for i in range(0, len(checks), batch_size)]
+    queries = ["\nUNION ALL\n".join(probe_query(check, context_values, approximate) for check in batch) + ";"
+               for batch in batches]
+    rows = [row for records in executor.map(get_records, queries) for row in records]
+    return {row[0]: (row[1], row[2]) for row in rows}
+
+
+def run_checks(get_records, checks, context_values=None, batch_size=10, max_workers=4, redshift=True,
+               stream_values=None):
+    """
+    Runs every check and returns every result, without stopping at the first failure.
+    The probes are combined with UNION ALL in batches of batch_size, and the batches run concurrently on a bounded
+    thread pool. The approximate unique checks run first (APPROXIMATE COUNT on Redshift, a client-side HyperLogLog
+    on Postgres), and only the ones whose estimate is ambiguous are escalated to the exact probe.
+    :param get_records: Function that runs a query and returns its rows, like PostgresHook.get_records.
+    :param checks: List of checks.
+    :param context_values: Dictionary with values taken from the run, see probe_query.
+    :param batch_size: Number of probes per query.
+    :param max_workers: Maximum number of queries in flight.
+    :param redshift: Bool, whether the database is Redshift.
+    :param stream_values: Function that runs a query and yields the first column of every row. Needed for the
+    approximate checks on Postgres, see stream_column.
+    :return: List of CheckResult, in the order of the checks.
+    """
+    results = {}
+    approximate = [check for check in checks if check["type"] == "unique" and check.get("approximate")]
+    exact = [check for check in checks if not (check["type"] == "unique" and check.get("approximate"))]
+    with ThreadPoolExecutor(max_workers=max(1, max_workers)) as executor:
+        if approximate:
+            if redshift:
+                observed = _run_probes(executor, get_records, approximate, context_values, batch_size, True)
+                estimates = [observed.get(check_id(check), (None, None)) for check in approximate]
+            else:
+                estimates = list(executor.map(lambda check: estimate_distinct(stream_values, check), approximate))
+            for check, (estimate, reference) in zip(approximate, estimates):
+                result = None if estimate is None else evaluate_approximate(check, estimate, reference)
+                if result is None:
+                    exact.append(check)
+                else:
+                    results[result.check_id] = result
+        observed = _run_probes(executor, get_records, exact, context_values, batch_size)
+    for check in exact:
+        name = check_id(check)
+        if name not in observed:
+            results[name] = CheckResult(name, False, None, None, "the probe returned no values")
+        else:
+            results[name] = evaluate(check, *observed[name])
+    return [results[check_id(check)] for check in checks]
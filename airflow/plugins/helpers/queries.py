@@ -1,3 +1,8 @@
+from helpers.batch_window import HOUR_MS, DAY_MS, window_filter
+from helpers.staging_schema import STAGING_SCHEMAS, column_definition
+from helpers.match_keys import match_key
+
+
 class SqlQueries:
     @staticmethod
     def delete_table(table):
@@ -6,69 +11,271 @@ class SqlQueries:
         """
 
     @staticmethod
-    def staging_songs_table_create(table):
+    def staging_table_create(table, schema, load_key=False, temporary=False):
+        definitions = [column_definition(column) for column in schema.columns]
+        if load_key:
+            definitions.append(f"{'load_key':<25} VARCHAR(256) ENCODE ZSTD")
+        columns = ",\n                ".join(definitions)
         return f"""
-            CREATE TABLE IF NOT EXISTS {table}
-                (
-                    song_id                   VARCHAR,
-                    num_songs                 VARCHAR,
-                    title                     VARCHAR,
-                    artist_name               VARCHAR,
-                    artist_latitude           VARCHAR,
-                    year                      VARCHAR,
-                    duration                  VARCHAR,
-                    artist_id                 VARCHAR,
-                    artist_longitude          VARCHAR,
-                    artist_location           VARCHAR
-                ) DISTSTYLE EVEN;
-            """
-
-    @staticmethod
-    def staging_songs_table_copy(table, s3_path, iam_arn):
+            CREATE {"TEMP " if temporary else ""}TABLE IF NOT EXISTS {table}
+            (
+                {columns}
+            ) DISTSTYLE KEY DISTKEY({schema.distkey}) COMPOUND SORTKEY({", ".join(schema.sortkey)});
+        """
+
+    @staticmethod
+    def staging_load_insert(table, scratch, schema, load_key):
+        columns = ", ".join(column.name for column in schema.columns)
+        return f"""
+            INSERT INTO {table} ({columns}, load_key)
+            SELECT {columns}, '{load_key}' FROM {scratch};
+        """
+
+    @staticmethod
+    def staging_load_delete(table, load_keys):
+        key_list = ", ".join(f"'{load_key}'" for load_key in sorted(load_keys))
+        return f"""
+            DELETE FROM {table} WHERE load_key IN ({key_list});
+        """
+
+    @staticmethod
+    def load_key_add(table):
+        return f"""
+            ALTER TABLE {table} ADD COLUMN load_key VARCHAR(256) ENCODE ZSTD;
+        """
+
+    @staticmethod
+    def column_exists(table, column):
+        return f"""
+            SELECT COUNT(*) FROM information_schema.columns
+            WHERE table_name = '{table.lower()}' AND column_name = '{column}';
+        """
+
+    @staticmethod
+    def staging_songs_table_create(table, schema=None):
+        return SqlQueries.staging_table_create(table, schema or STAGING_SCHEMAS["songs"])
+
+    @staticmethod
+    def table_exists(table):
+        return f"""
+            SELECT COUNT(*) FROM information_schema.tables WHERE table_name = '{table.lower()}';
+        """
+
+    @staticmethod
+    def column_widths(table):
+        return f"""
+            SELECT column_name, character_maximum_length FROM information_schema.columns
+            WHERE table_name = '{table.lower()}' AND character_maximum_length IS NOT NULL;
+        """
+
+    @staticmethod
+    def batch_tables(table):
+        return f"""
+            SELECT table_name FROM information_schema.tables WHERE table_name LIKE '{table.lower()}\\_%';
+        """
+
+    @staticmethod
+    def staging_songs_table_copy(table, s3_path, iam_arn, manifest=False, gzip=False):
         return f"""
             COPY {table} 
             FROM '{s3_path}'
             CREDENTIALS 'aws_iam_role={iam_arn}'
             FORMAT AS JSON 'auto'
+            {"MANIFEST" if manifest else ""}
+            {"GZIP" if gzip else ""}
             REGION 'us-east-1' ;
         """
 
     @staticmethod
-    def staging_logs_table_create(table):
-        return f"""
-            CREATE TABLE IF NOT EXISTS {table} 
-                    (
-                        artist            VARCHAR, 
-                        auth              VARCHAR, 
-                        firstname         VARCHAR, 
-                        gender            VARCHAR, 
-                        iteminsession     VARCHAR, 
-                        lastName          VARCHAR,
-                        length            VARCHAR, 
-                        level             VARCHAR, 
-                        location          VARCHAR, 
-                        method            VARCHAR, 
-                        page              VARCHAR, 
-                        registration      VARCHAR,
-                        sessionid         VARCHAR, 
-                        song              VARCHAR, 
-                        status            VARCHAR, 
-                        ts                VARCHAR, 
-                        useragent         VARCHAR, 
-                        userid            INTEGER
-                    ) DISTSTYLE EVEN;
-        """
+    def staging_logs_table_create(table, schema=None):
+        return SqlQueries.staging_table_create(table, schema or STAGING_SCHEMAS["logs"])
 
     @staticmethod
-    def staging_logs_table_copy(table, s3_path, iam_arn, json_conf):
+    def staging_logs_table_copy(table, s3_path, iam_arn, json_conf, manifest=False, gzip=False):
         return f"""
             COPY {table} 
             FROM '{s3_path}'
             CREDENTIALS 'aws_iam_role={iam_arn}'
             FORMAT JSON AS '{json_conf}'
+            {"MANIFEST" if manifest else ""}
+            {"GZIP" if gzip else ""}
+            REGION 'us-east-1';
+        """
+
+    @staticmethod
+    def staging_table_copy_converted(table, manifest_path, iam_arn, copy_format):
+        return f"""
+            COPY {table}
+            FROM '{manifest_path}'
+            CREDENTIALS 'aws_iam_role={iam_arn}'
+            {"FORMAT AS PARQUET" if copy_format == "parquet" else "FORMAT AS CSV GZIP EMPTYASNULL"}
+            MANIFEST
+            COMPUPDATE OFF STATUPDATE OFF
             REGION 'us-east-1';
         """
 
+    @staticmethod
+    def cluster_slices():
+        return """
+            SELECT COUNT(*) FROM stv_slices;
+        """
+
+    @staticmethod
+    def staging_ledger_create(ledger):
+        return f"""
+            CREATE TABLE IF NOT EXISTS {ledger} (
+                target_table    VARCHAR(256) NOT NULL,
+                s3_key          VARCHAR(1024) NOT NULL,
+                etag            VARCHAR(64) NOT NULL,
+                size            BIGINT,
+                loaded_at       TIMESTAMP,
+                load_key        VARCHAR(256)
+            );
+        """
+
+    @staticmethod
+    def staging_ledger_select(ledger, table):
+        return f"""
+            SELECT s3_key, etag, load_key FROM {ledger} WHERE target_table = '{table}';
+        """
+
+    @staticmethod
+    def staging_ledger_delete(ledger, table, keys):
+        key_list = ", ".join(f"'{key}'" for key in keys)
+        return f"""
+            DELETE FROM {ledger} WHERE target_table = '{table}' AND s3_key IN ({key_list});
+        """
+
+    @staticmethod
+    def staging_ledger_delete_loads(ledger, table, load_keys):
+        key_list = ", ".join(f"'{load_key}'" for load_key in sorted(load_keys))
+        return f"""
+            DELETE FROM {ledger} WHERE target_table = '{table}' AND load_key IN ({key_list});
+        """
+
+    @staticmethod
+    def staging_ledger_insert(ledger, table, objects, loaded_at, load_key=None):
+        load_value = f"'{load_key}'" if load_key else "NULL"
+        values = ",\n                ".join(
+            f"('{table}', '{obj['key']}', '{obj['etag']}', {obj['size']}, '{loaded_at}', {load_value})"
+            for obj in objects
+        )
+        return f"""
+            INSERT INTO {ledger} (target_table, s3_key, etag, size, loaded_at, load_key) VALUES
+                {values};
+        """
+
+    @staticmethod
+    def staging_checkpoint_create(checkpoints):
+        return f"""
+            CREATE TABLE IF NOT EXISTS {checkpoints} (
+                run_id          VARCHAR(256) NOT NULL,
+                target_table    VARCHAR(256) NOT NULL,
+                chunk_id        VARCHAR(32) NOT NULL,
+                files           INTEGER,
+                loaded_at       TIMESTAMP
+            );
+        """
+
+    @staticmethod
+    def staging_checkpoint_select(checkpoints, run_id, table):
+        return f"""
+            SELECT chunk_id FROM {checkpoints} WHERE run_id = '{run_id}' AND target_table = '{table}';
+        """
+
+    @staticmethod
+    def staging_checkpoint_insert(checkpoints, run_id, table, chunk_id, files, loaded_at):
+        return f"""
+            INSERT INTO {checkpoints} (run_id, target_table, chunk_id, files, loaded_at) VALUES
+                ('{run_id}', '{table}', '{chunk_id}', {files}, '{loaded_at}');
+        """
+
+    @staticmethod
+    def fingerprint_create(state_table):
+        return f"""
+            CREATE TABLE IF NOT EXISTS {state_table} (
+                dag_id          VARCHAR(256) NOT NULL,
+                task_id         VARCHAR(256) NOT NULL,
+                fingerprint     VARCHAR(64) NOT NULL,
+                run_id          VARCHAR(256),
+                updated_at      TIMESTAMP
+            ) DISTSTYLE ALL;
+        """
+
+    @staticmethod
+    def fingerprint_select(state_table, dag_id, task_id):
+        return f"""
+            SELECT fingerprint, run_id FROM {state_table} WHERE dag_id = '{dag_id}' AND task_id = '{task_id}';
+        """
+
+    @staticmethod
+    def fingerprint_delete(state_table, dag_id, task_id):
+        return f"""
+            DELETE FROM {state_table} WHERE dag_id = '{dag_id}' AND task_id = '{task_id}';
+        """
+
+    @staticmethod
+    def fingerprint_insert(state_table, dag_id, task_id, fingerprint, run_id, updated_at):
+        return f"""
+            INSERT INTO {state_table} (dag_id, task_id, fingerprint, run_id, updated_at) VALUES
+                ('{dag_id}', '{task_id}', '{fingerprint}', '{run_id}', '{updated_at}');
+        """
+
+    @staticmethod
+    def song_events_create(table):
+        return f"""
+            CREATE TABLE IF NOT EXISTS {table} (
+                ts                BIGINT NOT NULL ENCODE RAW,
+                start_time        TIMESTAMP NOT NULL ENCODE AZ64,
+                page              VARCHAR(32) ENCODE BYTEDICT,
+                userid            INTEGER ENCODE AZ64,
+                firstname         VARCHAR(64) ENCODE ZSTD,
+                lastname          VARCHAR(64) ENCODE ZSTD,
+                gender            VARCHAR(4) ENCODE BYTEDICT,
+                level             VARCHAR(8) ENCODE BYTEDICT,
+                song              VARCHAR(512) ENCODE ZSTD,
+                artist            VARCHAR(512) ENCODE ZSTD,
+                length            DOUBLE PRECISION ENCODE ZSTD,
+                sessionid         INTEGER ENCODE AZ64,
+                iteminsession     INTEGER ENCODE AZ64,
+                location          VARCHAR(256) ENCODE ZSTD,
+                useragent         VARCHAR(512) ENCODE ZSTD,
+                match_key         BIGINT ENCODE AZ64
+            ) DISTSTYLE KEY DISTKEY(match_key) COMPOUND SORTKEY(ts);
+        """
+
+    @staticmethod
+    def song_events_delete(table, window, retention_start):
+        return f"""
+            DELETE FROM {table} WHERE ({window_filter("ts", window)}) OR ts < {retention_start};
+        """
+
+    @staticmethod
+    def song_events_insert(table, raw_logs, window=None):
+        return f"""
+            INSERT INTO {table} (ts, start_time, page, userid, firstname, lastname, gender, level, song, artist,
+                                 length, sessionid, iteminsession, location, useragent, match_key)
+            SELECT
+                ts,
+                TIMESTAMP 'epoch' + ts/1000 * interval '1 second' AS start_time,
+                page,
+                userid,
+                firstname,
+                lastname,
+                gender,
+                level,
+                song,
+                artist,
+                length,
+                sessionid,
+                iteminsession,
+                location,
+                useragent,
+                {match_key("song", "artist", "length")} AS match_key
+            FROM {raw_logs}
+            WHERE page = 'NextSong' AND ts IS NOT NULL AND {window_filter("ts", window)};
+        """
+
     @staticmethod
     def songplays_table_create(table):
         return f"""
@@ -81,14 +288,33 @@ class SqlQueries:
                 artist_id          VARCHAR(20),
                 session_id         INTEGER,
                 location           VARCHAR(200),
-                user_agent         TEXT   
-            ) DISTSTYLE EVEN;
+                user_agent         TEXT,
+                ts                 BIGINT ENCODE RAW
+            ) DISTSTYLE EVEN SORTKEY(ts);
+        """
+
+    @staticmethod
+    def songplays_ts_add(table):
+        return f"""
+            ALTER TABLE {table} ADD COLUMN ts BIGINT ENCODE RAW;
+        """
+
+    @staticmethod
+    def songplays_ts_backfill(table):
+        return f"""
+            UPDATE {table} SET ts = CAST(start_time AS BIGINT) WHERE ts IS NULL;
         """
 
     @staticmethod
-    def songplays_table_insert(table, raw_songs_table, raw_logs_table):
+    def songplays_ts_sortkey(table):
         return f"""
-            INSERT INTO {table} (start_time, user_id, level, song_id, artist_id, session_id, location, user_agent)
+            ALTER TABLE {table} ALTER SORTKEY (ts);
+        """
+
+    @staticmethod
+    def songplays_table_insert(table, raw_songs_table, raw_logs_table, window=None):
+        return f"""
+            INSERT INTO {table} (start_time, user_id, level, song_id, artist_id, session_id, location, user_agent, ts)
             WITH songs AS (
                 SELECT 
                     d.song_id AS song_id,
@@ -110,19 +336,337 @@ class SqlQueries:
                     d.artist_name != '' AND
                     s.artist != ''
             )
+            SELECT plays.*, plays.ts FROM (
+                SELECT
+                    ts,
+                    userid AS user_id,
+                    level,
+                    (SELECT song_id FROM songs 
+                        WHERE song_name = song AND song_name != '' AND song_name IS NOT NULL LIMIT 1) AS song_id,
+                    (SELECT artist_id FROM artists 
+                        WHERE artist_name = artist AND artist_name != '' AND artist_name IS NOT NULL LIMIT 1) AS artist_id,
+                    sessionid AS session_id,
+                    location,
+                    useragent as user_agent
+                FROM {raw_logs_table}
+                WHERE {window_filter("ts", window)}
+            ) plays
+            WHERE song_id IS NOT NULL AND artist_id IS NOT NULL;
+        """
+
+    @staticmethod
+    def songplays_table_insert_hash_join(table, raw_songs_table, raw_logs_table, window=None):
+        return f"""
+            INSERT INTO {table} (start_time, user_id, level, song_id, artist_id, session_id, location, user_agent, ts)
+            WITH song_lookup AS (
+                SELECT
+                    title,
+                    artist_name,
+                    duration,
+                    song_id,
+                    artist_id
+                FROM (
+                    SELECT
+                        title,
+                        artist_name,
+                        duration,
+                        song_id,
+                        artist_id,
+                        ROW_NUMBER() OVER (PARTITION BY title, artist_name, duration
+                                           ORDER BY song_id, artist_id) AS song_rank
+                    FROM {raw_songs_table}
+                    WHERE
+                        song_id IS NOT NULL AND song_id != '' AND
+                        artist_id IS NOT NULL AND artist_id != '' AND
+                        title IS NOT NULL AND artist_name IS NOT NULL
+                ) ranked
+                WHERE song_rank = 1
+            ), events AS (
+                SELECT
+                    ts,
+                    userid,
+                    level,
+                    song,
+                    artist,
+                    length,
+                    sessionid,
+                    location,
+                    useragent
+                FROM {raw_logs_table}
+                WHERE page = 'NextSong' AND {window_filter("ts", window)}
+            )
+            SELECT
+                e.ts AS start_time,
+                e.userid AS user_id,
+                e.level,
+                s.song_id,
+                s.artist_id,
+                e.sessionid AS session_id,
+                e.location,
+                e.useragent AS user_agent,
+                e.ts
+            FROM events e
+            JOIN song_lookup s ON s.title = e.song AND s.artist_name = e.artist AND s.duration = e.length;
+        """
+
+    @staticmethod
+    def song_match_keys_create(table):
+        return f"""
+            CREATE TABLE IF NOT EXISTS {table} (
+                match_key         BIGINT NOT NULL ENCODE RAW,
+                song_id           VARCHAR(32) ENCODE ZSTD,
+                artist_id         VARCHAR(32) ENCODE ZSTD
+            ) DISTSTYLE KEY DISTKEY(match_key) COMPOUND SORTKEY(match_key);
+        """
+
+    @staticmethod
+    def song_match_keys_insert(table, raw_songs_table):
+        return f"""
+            INSERT INTO {table} (match_key, song_id, artist_id)
+            SELECT
+                k.match_key,
+                k.song_id,
+                k.artist_id
+            FROM (
+                SELECT
+                    match_key,
+                    song_id,
+                    artist_id,
+                    ROW_NUMBER() OVER (PARTITION BY match_key ORDER BY song_id, artist_id) AS song_rank
+                FROM (
+                    SELECT
+                        {match_key("title", "artist_name", "duration")} AS match_key,
+                        song_id,
+                        artist_id
+                    FROM {raw_songs_table}
+                    WHERE
+                        song_id IS NOT NULL AND song_id != '' AND
+                        artist_id IS NOT NULL AND artist_id != ''
+                ) keyed
+            ) k
+            LEFT JOIN {table} t ON t.match_key = k.match_key
+            WHERE k.song_rank = 1 AND k.match_key IS NOT NULL AND t.match_key IS NULL;
+        """
+
+    @staticmethod
+    def songplays_table_insert_match_key(table, match_keys_table, events_table, window=None):
+        return f"""
+            INSERT INTO {table} (start_time, user_id, level, song_id, artist_id, session_id, location, user_agent, ts)
+            SELECT
+                e.ts AS start_time,
+                e.userid AS user_id,
+                e.level,
+                k.song_id,
+                k.artist_id,
+                e.sessionid AS session_id,
+                e.location,
+                e.useragent AS user_agent,
+                e.ts
+            FROM {events_table} e
+            JOIN {match_keys_table} k ON k.match_key = e.match_key
+            WHERE e.page = 'NextSong' AND {window_filter("e.ts", window)};
+        """
+
+    @staticmethod
+    def match_hit_rate(match_keys_table, events_table, window=None):
+        return f"""
+            SELECT
+                COUNT(*) AS events,
+                COUNT(e.match_key) AS keyed,
+                COUNT(k.match_key) AS resolved
+            FROM {events_table} e
+            LEFT JOIN {match_keys_table} k ON k.match_key = e.match_key
+            WHERE e.page = 'NextSong' AND {window_filter("e.ts", window)};
+        """
+
+    @staticmethod
+    def songplays_merge_stage_create(stage_table, table):
+        return f"""
+            CREATE TEMP TABLE {stage_table} AS
+            SELECT start_time, user_id, level, song_id, artist_id, session_id, location, user_agent, ts
+            FROM {table}
+            WHERE 1 = 0;
+        """
+
+    @staticmethod
+    def merge_delete(table, stage_table, key_columns):
+        condition = " AND ".join(f"{table}.{column} = {stage_table}.{column}" for column in key_columns)
+        return f"""
+            DELETE FROM {table} USING {stage_table} WHERE {condition};
+        """
+
+    @staticmethod
+    def songplays_merge_insert(table, stage_table):
+        columns = "start_time, user_id, level, song_id, artist_id, session_id, location, user_agent, ts"
+        return f"""
+            INSERT INTO {table} ({columns})
+            SELECT DISTINCT {columns} FROM {stage_table};
+        """
+
+    @staticmethod
+    def drop_temp_table(table):
+        return f"""
+            DROP TABLE IF EXISTS {table};
+        """
+
+    @staticmethod
+    def songplays_table_diff(left_table, right_table):
+        columns = "start_time, user_id, level, song_id, artist_id, session_id, location, user_agent"
+        return f"""
+            SELECT
+                (SELECT COUNT(*) FROM (SELECT {columns} FROM {left_table}
+                    EXCEPT SELECT {columns} FROM {right_table}) only_left) AS only_left,
+                (SELECT COUNT(*) FROM (SELECT {columns} FROM {right_table}
+                    EXCEPT SELECT {columns} FROM {left_table}) only_right) AS only_right;
+        """
+
+    @staticmethod
+    def fact_plays(fact_table, window=None):
+        return f"""
             SELECT
                 ts,
-                userid AS user_id,
+                user_id,
                 level,
-                (SELECT song_id FROM songs 
-                    WHERE song_name = song AND song_name != '' AND song_name IS NOT NULL LIMIT 1) AS song_id,
-                (SELECT artist_id FROM artists 
-                    WHERE artist_name = artist AND artist_name != '' AND artist_name IS NOT NULL LIMIT 1) AS artist_id,
-                CAST(sessionid AS INTEGER),
-                location,
-                useragent as user_agent
-            FROM {raw_logs_table}
-            WHERE song_id IS NOT NULL AND artist_id IS NOT NULL;
+                song_id,
+                artist_id,
+                session_id
+            FROM {fact_table}
+            WHERE {window_filter("ts", window)}
+        """
+
+    @staticmethod
+    def rollup_delete(table, bucket_column, window=None):
+        return f"""
+            DELETE FROM {table} WHERE {window_filter(bucket_column, window)};
+        """
+
+    @staticmethod
+    def rollup_daily_song_create(table):
+        return f"""
+            CREATE TABLE IF NOT EXISTS {table} (
+                day_start          BIGINT NOT NULL,
+                play_date          DATE NOT NULL,
+                song_id            VARCHAR(20) NOT NULL,
+                artist_id          VARCHAR(20),
+                plays              BIGINT NOT NULL,
+                users              BIGINT NOT NULL
+            ) DISTSTYLE KEY DISTKEY(song_id) SORTKEY(day_start);
+        """
+
+    @staticmethod
+    def rollup_daily_song_insert(table, fact_table, window=None):
+        return f"""
+            INSERT INTO {table} (day_start, play_date, song_id, artist_id, plays, users)
+            WITH plays AS ({SqlQueries.fact_plays(fact_table, window)})
+            SELECT
+                ts - ts % {DAY_MS} AS day_start,
+                CAST(TIMESTAMP 'epoch' + (ts - ts % {DAY_MS})/1000 * interval '1 second' AS DATE) AS play_date,
+                song_id,
+                MIN(artist_id) AS artist_id,
+                COUNT(*) AS plays,
+                COUNT(DISTINCT user_id) AS users
+            FROM plays
+            WHERE song_id IS NOT NULL
+            GROUP BY 1, 2, 3;
+        """
+
+    @staticmethod
+    def rollup_daily_artist_create(table):
+        return f"""
+            CREATE TABLE IF NOT EXISTS {table} (
+                day_start          BIGINT NOT NULL,
+                play_date          DATE NOT NULL,
+                artist_id          VARCHAR(20) NOT NULL,
+                plays              BIGINT NOT NULL,
+                songs              BIGINT NOT NULL,
+                users              BIGINT NOT NULL
+            ) DISTSTYLE KEY DISTKEY(artist_id) SORTKEY(day_start);
+        """
+
+    @staticmethod
+    def rollup_daily_artist_insert(table, fact_table, window=None):
+        return f"""
+            INSERT INTO {table} (day_start, play_date, artist_id, plays, songs, users)
+            WITH plays AS ({SqlQueries.fact_plays(fact_table, window)})
+            SELECT
+                ts - ts % {DAY_MS} AS day_start,
+                CAST(TIMESTAMP 'epoch' + (ts - ts % {DAY_MS})/1000 * interval '1 second' AS DATE) AS play_date,
+                artist_id,
+                COUNT(*) AS plays,
+                COUNT(DISTINCT song_id) AS songs,
+                COUNT(DISTINCT user_id) AS users
+            FROM plays
+            WHERE artist_id IS NOT NULL
+            GROUP BY 1, 2, 3;
+        """
+
+    @staticmethod
+    def rollup_daily_level_create(table):
+        return f"""
+            CREATE TABLE IF NOT EXISTS {table} (
+                day_start          BIGINT NOT NULL,
+                play_date          DATE NOT NULL,
+                level              VARCHAR(10),
+                plays              BIGINT NOT NULL,
+                resolved_plays     BIGINT NOT NULL,
+                users              BIGINT NOT NULL,
+                sessions           BIGINT NOT NULL
+            ) DISTSTYLE ALL SORTKEY(day_start);
+        """
+
+    @staticmethod
+    def rollup_daily_level_insert(table, fact_table, window=None):
+        return f"""
+            INSERT INTO {table} (day_start, play_date, level, plays, resolved_plays, users, sessions)
+            WITH plays AS ({SqlQueries.fact_plays(fact_table, window)})
+            SELECT
+                ts - ts % {DAY_MS} AS day_start,
+                CAST(TIMESTAMP 'epoch' + (ts - ts % {DAY_MS})/1000 * interval '1 second' AS DATE) AS play_date,
+                level,
+                COUNT(*) AS plays,
+                COUNT(song_id) AS resolved_plays,
+                COUNT(DISTINCT user_id) AS users,
+                COUNT(DISTINCT CAST(user_id AS VARCHAR) || '-' || CAST(session_id AS VARCHAR)) AS sessions
+            FROM plays
+            GROUP BY 1, 2, 3;
+        """
+
+    @staticmethod
+    def rollup_hourly_concurrency_create(table):
+        return f"""
+            CREATE TABLE IF NOT EXISTS {table} (
+                hour_start         BIGINT NOT NULL,
+                hour               TIMESTAMP NOT NULL,
+                plays              BIGINT NOT NULL,
+                active_users       BIGINT NOT NULL,
+                active_sessions    BIGINT NOT NULL
+            ) DISTSTYLE ALL SORTKEY(hour_start);
+        """
+
+    @staticmethod
+    def rollup_hourly_concurrency_insert(table, fact_table, window=None):
+        return f"""
+            INSERT INTO {table} (hour_start, hour, plays, active_users, active_sessions)
+            WITH plays AS ({SqlQueries.fact_plays(fact_table, window)})
+            SELECT
+                ts - ts % {HOUR_MS} AS hour_start,
+                TIMESTAMP 'epoch' + (ts - ts % {HOUR_MS})/1000 * interval '1 second' AS hour,
+                COUNT(*) AS plays,
+                COUNT(DISTINCT user_id) AS active_users,
+                COUNT(DISTINCT CAST(user_id AS VARCHAR) || '-' || CAST(session_id AS VARCHAR)) AS active_sessions
+            FROM plays
+            GROUP BY 1, 2;
+        """
+
+    @staticmethod
+    def table_diff(left_table, right_table, columns):
+        column_list = ", ".join(columns)
+        return f"""
+            SELECT
+                (SELECT COUNT(*) FROM (SELECT {column_list} FROM {left_table}
+                    EXCEPT SELECT {column_list} FROM {right_table}) only_left) AS only_left,
+                (SELECT COUNT(*) FROM (SELECT {column_list} FROM {right_table}
+                    EXCEPT SELECT {column_list} FROM {left_table}) only_right) AS only_right;
         """
 
     @staticmethod
@@ -137,6 +681,21 @@ class SqlQueries:
             ) DISTSTYLE ALL;
         """
 
+    @staticmethod
+    def dimension_user_scd2_create(table):
+        return f"""
+            CREATE TABLE IF NOT EXISTS {table} (
+                user_id       INTEGER NOT NULL,
+                first_name    VARCHAR(30),
+                last_name     VARCHAR(30) SORTKEY,
+                gender        VARCHAR(3),
+                level         VARCHAR(10),
+                valid_from    TIMESTAMP,
+                valid_to      TIMESTAMP,
+                is_current    BOOLEAN
+            ) DISTSTYLE ALL;
+        """
+
     @staticmethod
     def dimension_time_create(table):
         return f"""
@@ -176,7 +735,7 @@ class SqlQueries:
         """
 
     @staticmethod
-    def dimension_user_insert(table, raw_logs):
+    def dimension_user_insert(table, raw_logs, window=None):
         return f"""
             INSERT INTO {table} (user_id, first_name, last_name, gender, level)
             WITH most_recent_status AS(
@@ -185,28 +744,51 @@ class SqlQueries:
                 WHERE (userid, ts) IN
                 (
                     SELECT userid, MAX(ts) FROM {raw_logs}
+                    WHERE {window_filter("ts", window)}
                     GROUP BY userid
                 )
             )
             SELECT DISTINCT
-                CAST(userid AS INTEGER) AS user_id, 
+                userid AS user_id, 
                 firstname AS first_name, 
                 lastname AS last_name, 
                 gender, 
                 level
             FROM most_recent_status
-            WHERE user_id IS NOT NULL;
+            WHERE userid IS NOT NULL;
+        """
+
+    @staticmethod
+    def dimension_user_insert_latest(table, raw_logs, window=None):
+        return f"""
+            INSERT INTO {table} (user_id, first_name, last_name, gender, level)
+            SELECT user_id, first_name, last_name, gender, level
+            FROM (
+                SELECT
+                    userid AS user_id,
+                    firstname AS first_name,
+                    lastname AS last_name,
+                    gender,
+                    level,
+                    ROW_NUMBER() OVER (
+                        PARTITION BY userid ORDER BY ts DESC, sessionid DESC, iteminsession DESC
+                    ) AS recency
+                FROM {raw_logs}
+                WHERE userid IS NOT NULL AND {window_filter("ts", window)}
+            ) events
+            WHERE recency = 1;
         """
 
     @staticmethod
-    def dimension_time_insert(table, raw_logs):
+    def dimension_time_insert(table, raw_logs, window=None):
         return f"""
             INSERT INTO {table} (start_time, hour, day, week, month, year, weekday)
             WITH timestamps AS (
                 SELECT 
                     ts AS tsraw, 
-                    TIMESTAMP 'epoch' + CAST(ts AS BIGINT)/1000 * interval '1 second' AS ts
+                    TIMESTAMP 'epoch' + ts/1000 * interval '1 second' AS ts
                 FROM {raw_logs}
+                WHERE {window_filter("ts", window)}
             )
             SELECT DISTINCT
                 tsraw AS start_time,
@@ -219,6 +801,77 @@ class SqlQueries:
             FROM timestamps;
         """
 
+    @staticmethod
+    def dimension_time_insert_new(table, raw_logs, window=None, calendar_table="", time_column=""):
+        if calendar_table:
+            attributes = f"""
+                COALESCE(c.hour, EXTRACT(hour FROM n.ts_time)) AS hour,
+                COALESCE(c.day, EXTRACT(day FROM n.ts_time)) AS day,
+                COALESCE(c.week, EXTRACT(week FROM n.ts_time)) AS week,
+                COALESCE(c.month, EXTRACT(month FROM n.ts_time)) AS month,
+                COALESCE(c.year, EXTRACT(year FROM n.ts_time)) AS year,
+                COALESCE(c.weekday, EXTRACT(dow FROM n.ts_time)) AS weekday
+            FROM new_timestamps n
+            LEFT JOIN {calendar_table} c ON c.hour_start = n.ts - n.ts % {HOUR_MS}"""
+        else:
+            attributes = """
+                EXTRACT(hour FROM n.ts_time) AS hour,
+                EXTRACT(day FROM n.ts_time) AS day,
+                EXTRACT(week FROM n.ts_time) AS week,
+                EXTRACT(month FROM n.ts_time) AS month,
+                EXTRACT(year FROM n.ts_time) AS year,
+                EXTRACT(dow FROM n.ts_time) AS weekday
+            FROM new_timestamps n"""
+        return f"""
+            INSERT INTO {table} (start_time, hour, day, week, month, year, weekday)
+            WITH batch AS (
+                SELECT DISTINCT ts{f", {time_column} AS ts_time" if time_column else ""}
+                FROM {raw_logs}
+                WHERE ts IS NOT NULL AND {window_filter("ts", window)}
+            ), new_timestamps AS (
+                SELECT
+                    b.ts,
+                    {"b.ts_time" if time_column else "TIMESTAMP 'epoch' + b.ts/1000 * interval '1 second'"} AS ts_time
+                FROM batch b
+                LEFT JOIN {table} d ON d.start_time = CAST(b.ts AS VARCHAR(20))
+                WHERE d.start_time IS NULL
+            )
+            SELECT
+                CAST(n.ts AS VARCHAR(20)) AS start_time,{attributes};
+        """
+
+    @staticmethod
+    def dimension_time_insert_events(table, song_events, window=None, calendar_table=""):
+        return SqlQueries.dimension_time_insert_new(table, song_events, window, calendar_table, "start_time")
+
+    @staticmethod
+    def calendar_create(table):
+        return f"""
+            CREATE TABLE IF NOT EXISTS {table} (
+                hour_start  BIGINT NOT NULL SORTKEY,
+                hour        SMALLINT,
+                day         SMALLINT,
+                week        SMALLINT,
+                month       SMALLINT,
+                year        SMALLINT,
+                weekday     SMALLINT
+            ) DISTSTYLE ALL;
+        """
+
+    @staticmethod
+    def calendar_last_hour(table):
+        return f"""
+            SELECT MAX(hour_start) FROM {table};
+        """
+
+    @staticmethod
+    def calendar_insert(table, hours):
+        values = ",\n                ".join(f"({', '.join(str(value) for value in hour)})" for hour in hours)
+        return f"""
+            INSERT INTO {table} (hour_start, hour, day, week, month, year, weekday) VALUES
+                {values};
+        """
+
     @staticmethod
     def dimension_song_insert(table, raw_songs):
         return f"""
@@ -227,8 +880,8 @@ class SqlQueries:
                 song_id,
                 title,
                 artist_id,
-                CAST(year AS INTEGER) AS year,
-                CAST(duration AS FLOAT) as duration
+                year,
+                duration
             FROM {raw_songs} 
             WHERE song_id is NOT NULL
         """
@@ -241,12 +894,55 @@ class SqlQueries:
                 artist_id,
                 artist_name AS name,
                 artist_location AS location,
-                CAST(artist_latitude AS FLOAT) AS latitude,
-                CAST(artist_longitude AS FLOAT) AS longitude
+                artist_latitude AS latitude,
+                artist_longitude AS longitude
             FROM {raw_songs}
             WHERE artist_id is NOT NULL
         """
 
+    @staticmethod
+    def dimension_merge_stage_create(stage_table, table, columns):
+        return f"""
+            CREATE TEMP TABLE {stage_table} AS
+            SELECT {", ".join(columns)} FROM {table}
+            WHERE 1 = 0;
+        """
+
+    @staticmethod
+    def dimension_changes_create(changes_table, stage_table, table, columns, current_only=False):
+        column_list = ", ".join(columns)
+        return f"""
+            CREATE TEMP TABLE {changes_table} AS
+            SELECT DISTINCT {column_list} FROM {stage_table}
+            EXCEPT
+            SELECT {column_list} FROM {table} {"WHERE is_current" if current_only else ""};
+        """
+
+    @staticmethod
+    def dimension_merge_insert(table, changes_table, columns):
+        column_list = ", ".join(columns)
+        return f"""
+            INSERT INTO {table} ({column_list})
+            SELECT {column_list} FROM {changes_table};
+        """
+
+    @staticmethod
+    def dimension_scd2_expire(table, changes_table, key_columns, valid_to):
+        condition = " AND ".join(f"{table}.{column} = {changes_table}.{column}" for column in key_columns)
+        return f"""
+            UPDATE {table} SET valid_to = TIMESTAMP '{valid_to}', is_current = FALSE
+            FROM {changes_table}
+            WHERE {condition} AND {table}.is_current;
+        """
+
+    @staticmethod
+    def dimension_scd2_insert(table, changes_table, columns, valid_from):
+        column_list = ", ".join(columns)
+        return f"""
+            INSERT INTO {table} ({column_list}, valid_from, valid_to, is_current)
+            SELECT {column_list}, TIMESTAMP '{valid_from}', NULL, TRUE FROM {changes_table};
+        """
+
     @staticmethod
     def data_quality_check_unique(table, column):
         return f"""
@@ -0,0 +1,111 @@
+import json
+
+from helpers.dialects import is_redshift, adapt_sql
+from helpers.queries import SqlQueries
+
+
+def list_s3_objects(client, bucket, prefix):
+    """
+    Lists every object under an s3 prefix.
+    :param client: boto3 s3 client (the one returned by S3Hook.get_conn()).
+    :param bucket: Bucket to list.
+    :param prefix: Key prefix to list.
+    :return: List of dicts with the key, etag and size of each object.
+    """
+    objects = []
+    paginator = client.get_paginator("list_objects_v2")
+    for page in paginator.paginate(Bucket=bucket, Prefix=prefix):
+        for obj in page.get("Contents", []):
+            if obj["Key"].endswith("/"):
+                continue
+            objects.append({
+                "key": obj["Key"],
+                "etag": obj["ETag"].strip('"'),
+                "size": obj["Size"]
+            })
+    return objects
+
+
+def pending_objects(objects, loaded, reloaded=()):
+    """
+    Filters out the objects that were already loaded with the same content. A compacted chunk (an object with
+    sources, see read_manifest_objects) is pending while any of its source files is.
+    :param objects: List of objects as returned by list_s3_objects.
+    :param loaded: Dictionary with the key:etag pairs already present in the ledger.
+    :param reloaded: Keys to load again even though their etag did not change, see reloaded_keys.
+    :return: List of the new or changed objects.
+    """
+    return [obj for obj in objects
+            if any(loaded.get(entry["key"]) != entry["etag"] or entry["key"] in reloaded
+                   for entry in ledger_entries([obj]))]
+
+
+def replaced_loads(objects, loaded, loads):
+    """
+    Finds the loads that copied a previous version of a changed object. The staged rows of a load are only known by
+    the load_key they were inserted with, so the rows of the whole load are deleted when the new version is copied,
+    and the other files of the load are copied again with it.
+    :param objects: List of objects as returned by list_s3_objects or list_source_objects.
+    :param loaded: Dictionary with the key:etag pairs already present in the ledger.
+    :param loads: Dictionary with the key:load_key pairs of the ledger.
+    :return: Set of load keys.
+    """
+    return {loads[entry["key"]] for entry in ledger_entries(objects)
+            if entry["key"] in loaded and loaded[entry["key"]] != entry["etag"] and loads.get(entry["key"])}
+
+
+def reloaded_keys(loads, replaced):
+    """
+    Lists the keys of the ledger copied by the replaced loads, see replaced_loads.
+    :param loads: Dictionary with the key:load_key pairs of the ledger.
+    :param replaced: Set of load keys.
+    :return: Set of keys.
+    """
+    return {key for key, load_key in loads.items() if load_key in replaced}
+
+
+def read_ledger(db, ledger, table):
+    """
+    Creates the ledger if it does not exist, adds the load_key column to a ledger created before it existed, and
+    reads the files the ledger records for a table.
+    :param db: PostgresHook to the database.
+    :param ledger: Table name of the ledger.
+    :param table: Table the files were loaded into.
+    :return: Tuple with the key:etag and the key:load_key dictionaries.
+    """
+    db.run(SqlQueries.staging_ledger_create(ledger))
+    add_load_key(db, ledger)
+    records = db.get_records(SqlQueries.staging_ledger_select(ledger, table))
+    return {key: etag for key, etag, _ in records}, {key: load_key for key, _, load_key in records}
+
+
+def add_load_key(db, table):
+    """
+    Adds the load_key column to a table created before it existed. The rows already in it keep a NULL load key.
+    :param db: PostgresHook to the database.
+    :param table: Ledger or staging table.
+    :return:
+    """
+    if not db.get_first(SqlQueries.column_exists(table, "load_key"))[0]:
+        db.run(adapt_sql(SqlQueries.load_key_add(table), is_redshift(db)))
+
+
+def ledger_entries(objects):
+    """
+    Lists the files the ledger records for a load: the source files of the compacted chunks, and the other objects
+    themselves.
+    :param objects: List of objects as returned by list_s3_objects or list_source_objects.
+    :return: List of objects.
+    """
+    return [entry for obj in objects for entry in obj.get("sources", [obj])]
+
+
+def build_copy_manifest(bucket, objects):
+    """
+    Builds a Redshift COPY manifest for a list of objects.
+    :param bucket: Bucket where the objects live.
+    :param objects: List of objects as returned by list_s3_objects.
+    :return: The manifest as a json string.
+    """
+    entries = [{"url": f"s3://{bucket}/{obj['key']}", "mandatory": True} for obj in objects]
+    return json.dumps({"entries": entries})
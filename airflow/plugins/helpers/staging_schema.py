@@ -0,0 +1,131 @@
+from collections import namedtuple
+
+# width is the VARCHAR width in bytes, None for the other types.
+StagingColumn = namedtuple("StagingColumn", ["name", "sql_type", "width", "encoding"])
+StagingSchema = namedtuple("StagingSchema", ["columns", "distkey", "sortkey"])
+
+MAX_VARCHAR_WIDTH = 65535
+# XCom key of the VARCHAR widths the records of a run were validated against, for the staging table of the run.
+WIDTHS_KEY = "staging_widths"
+
+# Column order is the order of the COPY: the jsonpaths file for the logs, the column names for the songs ('auto').
+# Both tables are distributed on the song title, the key of the fact join, so the join is collocated. The leading
+# sort key column is left uncompressed, so the zone maps stay selective.
+STAGING_SCHEMAS = {
+    "songs": StagingSchema(
+        columns=[
+            StagingColumn("song_id", "VARCHAR", 32, "ZSTD"),
+            StagingColumn("num_songs", "INTEGER", None, "AZ64"),
+            StagingColumn("title", "VARCHAR", 512, "RAW"),
+            StagingColumn("artist_name", "VARCHAR", 512, "ZSTD"),
+            StagingColumn("artist_latitude", "DOUBLE PRECISION", None, "ZSTD"),
+            StagingColumn("year", "INTEGER", None, "AZ64"),
+            StagingColumn("duration", "DOUBLE PRECISION", None, "ZSTD"),
+            StagingColumn("artist_id", "VARCHAR", 32, "ZSTD"),
+            StagingColumn("artist_longitude", "DOUBLE PRECISION", None, "ZSTD"),
+            StagingColumn("artist_location", "VARCHAR", 512, "ZSTD"),
+        ],
+        distkey="title",
+        sortkey=("title", "artist_name")
+    ),
+    "logs": StagingSchema(
+        columns=[
+            StagingColumn("artist", "VARCHAR", 512, "ZSTD"),
+            StagingColumn("auth", "VARCHAR", 16, "BYTEDICT"),
+            StagingColumn("firstname", "VARCHAR", 64, "ZSTD"),
+            StagingColumn("gender", "VARCHAR", 4, "BYTEDICT"),
+            StagingColumn("iteminsession", "INTEGER", None, "AZ64"),
+            StagingColumn("lastname", "VARCHAR", 64, "ZSTD"),
+            StagingColumn("length", "DOUBLE PRECISION", None, "ZSTD"),
+            StagingColumn("level", "VARCHAR", 8, "BYTEDICT"),
+            StagingColumn("location", "VARCHAR", 256, "ZSTD"),
+            StagingColumn("method", "VARCHAR", 8, "BYTEDICT"),
+            StagingColumn("page", "VARCHAR", 32, "BYTEDICT"),
+            StagingColumn("registration", "DOUBLE PRECISION", None, "ZSTD"),
+            StagingColumn("sessionid", "INTEGER", None, "AZ64"),
+            StagingColumn("song", "VARCHAR", 512, "ZSTD"),
+            StagingColumn("status", "SMALLINT", None, "AZ64"),
+            StagingColumn("ts", "BIGINT", None, "RAW"),
+            StagingColumn("useragent", "VARCHAR", 512, "ZSTD"),
+            StagingColumn("userid", "INTEGER", None, "AZ64"),
+        ],
+        distkey="song",
+        sortkey=("ts",)
+    )
+}
+
+
+def column_definition(column):
+    """
+    Renders the definition of a column for a CREATE TABLE.
+    :param column: StagingColumn.
+    :return: String like "title VARCHAR(512) ENCODE RAW"
+    """
+    sql_type = f"{column.sql_type}({column.width})" if column.width else column.sql_type
+    return f"{column.name:<25} {sql_type} ENCODE {column.encoding}"
+
+
+def column_kind(column):
+    """
+    Tells how the values of a column are written in the COPY text format.
+    :param column: StagingColumn.
+    :return: text or number
+    """
+    return "text" if column.sql_type == "VARCHAR" else "number"
+
+
+def varchar_width(max_bytes, headroom=2.0, minimum=16):
+    """
+    Sizes a VARCHAR column from the longest value seen: the length times the headroom, rounded up to a power of two.
+    :param max_bytes: Length in bytes of the longest value seen.
+    :param headroom: Multiplier left for the values not seen yet.
+    :param minimum: Smallest width returned.
+    :return: The width, at most MAX_VARCHAR_WIDTH.
+    """
+    width = minimum
+    while width < max_bytes * headroom:
+        width *= 2
+    return min(width, MAX_VARCHAR_WIDTH)
+
+
+def sample_widths(schema, records, fields, headroom=2.0):
+    """
+    Infers the VARCHAR widths of a schema from a sample of the source records. A sampled width is never below the
+    width of the schema, as the records past the sample (and the validation against the schema) may be as wide, and
+    columns without any value in the sample keep the width of the schema.
+    :param schema: StagingSchema to size.
+    :param records: Iterable of json records, e.g. the first records of the source.
+    :param fields: Json field read for every column, in column order (see local_loader.record_fields).
+    :param headroom: Multiplier left for the values not seen in the sample.
+    :return: A new StagingSchema with the sampled widths.
+    """
+    longest = {}
+    for record in records:
+        for column, field in zip(schema.columns, fields):
+            value = record.get(field)
+            if column.width and value is not None:
+                longest[column.name] = max(longest.get(column.name, 0), len(str(value).encode("utf-8")))
+    columns = [column._replace(width=varchar_width(longest[column.name], headroom, column.width))
+               if column.name in longest else column for column in schema.columns]
+    return schema._replace(columns=columns)
+
+
+def schema_widths(schema):
+    """
+    Reads the VARCHAR widths of a schema.
+    :param schema: StagingSchema.
+    :return: Dictionary with the width of every VARCHAR column, by name.
+    """
+    return {column.name: column.width for column in schema.columns if column.width}
+
+
+def apply_widths(schema, widths):
+    """
+    Sets the VARCHAR widths of a schema, e.g. to the ones of an existing table or of a sample.
+    :param schema: StagingSchema.
+    :param widths: Dictionary with VARCHAR widths by column name. The columns missing from it keep their width.
+    :return: A new StagingSchema.
+    """
+    columns = [column._replace(width=widths[column.name]) if column.width and widths.get(column.name) else column
+               for column in schema.columns]
+    return schema._replace(columns=columns)
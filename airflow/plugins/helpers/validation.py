@@ -0,0 +1,177 @@
+import gzip
+import json
+import os
+import shutil
+import tempfile
+from collections import Counter
+from concurrent.futures import ProcessPoolExecutor
+
+from helpers.compaction import plan_chunks, write_object, write_manifest, _s3_client
+from helpers.conversion import typed_value
+from helpers.local_loader import split_s3_path, iter_object_lines
+
+INTEGER_RANGES = {
+    "SMALLINT": (-2 ** 15, 2 ** 15 - 1),
+    "INTEGER": (-2 ** 31, 2 ** 31 - 1),
+    "BIGINT": (-2 ** 63, 2 ** 63 - 1),
+}
+
+
+def record_errors(line, columns, fields, ts_range=None):
+    """
+    Checks a json-lines record against the staging schema, the way COPY would read it: every field must convert to
+    the type of its column, fit its integer range or VARCHAR width, and ts must fall in ts_range.
+    :param line: Raw line of the file.
+    :param columns: StagingColumns of the staging table.
+    :param fields: Json field read for every column (see local_loader.record_fields).
+    :param ts_range: Tuple with the lowest and highest accepted ts, in epoch milliseconds, or None.
+    :return: List of error kinds, like type:userid or width:song. Empty if the record is valid.
+    """
+    try:
+        record = json.loads(line)
+    except ValueError:
+        return ["invalid_json"]
+    if not isinstance(record, dict):
+        return ["not_an_object"]
+    errors = []
+    for column, field in zip(columns, fields):
+        try:
+            value = typed_value(record.get(field), column)
+        except (TypeError, ValueError, OverflowError):
+            errors.append(f"type:{column.name}")
+            continue
+        if value is None:
+            continue
+        if column.sql_type in INTEGER_RANGES:
+            low, high = INTEGER_RANGES[column.sql_type]
+            if not low <= value <= high:
+                errors.append(f"range:{column.name}")
+                continue
+        if column.width and len(value.encode("utf-8")) > column.width:
+            errors.append(f"width:{column.name}")
+        if column.name == "ts" and ts_range is not None and not ts_range[0] <= value <= ts_range[1]:
+            errors.append("range:ts")
+    return errors
+
+
+class _SpooledOutput:
+    """
+    gzip json-lines output written to a local temp file, so a worker holds a single line in memory whatever the size
+    of its chunk. The file is moved or uploaded to its destination on close, and dropped if nothing was written.
+    """
+
+    def __init__(self, destination, s3_client=None):
+        self.destination = destination
+        self.s3_client = s3_client
+        self.lines = 0
+        handle, self.path = tempfile.mkstemp(suffix=".json.gz")
+        os.close(handle)
+        self.gz = gzip.open(self.path, "wb")
+
+    def write(self, line):
+        self.gz.write((line + "\n").encode("utf-8"))
+        self.lines += 1
+
+    def close(self, keep_empty=True):
+        """
+        :return: Number of bytes written, or None if the empty output was dropped.
+        """
+        self.gz.close()
+        try:
+            if not self.lines and not keep_empty:
+                return None
+            size = os.path.getsize(self.path)
+            if self.destination.startswith("s3://"):
+                bucket, key = split_s3_path(self.destination)
+                self.s3_client.upload_file(self.path, bucket, key)
+            else:
+                os.makedirs(os.path.dirname(self.destination) or ".", exist_ok=True)
+                shutil.move(self.path, self.destination)
+            return size
+        finally:
+            if os.path.exists(self.path):
+                os.remove(self.path)
+
+
+def validate_chunk(keys, destination, reject_destination, columns, fields, ts_range=None, client_kwargs=None):
+    """
+    Streams a list of json-lines files, record by record: the valid records are written as they are to a single
+    gzip json-lines file, the rejects to a gzip quarantine file, with their source, line number and errors.
+    Runs in a worker process, so it opens its own s3 client.
+    :param keys: Local paths or full s3 paths of the files to validate.
+    :param destination: Local path or full s3 path of the valid records.
+    :param reject_destination: Local path or full s3 path of the rejects. Only written if there are any.
+    :param columns: StagingColumns of the staging table.
+    :param fields: Json field read for every column.
+    :param ts_range: Tuple with the lowest and highest accepted ts, in epoch milliseconds, or None.
+    :param client_kwargs: Keyword arguments for boto3.client, needed if any path is in s3.
+    :return: Dict with the destination, the number of valid records, the bytes written, and the summary of every
+    file (records, valid, rejected and the count of every error kind).
+    """
+    uses_s3 = any(path.startswith("s3://") for path in [destination, reject_destination] + list(keys))
+    s3_client = _s3_client(client_kwargs or {}) if uses_s3 else None
+    valid = _SpooledOutput(destination, s3_client)
+    rejects = _SpooledOutput(reject_destination, s3_client)
+    files = {}
+    try:
+        for key in keys:
+            summary = {"records": 0, "valid": 0, "rejected": 0, "errors": Counter()}
+            for number, line in enumerate(iter_object_lines(key, s3_client), start=1):
+                line = line.strip()
+                if not line:
+                    continue
+                summary["records"] += 1
+                errors = record_errors(line, columns, fields, ts_range)
+                if errors:
+                    summary["rejected"] += 1
+                    summary["errors"].update(errors)
+                    rejects.write(json.dumps({"source": key, "line": number, "errors": errors, "record": line}))
+                else:
+                    summary["valid"] += 1
+                    valid.write(line)
+            summary["errors"] = dict(summary["errors"])
+            files[key] = summary
+    finally:
+        bytes_out = valid.close()
+        rejects.close(keep_empty=False)
+    return {"url": destination, "records": sum(summary["valid"] for summary in files.values()),
+            "bytes_out": bytes_out, "files": files}
+
+
+def validate_files(objects, staging_prefix, quarantine_prefix, schema, fields, ts_range=None, slices=1,
+                   target_chunk_size=64 * 1024 * 1024, workers=None, client_kwargs=None):
+    """
+    Validates json files against the staging schema with a process pool, ahead of COPY. The valid records are
+    merged into gzip json chunks with a COPY manifest, like compact_files does, and the rejects are written under the
+    quarantine prefix, next to a summary.json with the errors of every file.
+    :param objects: List of objects as returned by list_source_objects.
+    :param staging_prefix: Local directory or s3://bucket/prefix/ where the valid chunks and the manifest are written.
+    :param quarantine_prefix: Local directory or s3://bucket/prefix/ where the rejects and the summary are written.
+    :param schema: StagingSchema of the staging table.
+    :param fields: Json field read for every column (the jsonpaths mapping for the logs).
+    :param ts_range: Tuple with the lowest and highest accepted ts, in epoch milliseconds, or None.
+    :param slices: Number of slices of the cluster.
+    :param target_chunk_size: Target size of a chunk in bytes.
+    :param workers: Number of worker processes. Defaults to the number of cpus.
+    :param client_kwargs: Keyword arguments for boto3.client, needed for s3 sources or destinations.
+    :return: Tuple with the manifest path, the summary of every file and the list of chunk results.
+    """
+    if not staging_prefix.endswith("/"):
+        staging_prefix += "/"
+    if not quarantine_prefix.endswith("/"):
+        quarantine_prefix += "/"
+    chunks = plan_chunks(objects, slices, target_chunk_size)
+    sizes = {obj["key"]: obj["size"] for obj in objects}
+    with ProcessPoolExecutor(max_workers=workers) as executor:
+        futures = [executor.submit(validate_chunk, keys, f"{staging_prefix}part-{i:05d}.json.gz",
+                                   f"{quarantine_prefix}part-{i:05d}.rejects.json.gz", schema.columns, fields,
+                                   ts_range, client_kwargs)
+                   for i, keys in enumerate(chunks)]
+        results = [future.result() for future in futures]
+    for keys, result in zip(chunks, results):
+        result["bytes_in"] = sum(sizes[key] for key in keys)
+    summary = {key: file_summary for result in results for key, file_summary in result["files"].items()}
+    if any(file_summary["rejected"] for file_summary in summary.values()):
+        s3_client = _s3_client(client_kwargs or {}) if quarantine_prefix.startswith("s3://") else None
+        write_object(f"{quarantine_prefix}summary.json", json.dumps(summary, indent=2).encode("utf-8"), s3_client)
+    return write_manifest(results, staging_prefix, client_kwargs), summary, results
@@ -2,10 +2,20 @@ from operators.stage_redshift_operator import RedshiftStagingOperator
 from operators.load_fact import LoadFactOperator
 from operators.load_dimension import LoadDimensionOperator
 from operators.data_quality import DataQualityOperator
+from operators.compact_files import CompactFilesOperator
+from operators.extract_events import ExtractEventsOperator
+from operators.validate_records import ValidateRecordsOperator
+from operators.table_maintenance import TableMaintenanceOperator
+from operators.load_rollup import LoadRollupOperator
 
 __all__ = [
     'RedshiftStagingOperator',
     'LoadFactOperator',
     'LoadDimensionOperator',
-    'DataQualityOperator'
+    'DataQualityOperator',
+    'CompactFilesOperator',
+    'ExtractEventsOperator',
+    'ValidateRecordsOperator',
+    'TableMaintenanceOperator',
+    'LoadRollupOperator'
 ]
\ No newline at end of file
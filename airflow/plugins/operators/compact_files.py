@@ -0,0 +1,117 @@
+from airflow.contrib.hooks.aws_hook import AwsHook
+from airflow.hooks.postgres_hook import PostgresHook
+from airflow.models import BaseOperator
+from airflow.utils.decorators import apply_defaults
+
+from helpers import (SqlQueries, is_redshift, list_source_objects, pending_objects, read_ledger, replaced_loads,
+                     reloaded_keys, compact_files, convert_files, record_fields, STAGING_SCHEMAS)
+
+
+class CompactFilesOperator(BaseOperator):
+    ui_color = '#7fd4e8'
+
+    @apply_defaults
+    def __init__(self, db_conn_id="", aws_credentials_id="", source="", staging_prefix="", slices=0,
+                 target_chunk_size=64 * 1024 * 1024, workers=None, skip=False, output_format="json", staging_type="",
+                 json_conf="", schema=None, ledger_table="", target_table="", *args, **kwargs):
+        """
+        Initiates the operator.
+        :param db_conn_id: Connection to the Redshift database saved in Airflow. Used to read the number of slices.
+        :param aws_credentials_id: Connection to the aws credentials saved in Airflow.
+        :param source: s3://bucket/prefix or local path with the small files. It is rendered with the context.
+        :param staging_prefix: s3://bucket/prefix/ or local directory where the chunks and their manifest are written.
+        It is rendered with the context.
+        :param slices: Number of slices of the cluster. If 0, it is read from the database (1 for plain Postgres).
+        :param target_chunk_size: Target size of every chunk in bytes, before compression.
+        :param workers: Number of worker processes. Defaults to the number of cpus.
+        :param skip: Bool, if set to True, the operator will skip.
+        :param output_format: json (default) merges the files as they are. csv and parquet convert the records into
+        the columns of the staging table (gzip CSV, or snappy Parquet with pyarrow), the fastest inputs of COPY.
+        The staging operator must then be given the same copy_format.
+        :param staging_type: songs or logs, only for csv and parquet. Selects the columns and the json mapping.
+        :param json_conf: Local jsonpaths file of the logs, only for csv and parquet. Defaults to the layout of
+        s3://udacity-dend/log_json_path.json.
+        :param schema: StagingSchema of the staging table, only for csv and parquet. Defaults to the schema registered
+        for the staging_type.
+        :param ledger_table: Ledger of the files already loaded, as kept by RedshiftStagingOperator with incremental.
+        If set with target_table, only the files not yet loaded into target_table (or whose etag changed) are
+        compacted, so a staging_prefix that is the same every day only holds the chunks of the new files.
+        :param target_table: Staging table the chunks are loaded into, only with ledger_table.
+        :param args:
+        :param kwargs:
+        """
+        super(CompactFilesOperator, self).__init__(*args, **kwargs)
+        self.db_conn_id = db_conn_id
+        self.aws_credentials_id = aws_credentials_id
+        self.source = source
+        self.staging_prefix = staging_prefix
+        self.slices = slices
+        self.target_chunk_size = target_chunk_size
+        self.workers = workers
+        self.skip = skip
+        self.output_format = output_format
+        self.staging_type = staging_type
+        self.json_conf = json_conf
+        self.schema = schema or STAGING_SCHEMAS.get(staging_type)
+        self.ledger_table = ledger_table
+        self.target_table = target_table
+
+    def execute(self, context):
+        """
+        Merges the small files of the source into gzip-compressed chunks (converted to CSV or Parquet if requested),
+        and writes a COPY manifest for them.
+        :param context:
+        :return: The path of the manifest, so the staging operator can COPY from it.
+        """
+        if not self.skip:
+            source = self.source.format(**context)
+            staging_prefix = self.staging_prefix.format(**context)
+            client_kwargs = {}
+            s3_client = None
+            if source.startswith("s3://") or staging_prefix.startswith("s3://"):
+                aws_hook = AwsHook(self.aws_credentials_id)
+                credentials = aws_hook.get_credentials()
+                client_kwargs = {"aws_access_key_id": credentials.access_key,
+                                 "aws_secret_access_key": credentials.secret_key,
+                                 "aws_session_token": credentials.token}
+                s3_client = aws_hook.get_client_type("s3")
+            objects = list_source_objects(source, s3_client)
+            if self.ledger_table and self.target_table:
+                objects = self.pending_files(objects)
+            slices = self.slices or self.get_slices()
+            self.log.info(f"Compacting {len(objects)} files from {source} for {slices} slices, "
+                          f"as {self.output_format}.")
+            if self.output_format == "json":
+                manifest_path, results = compact_files(objects, staging_prefix, slices, self.target_chunk_size,
+                                                       self.workers, client_kwargs)
+            else:
+                manifest_path, results = convert_files(objects, staging_prefix, self.schema,
+                                                       record_fields(self.staging_type, self.json_conf),
+                                                       self.output_format, slices, self.target_chunk_size,
+                                                       self.workers, client_kwargs)
+            bytes_in = sum(result["bytes_in"] for result in results)
+            bytes_out = sum(result["bytes_out"] for result in results)
+            self.log.info(f"Wrote {len(results)} chunks ({bytes_in} bytes in, {bytes_out} bytes out) "
+                          f"and the manifest {manifest_path}")
+            return manifest_path
+        else:
+            self.log.info("Skipping step after user selection.")
+
+    def pending_files(self, objects):
+        """
+        Filters out the files already loaded into the target table, according to the ledger. The files of a load that
+        copied a previous version of a changed file stay, as the staging operator replaces the whole load.
+        :param objects: List of objects as returned by list_source_objects.
+        :return: List of the new or changed objects.
+        """
+        loaded, loads = read_ledger(PostgresHook(self.db_conn_id), self.ledger_table, self.target_table)
+        pending = pending_objects(objects, loaded, reloaded_keys(loads, replaced_loads(objects, loaded, loads)))
+        self.log.info(f"{len(objects) - len(pending)} of {len(objects)} files are already loaded into "
+                      f"{self.target_table}.")
+        return pending
+
+    def get_slices(self):
+        db = PostgresHook(self.db_conn_id)
+        if not is_redshift(db):
+            return 1
+        return db.get_first(SqlQueries.cluster_slices())[0]
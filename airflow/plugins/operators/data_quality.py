@@ -2,19 +2,32 @@ from airflow.hooks.postgres_hook import PostgresHook
 from airflow.models import BaseOperator
 from airflow.utils.decorators import apply_defaults
 
+from helpers import (default_checks, run_checks, stream_column, execution_window, is_redshift, instrument,
+                     publish_metrics)
+
 
 class DataQualityOperator(BaseOperator):
     ui_color = '#89DA59'
 
     @apply_defaults
-    def __init__(self, db_conn_id="", dims={}, fact="", skip=False, test=None, *args, **kwargs):
+    def __init__(self, db_conn_id="", dims={}, fact="", skip=False, test=None, checks=None, batch_size=10,
+                 max_workers=4, instrument=False, explain=False, *args, **kwargs):
         """
         Initiates the operator.
         :param db_conn_id: Connection to the Redshift database saved in Airflow.
         :param dims: Dictionary with the table_name:column_to_eval key-value pairs.
         :param fact: Name of the fact table.
         :param skip: Bool, if set to True, the Operator will be skipped.
-        :param test: Reference to the function that will test the data quality.
+        :param test: Reference to the function that will test the data quality. If passed (and checks is not), the
+        operator runs it once per dimension, as it used to.
+        :param checks: List of checks, as described in helpers.quality_checks.probe_query. If neither checks nor test
+        are passed, the standard checks of the dims and the fact table are run. Unique checks with "approximate" set
+        use an approximate distinct count first, and run the exact count only when the estimate is ambiguous.
+        :param batch_size: Number of checks combined into a single query.
+        :param max_workers: Maximum number of queries running at the same time.
+        :param instrument: Bool, if set to True, every statement is timed and its row count captured, and the
+        metrics are pushed to XCom (key query_metrics) and to StatsD (Airflow's [scheduler] statsd_* settings).
+        :param explain: Bool, only with instrument. If set to True, the EXPLAIN plan of every query is captured too.
         :param args:
         :param kwargs:
         """
@@ -24,6 +37,11 @@ class DataQualityOperator(BaseOperator):
         self.fact = fact
         self.skip = skip
         self.test = test
+        self.checks = checks
+        self.batch_size = batch_size
+        self.max_workers = max_workers
+        self.instrument = instrument
+        self.explain = explain
 
     def execute(self, context):
         """
@@ -33,18 +51,38 @@ class DataQualityOperator(BaseOperator):
         """
         if not self.skip:
             self.log.info("Reviewing Data Quality.")
-            db = PostgresHook(self.db_conn_id)
-            for dim, col in self.dims.items():
-                unique_query = self.test(dim, col)
-                records = db.get_records(unique_query)
-                if len(records) >= 1:
-                    unique, total = records[0]
-                    if unique != total:
-                        raise ValueError("The counts between total and unique ids are not the same.")
-                    else:
-                        self.log.info(f"The counts between unique {unique} and total {total} are the same."
-                                      f" Data Quality check passed.")
-                else:
-                    raise ValueError("The query returned no values.")
+            db = instrument(self, PostgresHook(self.db_conn_id))
+            try:
+                if self.test is not None and self.checks is None:
+                    self.run_test(db)
+                    return
+                checks = self.checks if self.checks is not None else default_checks(self.dims, self.fact)
+                context_values = {"reference_ms": execution_window(context)[1]}
+                results = run_checks(db.get_records, checks, context_values, self.batch_size, self.max_workers,
+                                     redshift=is_redshift(db),
+                                     stream_values=lambda query: stream_column(db.get_conn, query))
+                failures = [result for result in results if not result.passed]
+                for result in results:
+                    self.log.info(f"{'PASSED' if result.passed else 'FAILED'} {result.check_id}: {result.message}")
+                if failures:
+                    raise ValueError(f"{len(failures)} of {len(results)} data quality checks failed: "
+                                     + "; ".join(f"{result.check_id} ({result.message})" for result in failures))
+                self.log.info(f"All {len(results)} data quality checks passed.")
+            finally:
+                publish_metrics(db, context)
         else:
-            self.log.info(f"Skipping step after user selection.")
\ No newline at end of file
+            self.log.info("Skipping step after user selection.")
+
+    def run_test(self, db):
+        for dim, col in self.dims.items():
+            unique_query = self.test(dim, col)
+            records = db.get_records(unique_query)
+            if len(records) >= 1:
+                unique, total = records[0]
+                if unique != total:
+                    raise ValueError("The counts between total and unique ids are not the same.")
+                else:
+                    self.log.info(f"The counts between unique {unique} and total {total} are the same."
+                                  f" Data Quality check passed.")
+            else:
+                raise ValueError("The query returned no values.")
\ No newline at end of file
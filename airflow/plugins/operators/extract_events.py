@@ -0,0 +1,82 @@
+from airflow.hooks.postgres_hook import PostgresHook
+from airflow.models import BaseOperator
+from airflow.utils.decorators import apply_defaults
+
+from helpers import (SqlQueries, is_redshift, adapt_sql, execution_window, instrument, publish_metrics, HOUR_MS,
+                     partition_context, derived_fingerprint, check_fingerprint, save_fingerprint)
+
+
+class ExtractEventsOperator(BaseOperator):
+    ui_color = '#F9C66B'
+
+    @apply_defaults
+    def __init__(self, db_conn_id="", table="", raw_logs_table="", retention_days=7, skip=False, instrument=False,
+                 explain=False, partition="", skip_unchanged=False, state_table="task_fingerprints", *args, **kwargs):
+        """
+        Initiates the operator.
+        :param db_conn_id: Connection to the Redshift database saved in Airflow.
+        :param table: Table name for the working table of the song events.
+        :param raw_logs_table: Table name for the raw logs table. It is rendered with the context, so the batch of
+        the run of a batched staging table can be read, e.g. logs_raw_data_{ds_nodash}.
+        :param retention_days: Events older than this many days before the run's window are dropped from the
+        working table, so it only holds the recent batches.
+        :param skip: Bool, if set to True, the operator will skip.
+        :param instrument: Bool, if set to True, every statement is timed and its row count captured, and the
+        metrics are pushed to XCom (key query_metrics) and to StatsD (Airflow's [scheduler] statsd_* settings).
+        :param explain: Bool, only with instrument. If set to True, the EXPLAIN plan of every query is captured too.
+        :param partition: Day (YYYY-MM-DD) the task is scoped to, for the backfill groups. The context is rendered as
+        if the run had been scheduled for that day (see helpers.batch_window.partition_context).
+        :param skip_unchanged: Bool, if set to True, the inputs of the run are fingerprinted from the fingerprints of
+        the upstream tasks and the window (see helpers.fingerprints), and the extraction is skipped when the
+        fingerprint matches the one of the last successful run. The fingerprint and the skip reason are pushed to
+        XCom (keys input_fingerprint and skip_reason).
+        :param state_table: Table name for the fingerprints of the last successful run of every task.
+        :param args:
+        :param kwargs:
+        """
+        super(ExtractEventsOperator, self).__init__(*args, **kwargs)
+        self.db_conn_id = db_conn_id
+        self.table = table
+        self.raw_logs_table = raw_logs_table
+        self.retention_days = retention_days
+        self.skip = skip
+        self.instrument = instrument
+        self.explain = explain
+        self.partition = partition
+        self.skip_unchanged = skip_unchanged
+        self.state_table = state_table
+
+    def execute(self, context):
+        """
+        Scans the logs of the run's window once, and writes its NextSong events, typed and with ts converted, into
+        the working table the fact and log-based dimension loads read.
+        :param context:
+        :return:
+        """
+        if not self.skip:
+            context = partition_context(context, self.partition)
+            db = instrument(self, PostgresHook(self.db_conn_id))
+            try:
+                window = execution_window(context)
+                raw_logs_table = self.raw_logs_table.format(**context)
+                fingerprint = None
+                if self.skip_unchanged:
+                    fingerprint, upstream_reasons = derived_fingerprint(
+                        self, context, {"table": self.table, "raw_logs_table": raw_logs_table, "window": window})
+                    reason = check_fingerprint(self, db, context, fingerprint, self.table, upstream_reasons)
+                    if reason:
+                        self.log.info(f"Skipping the extraction into {self.table}: {reason}")
+                        return
+                db.run(adapt_sql(SqlQueries.song_events_create(self.table), is_redshift(db)))
+                retention_start = window[0] - self.retention_days * 24 * HOUR_MS
+                self.log.info(f"Extracting the song events between {window[0]} and {window[1]} of {raw_logs_table} "
+                              f"into {self.table}.")
+                db.run([
+                    SqlQueries.song_events_delete(self.table, window, retention_start),
+                    SqlQueries.song_events_insert(self.table, raw_logs_table, window)
+                ])
+                save_fingerprint(self, db, context, fingerprint)
+            finally:
+                publish_metrics(db, context)
+        else:
+            self.log.info("Skipping step after user selection.")
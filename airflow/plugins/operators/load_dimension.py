@@ -2,14 +2,17 @@ from airflow.hooks.postgres_hook import PostgresHook
 from airflow.models import BaseOperator
 from airflow.utils.decorators import apply_defaults
 
-from helpers import SqlQueries
+from helpers import (SqlQueries, is_redshift, adapt_sql, execution_window, instrument, publish_metrics, HOUR_MS,
+                     calendar_hours, partition_context, derived_fingerprint, check_fingerprint, save_fingerprint)
 
 
 class LoadDimensionOperator(BaseOperator):
     ui_color = '#80BD9E'
     @apply_defaults
     def __init__(self, db_conn_id="", aws_credentials_id="", table="", raw_table="", create_func=None,
-                 insert_func=None, skip=False, delete_first=False, *args, **kwargs):
+                 insert_func=None, skip=False, delete_first=False, mode="rebuild", key_columns=(), columns=(),
+                 windowed=False, scd2=False, instrument=False, explain=False, calendar_table="", calendar_days=0,
+                 partition="", skip_unchanged=False, state_table="task_fingerprints", *args, **kwargs):
         """
         Initiates the operator.
         :param db_conn_id: Connection to the Redshift database saved in Airflow.
@@ -20,6 +23,31 @@ class LoadDimensionOperator(BaseOperator):
         :param insert_func: Reference to the function that inserts the data into the table.
         :param skip: Bool, if set to True, the operator will skip.
         :param delete_first: Bool, if set to True, the operator will delete first the table.
+        :param mode: rebuild (default) inserts straight into the dimension. merge computes the rows of the current
+        batch into a temp table, keeps only the new or changed ones and upserts them on key_columns in a single
+        transaction, so the dimension stays queryable during the load. incremental is for append-only dimensions,
+        like the time dimension: insert_func only adds the keys of the batch that are not in the dimension yet (see
+        SqlQueries.dimension_time_insert_new), so the cost of a run follows the number of new keys. delete_first is
+        ignored in the merge and incremental modes.
+        :param key_columns: Columns that identify a row of the dimension, used by the merge mode.
+        :param columns: Columns filled by insert_func, used by the merge mode.
+        :param windowed: Bool, if set to True, insert_func is restricted to the run's execution_date window.
+        :param scd2: Bool, only for the merge mode. If set to True, the changed rows are not replaced: the current
+        version is closed (valid_to, is_current) and a new version is inserted, keeping a type-2 history.
+        :param instrument: Bool, if set to True, every statement is timed and its row count captured, and the
+        metrics are pushed to XCom (key query_metrics) and to StatsD (Airflow's [scheduler] statsd_* settings).
+        :param explain: Bool, only with instrument. If set to True, the EXPLAIN plan of every query is captured too.
+        :param calendar_table: Only for the incremental mode. Table with the calendar attributes of every hour,
+        passed to insert_func so the new keys are looked up instead of computed.
+        :param calendar_days: Only with calendar_table. When the calendar does not cover the run, the attributes of
+        the next calendar_days days are generated in bulk.
+        :param partition: Day (YYYY-MM-DD) the task is scoped to, for the backfill groups. The context is rendered as
+        if the run had been scheduled for that day (see helpers.batch_window.partition_context).
+        :param skip_unchanged: Bool, if set to True, the inputs of the run are fingerprinted from the fingerprints of
+        the upstream tasks, the settings of the load and, if windowed, the window (see helpers.fingerprints). The
+        load is skipped when the fingerprint matches the one of the last successful run and the dimension exists.
+        The fingerprint and the skip reason are pushed to XCom (keys input_fingerprint and skip_reason).
+        :param state_table: Table name for the fingerprints of the last successful run of every task.
         :param args:
         :param kwargs:
         """
@@ -32,6 +60,18 @@ class LoadDimensionOperator(BaseOperator):
         self.create_func = create_func
         self.insert_func = insert_func
         self.delete_first = delete_first
+        self.mode = mode
+        self.key_columns = key_columns
+        self.columns = columns
+        self.windowed = windowed
+        self.scd2 = scd2
+        self.instrument = instrument
+        self.explain = explain
+        self.partition = partition
+        self.calendar_table = calendar_table
+        self.calendar_days = calendar_days
+        self.skip_unchanged = skip_unchanged
+        self.state_table = state_table
 
     def execute(self, context):
         """
@@ -40,16 +80,121 @@ class LoadDimensionOperator(BaseOperator):
         :return:
         """
         if not self.skip:
-            db = PostgresHook(self.db_conn_id)
-            if self.delete_first:
-                self.log.info(f"Deleting table {self.table}.")
-                delete_query = SqlQueries.delete_table(self.table)
-                db.run(delete_query)
-                self.log.info(f"Creating table {self.table}.")
-                create_query = self.create_func(self.table)
-                db.run(create_query)
-            self.log.info(f"Inserting data into dimension {self.table}.")
-            insert_query = self.insert_func(self.table, self.raw_table)
-            db.run(insert_query)
+            context = partition_context(context, self.partition)
+            db = instrument(self, PostgresHook(self.db_conn_id))
+            try:
+                fingerprint = None
+                if self.skip_unchanged:
+                    fingerprint, upstream_reasons = derived_fingerprint(self, context,
+                                                                        self.fingerprint_settings(context))
+                    reason = check_fingerprint(self, db, context, fingerprint, self.table, upstream_reasons)
+                    if reason:
+                        self.log.info(f"Skipping the load of dimension {self.table}: {reason}")
+                        return
+                if self.mode == "merge":
+                    self.merge(db, context)
+                elif self.mode == "incremental":
+                    self.append_new(db, context)
+                else:
+                    if self.delete_first:
+                        self.log.info(f"Deleting table {self.table}.")
+                        delete_query = SqlQueries.delete_table(self.table)
+                        db.run(delete_query)
+                        self.log.info(f"Creating table {self.table}.")
+                        create_query = self.create_func(self.table)
+                        db.run(adapt_sql(create_query, is_redshift(db)))
+                    self.log.info(f"Inserting data into dimension {self.table}.")
+                    insert_query = self.insert_query(self.table, context)
+                    db.run(insert_query)
+                save_fingerprint(self, db, context, fingerprint)
+            finally:
+                publish_metrics(db, context)
         else:
-            self.log.info(f"Skipping step after user selection.")
\ No newline at end of file
+            self.log.info("Skipping step after user selection.")
+
+    def fingerprint_settings(self, context):
+        """
+        Settings that change the rows the run loads, fingerprinted with the upstream fingerprints.
+        :param context:
+        :return: Dictionary of settings.
+        """
+        return {"table": self.table, "raw_table": self.raw_table, "insert_func": self.insert_func.__name__,
+                "mode": self.mode, "key_columns": list(self.key_columns), "columns": list(self.columns),
+                "scd2": self.scd2, "calendar_table": self.calendar_table,
+                "window": execution_window(context) if self.windowed else None}
+
+    def merge(self, db, context):
+        """
+        Upserts the new or changed rows of the current batch through temp tables, in a single transaction.
+        :param db: PostgresHook to the database.
+        :param context:
+        :return:
+        """
+        create_query = self.create_func(self.table)
+        db.run(adapt_sql(create_query, is_redshift(db)))
+        stage_table = f"{self.table}_merge_stage"
+        changes_table = f"{self.table}_merge_changes"
+        queries = [
+            SqlQueries.drop_temp_table(stage_table),
+            SqlQueries.drop_temp_table(changes_table),
+            SqlQueries.dimension_merge_stage_create(stage_table, self.table, self.columns),
+            self.insert_query(stage_table, context),
+            SqlQueries.dimension_changes_create(changes_table, stage_table, self.table, self.columns, self.scd2)
+        ]
+        if self.scd2:
+            version_ts = context["execution_date"].strftime("%Y-%m-%d %H:%M:%S")
+            queries += [
+                SqlQueries.dimension_scd2_expire(self.table, changes_table, self.key_columns, version_ts),
+                SqlQueries.dimension_scd2_insert(self.table, changes_table, self.columns, version_ts)
+            ]
+        else:
+            queries += [
+                SqlQueries.merge_delete(self.table, changes_table, self.key_columns),
+                SqlQueries.dimension_merge_insert(self.table, changes_table, self.columns)
+            ]
+        queries += [
+            SqlQueries.drop_temp_table(stage_table),
+            SqlQueries.drop_temp_table(changes_table)
+        ]
+        self.log.info(f"Merging the changed rows into dimension {self.table}.")
+        db.run(queries)
+
+    def append_new(self, db, context):
+        """
+        Adds the keys of the current batch that are not in the dimension yet.
+        :param db: PostgresHook to the database.
+        :param context:
+        :return:
+        """
+        redshift = is_redshift(db)
+        db.run(adapt_sql(self.create_func(self.table), redshift))
+        window = execution_window(context) if self.windowed else None
+        if self.calendar_table:
+            db.run(adapt_sql(SqlQueries.calendar_create(self.calendar_table), redshift))
+            if self.calendar_days:
+                self.extend_calendar(db, execution_window(context))
+            insert_query = self.insert_func(self.table, self.raw_table, window, self.calendar_table)
+        else:
+            insert_query = self.insert_func(self.table, self.raw_table, window)
+        self.log.info(f"Appending the new keys of the batch into dimension {self.table}.")
+        db.run(insert_query)
+
+    def extend_calendar(self, db, window):
+        """
+        Generates the calendar attributes of the next calendar_days days, if the calendar does not cover the run.
+        :param db: PostgresHook to the database.
+        :param window: Window of the run, in epoch milliseconds.
+        :return:
+        """
+        last_hour = db.get_first(SqlQueries.calendar_last_hour(self.calendar_table))[0]
+        if last_hour is not None and last_hour + HOUR_MS >= window[1]:
+            return
+        start = window[0] if last_hour is None else max(last_hour + HOUR_MS, window[0])
+        hours = calendar_hours(start, max(window[1], window[0] + self.calendar_days * 24 * HOUR_MS))
+        self.log.info(f"Generating the calendar attributes of {len(hours)} hours into {self.calendar_table}.")
+        db.run(SqlQueries.calendar_insert(self.calendar_table, hours))
+
+    def insert_query(self, table, context):
+        if self.windowed:
+            return self.insert_func(table, self.raw_table, execution_window(context))
+        return self.insert_func(table, self.raw_table)
\ No newline at end of file
@@ -2,7 +2,8 @@ from airflow.hooks.postgres_hook import PostgresHook
 from airflow.models import BaseOperator
 from airflow.utils.decorators import apply_defaults
 
-from helpers import SqlQueries
+from helpers import (SqlQueries, is_redshift, adapt_sql, execution_window, instrument, publish_metrics,
+                     partition_context, derived_fingerprint, check_fingerprint, save_fingerprint)
 
 
 class LoadFactOperator(BaseOperator):
@@ -10,7 +11,9 @@ class LoadFactOperator(BaseOperator):
 
     @apply_defaults
     def __init__(self, db_conn_id="", aws_credentials_id="", table="", raw_songs_table="", raw_logs_table="",
-                 skip=False, *args, **kwargs):
+                 skip=False, strategy="legacy", mode="append", merge_key=("user_id", "session_id", "start_time"),
+                 instrument=False, explain=False, partition="", match_keys_table="", skip_unchanged=False,
+                 state_table="task_fingerprints", *args, **kwargs):
         """
         Initiates the operator.
         :param db_conn_id: Connection to the Redshift database saved in Airflow.
@@ -19,6 +22,27 @@ class LoadFactOperator(BaseOperator):
         :param raw_songs_table: Table name for the raw songs table.
         :param raw_logs_table: Table name for the raw logs table.
         :param skip: Bool, skips if set to True.
+        :param strategy: legacy (default) runs the former per-row subqueries. hash_join resolves song_id and
+        artist_id by joining the NextSong events to a deduplicated (title, artist_name, duration) lookup, with both
+        ids taken from the same song; both results can be diffed with SqlQueries.songplays_table_diff. match_key joins the events on their normalised
+        match key (see helpers.match_keys) to match_keys_table, both distributed on it, and reports the share of the
+        NextSong events that resolved; raw_logs_table must then be a song events table.
+        :param mode: append (default) inserts every event of the staging table. merge only loads the events of the
+        run's execution_date window into a temp table, then deletes the matching rows of the fact table (on
+        merge_key) and inserts the new ones in a single transaction, so retries and backfills are idempotent.
+        :param merge_key: Columns that identify an event, used by the merge mode.
+        :param instrument: Bool, if set to True, every statement is timed and its row count captured, and the
+        metrics are pushed to XCom (key query_metrics) and to StatsD (Airflow's [scheduler] statsd_* settings).
+        :param explain: Bool, only with instrument. If set to True, the EXPLAIN plan of every query is captured too.
+        :param partition: Day (YYYY-MM-DD) the task is scoped to, for the backfill groups. The context is rendered as
+        if the run had been scheduled for that day (see helpers.batch_window.partition_context).
+        :param match_keys_table: Only with the match_key strategy. Table of the song match keys, filled by the songs
+        staging task (see RedshiftStagingOperator's match_keys_table).
+        :param skip_unchanged: Bool, if set to True, the inputs of the run are fingerprinted from the fingerprints of
+        the upstream tasks, the settings of the load and, in merge mode, the window (see helpers.fingerprints). The
+        load is skipped when the fingerprint matches the one of the last successful run and the fact table exists.
+        The fingerprint and the skip reason are pushed to XCom (keys input_fingerprint and skip_reason).
+        :param state_table: Table name for the fingerprints of the last successful run of every task.
         :param args:
         :param kwargs:
         """
@@ -29,6 +53,15 @@ class LoadFactOperator(BaseOperator):
         self.raw_songs_table = raw_songs_table
         self.raw_logs_table = raw_logs_table
         self.skip = skip
+        self.strategy = strategy
+        self.mode = mode
+        self.merge_key = merge_key
+        self.instrument = instrument
+        self.explain = explain
+        self.partition = partition
+        self.match_keys_table = match_keys_table
+        self.skip_unchanged = skip_unchanged
+        self.state_table = state_table
 
     def execute(self, context):
         """
@@ -37,12 +70,108 @@ class LoadFactOperator(BaseOperator):
         :return:
         """
         if not self.skip:
-            db = PostgresHook(self.db_conn_id)
-            self.log.info(f"Creating table {self.table}.")
-            create_query = SqlQueries.songplays_table_create(self.table)
-            db.run(create_query)
-            self.log.info(f"Inserting data into facts table.")
-            insert_query = SqlQueries.songplays_table_insert(self.table, self.raw_songs_table, self.raw_logs_table)
-            db.run(insert_query)
+            context = partition_context(context, self.partition)
+            db = instrument(self, PostgresHook(self.db_conn_id))
+            try:
+                fingerprint = None
+                if self.skip_unchanged:
+                    fingerprint, upstream_reasons = derived_fingerprint(self, context,
+                                                                        self.fingerprint_settings(context))
+                    reason = check_fingerprint(self, db, context, fingerprint, self.table, upstream_reasons)
+                    if reason:
+                        self.log.info(f"Skipping the load of {self.table}: {reason}")
+                        return
+                self.log.info(f"Creating table {self.table}.")
+                create_query = SqlQueries.songplays_table_create(self.table)
+                db.run(adapt_sql(create_query, is_redshift(db)))
+                self.add_ts(db)
+                window = None
+                if self.mode == "merge":
+                    window = execution_window(context)
+                    self.merge(db, window)
+                else:
+                    self.log.info("Inserting data into facts table.")
+                    insert_query = self.insert_query(self.table)
+                    db.run(insert_query)
+                if self.strategy == "match_key":
+                    self.report_hit_rate(db, window, context)
+                save_fingerprint(self, db, context, fingerprint)
+            finally:
+                publish_metrics(db, context)
         else:
-            self.log.info(f"Skipping step after user selection.")
+            self.log.info("Skipping step after user selection.")
+
+    def fingerprint_settings(self, context):
+        """
+        Settings that change the rows the run loads, fingerprinted with the upstream fingerprints.
+        :param context:
+        :return: Dictionary of settings.
+        """
+        return {"table": self.table, "raw_songs_table": self.raw_songs_table, "raw_logs_table": self.raw_logs_table,
+                "match_keys_table": self.match_keys_table, "strategy": self.strategy, "mode": self.mode,
+                "merge_key": list(self.merge_key),
+                "window": execution_window(context) if self.mode == "merge" else None}
+
+    def add_ts(self, db):
+        """
+        Adds the ts column to a fact table created before it existed, which CREATE TABLE IF NOT EXISTS leaves as it
+        is, and fills it from start_time. On Redshift, the table is then sorted on it.
+        :param db: PostgresHook to the database.
+        :return:
+        """
+        if db.get_first(SqlQueries.column_exists(self.table, "ts"))[0]:
+            return
+        self.log.info(f"Adding the ts column to {self.table}.")
+        redshift = is_redshift(db)
+        db.run([adapt_sql(SqlQueries.songplays_ts_add(self.table), redshift),
+                SqlQueries.songplays_ts_backfill(self.table)])
+        if redshift:
+            db.run(SqlQueries.songplays_ts_sortkey(self.table), autocommit=True)
+
+    def merge(self, db, window):
+        """
+        Upserts the events of the run's window through a temp table, in a single transaction.
+        :param db: PostgresHook to the database.
+        :param window: Window of the run, in epoch milliseconds.
+        :return:
+        """
+        stage_table = f"{self.table}_merge_stage"
+        self.log.info(f"Merging the events between {window[0]} and {window[1]} into {self.table}.")
+        db.run([
+            SqlQueries.drop_temp_table(stage_table),
+            SqlQueries.songplays_merge_stage_create(stage_table, self.table),
+            self.insert_query(stage_table, window),
+            SqlQueries.merge_delete(self.table, stage_table, self.merge_key),
+            SqlQueries.songplays_merge_insert(self.table, stage_table),
+            SqlQueries.drop_temp_table(stage_table)
+        ])
+
+    def report_hit_rate(self, db, window, context):
+        """
+        Logs how many NextSong events of the window resolved to a song through their match key, and pushes the
+        counts to XCom (key match_hit_rate).
+        :param db: PostgresHook to the database.
+        :param window: Window of the run, or None for the whole events table.
+        :param context:
+        :return:
+        """
+        events, keyed, resolved = db.get_first(SqlQueries.match_hit_rate(self.match_keys_table, self.raw_logs_table,
+                                                                         window))
+        report = {"events": events, "keyed": keyed, "resolved": resolved,
+                  "hit_rate": resolved / events if events else None}
+        self.log.info(f"{resolved} of {events} NextSong events resolved to a song through their match key "
+                      f"({keyed} had a key).")
+        task_instance = context.get("ti") or context.get("task_instance")
+        if task_instance is not None:
+            task_instance.xcom_push(key="match_hit_rate", value=report)
+
+    def insert_query(self, table, window=None):
+        if self.strategy == "legacy":
+            return SqlQueries.songplays_table_insert(table, self.raw_songs_table, self.raw_logs_table, window)
+        if self.strategy == "hash_join":
+            return SqlQueries.songplays_table_insert_hash_join(table, self.raw_songs_table, self.raw_logs_table,
+                                                               window)
+        if self.strategy == "match_key":
+            return SqlQueries.songplays_table_insert_match_key(table, self.match_keys_table, self.raw_logs_table,
+                                                               window)
+        raise ValueError(f"Unknown fact load strategy {self.strategy}.")
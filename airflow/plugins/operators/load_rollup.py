@@ -0,0 +1,96 @@
+from airflow.hooks.postgres_hook import PostgresHook
+from airflow.models import BaseOperator
+from airflow.utils.decorators import apply_defaults
+
+from helpers import (SqlQueries, is_redshift, adapt_sql, execution_window, align_window, instrument, publish_metrics,
+                     partition_context, DAY_MS, derived_fingerprint, check_fingerprint, save_fingerprint)
+
+
+class LoadRollupOperator(BaseOperator):
+    ui_color = '#d9a7f2'
+
+    @apply_defaults
+    def __init__(self, db_conn_id="", table="", fact_table="", create_func=None, insert_func=None,
+                 bucket_column="day_start", grain_ms=DAY_MS, incremental=True, skip=False, instrument=False,
+                 explain=False, partition="", skip_unchanged=False, state_table="task_fingerprints", *args, **kwargs):
+        """
+        Initiates the operator.
+        :param db_conn_id: Connection to the Redshift database saved in Airflow.
+        :param table: Table name for the rollup.
+        :param fact_table: Fact table the rollup aggregates.
+        :param create_func: Reference to the function that creates the table.
+        :param insert_func: Reference to the function that aggregates the fact rows of a window into the table (see
+        SqlQueries.rollup_daily_song_insert).
+        :param bucket_column: Column of the rollup with the start of its bucket, in epoch milliseconds.
+        :param grain_ms: Size of a bucket of the rollup, in milliseconds.
+        :param incremental: Bool. If True (default), only the buckets touched by the run's window are replaced, with
+        the aggregates of the fact rows of those buckets, so the cost of a run follows the size of the batch. If
+        False, the whole rollup is recomputed from the fact table, like after a backfill.
+        :param skip: Bool, if set to True, the operator will skip.
+        :param instrument: Bool, if set to True, every statement is timed and its row count captured, and the
+        metrics are pushed to XCom (key query_metrics) and to StatsD.
+        :param explain: Bool, only with instrument. If set to True, the EXPLAIN plan of every query is captured too.
+        :param partition: Day (YYYY-MM-DD) the task is scoped to, for the backfill groups. The context is rendered as
+        if the run had been scheduled for that day (see helpers.batch_window.partition_context).
+        :param skip_unchanged: Bool, if set to True, the inputs of the run are fingerprinted from the fingerprint of
+        the fact load and the buckets the run replaces (see helpers.fingerprints), and the update is skipped when
+        the fingerprint matches the one of the last successful run and the rollup exists. The fingerprint and the
+        skip reason are pushed to XCom (keys input_fingerprint and skip_reason).
+        :param state_table: Table name for the fingerprints of the last successful run of every task.
+        :param args:
+        :param kwargs:
+        """
+        super(LoadRollupOperator, self).__init__(*args, **kwargs)
+        self.db_conn_id = db_conn_id
+        self.table = table
+        self.fact_table = fact_table
+        self.create_func = create_func
+        self.insert_func = insert_func
+        self.bucket_column = bucket_column
+        self.grain_ms = grain_ms
+        self.incremental = incremental
+        self.skip = skip
+        self.instrument = instrument
+        self.explain = explain
+        self.partition = partition
+        self.skip_unchanged = skip_unchanged
+        self.state_table = state_table
+
+    def execute(self, context):
+        """
+        Merges the fact rows of the run into the rollup: the buckets the run's window touches are deleted and
+        re-aggregated from the fact rows of those buckets, in a single transaction. The fact merge replaces the
+        rows of the window, so these are exactly the new rows of the run, and a retry replaces the same buckets
+        instead of counting them twice.
+        :param context:
+        :return:
+        """
+        if not self.skip:
+            context = partition_context(context, self.partition)
+            db = instrument(self, PostgresHook(self.db_conn_id))
+            try:
+                window = align_window(execution_window(context), self.grain_ms) if self.incremental else None
+                fingerprint = None
+                if self.skip_unchanged:
+                    fingerprint, upstream_reasons = derived_fingerprint(
+                        self, context, {"table": self.table, "fact_table": self.fact_table,
+                                        "insert_func": self.insert_func.__name__, "window": window})
+                    reason = check_fingerprint(self, db, context, fingerprint, self.table, upstream_reasons)
+                    if reason:
+                        self.log.info(f"Skipping the update of rollup {self.table}: {reason}")
+                        return
+                db.run(adapt_sql(self.create_func(self.table), is_redshift(db)))
+                if window is None:
+                    self.log.info(f"Recomputing rollup {self.table} from {self.fact_table}.")
+                else:
+                    self.log.info(f"Merging the {self.fact_table} rows between {window[0]} and {window[1]} into "
+                                  f"rollup {self.table}.")
+                db.run([
+                    SqlQueries.rollup_delete(self.table, self.bucket_column, window),
+                    self.insert_func(self.table, self.fact_table, window)
+                ])
+                save_fingerprint(self, db, context, fingerprint)
+            finally:
+                publish_metrics(db, context)
+        else:
+            self.log.info("Skipping step after user selection.")
@@ -1,10 +1,20 @@
-from airflow.contrib.hooks.aws_hook import AwsHook
+import datetime
+import itertools
+import time
+
+from airflow.hooks.S3_hook import S3Hook
 from airflow.hooks.postgres_hook import PostgresHook
 from airflow.models import BaseOperator
 from airflow.models import Variable
 from airflow.utils.decorators import apply_defaults
 
-from helpers import SqlQueries
+from helpers import (SqlQueries, list_s3_objects, pending_objects, ledger_entries, build_copy_manifest, is_redshift,
+                     read_ledger, add_load_key, replaced_loads, reloaded_keys,
+                     adapt_sql, STAGING_COLUMNS, list_source_objects, iter_json_records, iter_staging_lines, copy_lines,
+                     instrument, publish_metrics, record_metric, STAGING_SCHEMAS, sample_widths, record_fields,
+                     copy_converted, partition_context, batch_table, expired_batches, plan_load_chunks,
+                     chunk_manifest, objects_fingerprint, combine_fingerprints, check_fingerprint, save_fingerprint,
+                     apply_widths, WIDTHS_KEY)
 
 
 class RedshiftStagingOperator(BaseOperator):
@@ -12,7 +22,12 @@ class RedshiftStagingOperator(BaseOperator):
 
     @apply_defaults
     def __init__(self, db_conn_id="", aws_credentials_id="", table="", s3_bucket="", s3_key="", delimiter="",
-                 ignore_headers=1, clean=False, staging_type="", json_conf="", skip=False,*args, **kwargs):
+                 ignore_headers=1, clean=False, staging_type="", json_conf="", skip=False, incremental=False,
+                 ledger_table="staging_loaded_files", manifest_bucket="", manifest_prefix="manifests/", local_path="",
+                 batch_size=10000, copy_manifest="", instrument=False, explain=False, schema=None, sample_size=0,
+                 copy_format="json", partition="", batched=False, retention_days=7, match_keys_table="",
+                 chunk_size=0, checkpoint_table="staging_checkpoints", skip_unchanged=False,
+                 state_table="task_fingerprints", *args, **kwargs):
         """
         Initiates the operator.
         :param db_conn_id: Connection to the Redshift database saved in Airflow.
@@ -26,6 +41,55 @@ class RedshiftStagingOperator(BaseOperator):
         :param staging_type: songs or logs
         :param json_conf: If we are staging the logs data, we have to pass the json map for this data. Full s3 path.
         :param skip: Skips the step if passed.
+        :param incremental: Bool, if set to True, only the objects under the rendered s3_key that are not yet in the
+        ledger (or whose etag changed) are copied, through a generated manifest. Every load is copied into a scratch
+        table and inserted with a load key of its own, recorded in the ledger next to its files. When a file changes,
+        the rows of the load that copied its previous version are deleted in the same transaction as the new copy,
+        and the other files of that load are copied again with it.
+        :param ledger_table: Table name for the ledger of the s3 objects already loaded.
+        :param manifest_bucket: Bucket where the generated manifests are written. Defaults to the Airflow Variable
+        "staging_manifest_bucket", or to s3_bucket if that is not set.
+        :param manifest_prefix: s3 prefix where the generated manifests are written.
+        :param local_path: Only used when the connection is a plain Postgres database. Local file, directory or path
+        prefix to load instead of the s3 prefix. It is rendered with the context, like s3_key.
+        :param batch_size: Only used when the connection is a plain Postgres database. Number of rows per COPY buffer.
+        :param copy_manifest: Path of a manifest of gzip-compressed chunks, as written by CompactFilesOperator. If set,
+        the data is copied from the chunks in it instead of the s3 prefix. It is rendered with the context. With
+        incremental, the chunks whose source files are all in the ledger are skipped, and the ledger records the
+        source files of the chunks rather than the chunks.
+        :param instrument: Bool, if set to True, every statement is timed and its row count captured, and the
+        metrics are pushed to XCom (key query_metrics) and to StatsD (Airflow's [scheduler] statsd_* settings).
+        :param explain: Bool, only with instrument. If set to True, the EXPLAIN plan of every query is captured too.
+        :param schema: StagingSchema of the table (types, widths, encodings, dist and sort keys). Defaults to the
+        schema registered for the staging_type in helpers.staging_schema.
+        :param sample_size: If greater than 0, the VARCHAR widths of the schema are inferred from the first
+        sample_size records of the source when the table is created. Ignored once the table exists, and when an
+        upstream ValidateRecordsOperator pushed the widths it checked the records against (XCom key staging_widths):
+        the table is then created with those.
+        :param copy_format: Only with copy_manifest. Format of the chunks, as the output_format of
+        CompactFilesOperator: json (default), csv or parquet. csv and parquet are copied with COMPUPDATE OFF and
+        STATUPDATE OFF, since the encodings come from the schema.
+        :param partition: Day (YYYY-MM-DD) the task is scoped to, for the backfill groups. The context is rendered as
+        if the run had been scheduled for that day (see helpers.batch_window.partition_context).
+        :param batched: Bool, if set to True, every run is loaded into a table of its own, named after the table and
+        the batch id of the run (its ds_nodash, see helpers.batch_window.batch_table), instead of appending to the
+        table. The batch table is dropped and created again on every try, so clean and incremental are ignored.
+        Downstream tasks read the batch of their run through the same name, e.g. logs_raw_data_{ds_nodash}.
+        :param retention_days: Only with batched. Batch tables older than this many days before the run's batch are
+        dropped after the load. None keeps them all.
+        :param match_keys_table: Only for the songs. If set, the normalised match keys of the staged songs that are
+        not in this table yet (see helpers.match_keys) are added to it after the load, for the match_key strategy of
+        LoadFactOperator.
+        :param chunk_size: If greater than 0, the files of the load are split into chunks of chunk_size files, every
+        chunk is loaded in its own transaction and recorded in checkpoint_table, and a retry of the run skips the
+        chunks already loaded instead of loading everything again. The data is then copied from the files listed
+        under the source (see source_path), through a manifest per chunk on Redshift.
+        :param checkpoint_table: Table name for the checkpoints of the chunks loaded, keyed by run id and table.
+        :param skip_unchanged: Bool, if set to True, the files of the source are fingerprinted from their keys, etags
+        and sizes (see helpers.fingerprints), and the load is skipped when the fingerprint matches the one of the last
+        successful run and the table exists. The fingerprint and the skip reason are pushed to XCom (keys
+        input_fingerprint and skip_reason), so the downstream tasks can tell their inputs did not change.
+        :param state_table: Table name for the fingerprints of the last successful run of every task.
         :param args:
         :param kwargs:
         """
@@ -41,6 +105,26 @@ class RedshiftStagingOperator(BaseOperator):
         self.staging_type = staging_type
         self.json_conf = json_conf
         self.skip = skip
+        self.incremental = incremental
+        self.ledger_table = ledger_table
+        self.manifest_bucket = manifest_bucket
+        self.manifest_prefix = manifest_prefix
+        self.local_path = local_path
+        self.batch_size = batch_size
+        self.copy_manifest = copy_manifest
+        self.instrument = instrument
+        self.explain = explain
+        self.partition = partition
+        self.schema = schema or STAGING_SCHEMAS.get(staging_type)
+        self.sample_size = sample_size
+        self.copy_format = copy_format
+        self.batched = batched
+        self.retention_days = retention_days
+        self.match_keys_table = match_keys_table
+        self.chunk_size = chunk_size
+        self.checkpoint_table = checkpoint_table
+        self.skip_unchanged = skip_unchanged
+        self.state_table = state_table
 
     def execute(self, context):
         """
@@ -49,40 +133,425 @@ class RedshiftStagingOperator(BaseOperator):
         :return:
         """
         if not self.skip:
-            aws_hook = AwsHook(self.aws_credentials_id)
-            credentials = aws_hook.get_credentials()
-            db = PostgresHook(self.db_conn_id)
-            self.log.info("Creating table if not exists.")
-            if self.staging_type == "songs":
-                create_query = SqlQueries.staging_songs_table_create(self.table)
+            context = partition_context(context, self.partition)
+            db = instrument(self, PostgresHook(self.db_conn_id))
+            try:
+                redshift = is_redshift(db)
+                table = batch_table(self.table, context["ds_nodash"]) if self.batched else self.table
+                rendered_key = self.s3_key.format(**context)
+                fingerprint = None
+                if self.skip_unchanged:
+                    fingerprint = self.input_fingerprint(redshift, table, rendered_key, context)
+                    reason = check_fingerprint(self, db, context, fingerprint, table)
+                    if reason:
+                        self.log.info(f"Skipping the load of {table}: {reason}")
+                        return
+                completed = set()
+                if self.chunk_size:
+                    db.run(SqlQueries.staging_checkpoint_create(self.checkpoint_table))
+                    completed = {chunk_id for chunk_id, in db.get_records(
+                        SqlQueries.staging_checkpoint_select(self.checkpoint_table, context["run_id"], table))}
+                if self.batched and not completed:
+                    self.log.info(f"Loading the batch {context['ds_nodash']} into {table}.")
+                    db.run(SqlQueries.delete_table(table))
+                self.log.info("Creating table if not exists.")
+                schema = self.schema
+                if not db.get_first(SqlQueries.table_exists(table))[0]:
+                    widths = self.validated_widths(context)
+                    if widths:
+                        self.log.info(f"Creating {table} with the VARCHAR widths its records were validated against.")
+                        schema = apply_widths(self.schema, widths)
+                    elif self.sample_size:
+                        schema = self.sample_schema(redshift, rendered_key, context)
+                incremental = self.incremental and not self.batched
+                db.run(adapt_sql(SqlQueries.staging_table_create(table, schema, load_key=incremental), redshift))
+                if incremental:
+                    add_load_key(db, table)
+                if self.clean and not self.batched and not completed:
+                    self.log.info("Cleaning table.")
+                    clean_query = self.clean_table()
+                    db.run(clean_query)
+                self.log.info("Streaming data from s3 to db.")
+                if self.chunk_size:
+                    self.copy_chunked(db, table, redshift, rendered_key, context, completed)
+                elif not redshift:
+                    self.copy_local(db, table, rendered_key, context)
+                elif self.copy_manifest:
+                    self.copy_compacted(db, table, self.copy_manifest.format(**context), context)
+                elif incremental:
+                    self.copy_incremental(db, redshift, rendered_key, context)
+                else:
+                    s3_path = f"s3://{self.s3_bucket}/{rendered_key}"
+                    if self.staging_type == "songs":
+                        copy_query = self.copy_table_songs(copy_table=table, source=s3_path)
+                    else:
+                        copy_query = self.copy_table_logs(copy_table=table, source=s3_path, json_conf=self.json_conf)
+                    db.run(copy_query)
+                    self.log.info(f"Data copied successfully into {table}")
+                if self.match_keys_table:
+                    self.log.info(f"Adding the new match keys of {table} to {self.match_keys_table}.")
+                    db.run(adapt_sql(SqlQueries.song_match_keys_create(self.match_keys_table), redshift))
+                    db.run(adapt_sql(SqlQueries.song_match_keys_insert(self.match_keys_table, table), redshift))
+                if self.batched and self.retention_days is not None:
+                    self.drop_expired_batches(db, context["ds_nodash"])
+                save_fingerprint(self, db, context, fingerprint)
+            finally:
+                publish_metrics(db, context)
+        else:
+            self.log.info("Skipping step after user selection.")
+
+    def copy_incremental(self, db, redshift, rendered_key, context):
+        """
+        Copies only the new or changed objects under the rendered key, and records them in the ledger.
+        The COPY and the ledger update run in the same transaction, so a failed load can be retried safely.
+        :param db: PostgresHook to the database.
+        :param redshift: Bool, whether the database is Redshift.
+        :param rendered_key: s3 key rendered for the current execution_date.
+        :param context:
+        :return:
+        """
+        s3 = S3Hook(aws_conn_id=self.aws_credentials_id)
+        objects = list_s3_objects(s3.get_conn(), self.s3_bucket, rendered_key)
+        pending, replaced = self.pending_load(db, objects)
+        self.log.info(f"Found {len(objects)} objects under {rendered_key}, {len(pending)} new or changed.")
+        if not pending:
+            self.log.info(f"Nothing new to copy into {self.table}.")
+            return
+        manifest_bucket = self.manifest_bucket or Variable.get('staging_manifest_bucket', default_var=self.s3_bucket)
+        manifest_key = f"{self.manifest_prefix}{self.table}/{context['ts_nodash']}.manifest"
+        s3.load_string(build_copy_manifest(self.s3_bucket, pending), key=manifest_key,
+                       bucket_name=manifest_bucket, replace=True)
+        manifest_path = f"s3://{manifest_bucket}/{manifest_key}"
+        scratch, scratch_create = self.scratch_table(db, self.table, redshift)
+        if self.staging_type == "songs":
+            copy_query = self.copy_table_songs(copy_table=scratch, source=manifest_path, manifest=True)
+        else:
+            copy_query = self.copy_table_logs(copy_table=scratch, source=manifest_path, json_conf=self.json_conf,
+                                              manifest=True)
+        db.run(self.replace_statements(self.table, replaced) + [scratch_create, copy_query]
+               + self.record_statements(self.table, scratch, pending, self.load_key(context)))
+        self.log.info(f"Copied {len(pending)} objects into {self.table} through {manifest_path}")
+
+    def copy_compacted(self, db, table, manifest_path, context):
+        """
+        Copies the gzip-compressed chunks listed in a manifest written by CompactFilesOperator. With incremental, only
+        the chunks with new or changed source files are copied, and their source files are recorded in the ledger in
+        the same transaction.
+        :param db: PostgresHook to the database.
+        :param table: Table the chunks are copied into.
+        :param manifest_path: Full s3 path of the manifest.
+        :param context:
+        :return:
+        """
+        if not (self.incremental and not self.batched):
+            db.run(self.manifest_copy_query(table, manifest_path, compacted=True))
+            self.log.info(f"Data copied successfully into {table} from {manifest_path}")
+            return
+        chunks = list_source_objects(manifest_path, S3Hook(aws_conn_id=self.aws_credentials_id).get_conn())
+        pending, replaced = self.pending_load(db, chunks)
+        self.log.info(f"Found {len(chunks)} chunks in {manifest_path}, {len(pending)} with new or changed files.")
+        if not pending:
+            self.log.info(f"Nothing new to copy into {table}.")
+            return
+        if len(pending) < len(chunks):
+            manifest_path = self.write_chunk_manifest(pending, table, "pending", context)
+        scratch, scratch_create = self.scratch_table(db, table, True)
+        db.run(self.replace_statements(table, replaced)
+               + [scratch_create, self.manifest_copy_query(scratch, manifest_path, compacted=True)]
+               + self.record_statements(table, scratch, ledger_entries(pending), self.load_key(context)))
+        self.log.info(f"Copied {len(pending)} chunks into {table} from {manifest_path}")
+
+    def manifest_copy_query(self, table, manifest_path, compacted):
+        """
+        Builds the COPY of the files listed in a manifest.
+        :param table: Table the files are copied into.
+        :param manifest_path: Full s3 path of the manifest.
+        :param compacted: Bool, whether the files are chunks written by CompactFilesOperator (gzip json, or the
+        copy_format) rather than the json source files.
+        :return: The COPY statement.
+        """
+        if compacted and self.copy_format != "json":
+            return SqlQueries.staging_table_copy_converted(table, manifest_path, Variable.get('redshift_iam_arn'),
+                                                           self.copy_format)
+        if self.staging_type == "songs":
+            return self.copy_table_songs(copy_table=table, source=manifest_path, manifest=True, gzip=compacted)
+        return self.copy_table_logs(copy_table=table, source=manifest_path, json_conf=self.json_conf, manifest=True,
+                                    gzip=compacted)
+
+    def copy_local(self, db, table, rendered_key, context):
+        """
+        Loads the json files into a plain Postgres database, streaming them through COPY FROM STDIN in batches.
+        The files are read from local_path if set, otherwise from the s3 prefix.
+        :param db: PostgresHook to the database.
+        :param table: Table the files are loaded into.
+        :param rendered_key: s3 key rendered for the current execution_date.
+        :param context:
+        :return:
+        """
+        source, s3_client = self.source_path(False, rendered_key, context)
+        objects = list_source_objects(source, s3_client)
+        incremental = self.incremental and not self.batched
+        replaced = set()
+        if incremental:
+            objects, replaced = self.pending_load(db, objects)
+        if not objects:
+            self.log.info(f"Nothing new to copy into {table}.")
+            return
+        self.log.info(f"Streaming {len(objects)} files from {source} into {table}.")
+        conn = db.get_conn()
+        try:
+            if incremental:
+                scratch, scratch_create = self.scratch_table(db, table, False)
+                with conn.cursor() as cursor:
+                    for statement in self.replace_statements(table, replaced) + [scratch_create]:
+                        cursor.execute(statement)
+                rows = self.stream_objects(db, conn, scratch, objects, s3_client)
+                with conn.cursor() as cursor:
+                    for statement in self.record_statements(table, scratch, ledger_entries(objects),
+                                                            self.load_key(context)):
+                        cursor.execute(statement)
             else:
-                create_query = SqlQueries.staging_logs_table_create(self.table)
-            db.run(create_query)
-            if self.clean:
-                self.log.info("Cleaning table.")
-                clean_query = self.clean_table()
-                db.run(clean_query)
-            self.log.info("Streaming data from s3 to db.")
-            rendered_key = self.s3_key.format(**context)
-            s3_path = f"s3://{self.s3_bucket}/{rendered_key}"
-            if self.staging_type == "songs":
-                copy_query = self.copy_table_songs(copy_table=self.table, source=s3_path)
+                rows = self.stream_objects(db, conn, table, objects, s3_client)
+            conn.commit()
+        finally:
+            conn.close()
+        self.log.info(f"Copied {rows} rows into {table}")
+
+    def stream_objects(self, db, conn, table, objects, s3_client):
+        """
+        Streams files into a plain Postgres table through COPY FROM STDIN. Does not commit.
+        :param db: PostgresHook to the database, for the metrics.
+        :param conn: psycopg2 connection of the load.
+        :param table: Table the files are loaded into.
+        :param objects: List of objects as returned by list_source_objects.
+        :param s3_client: boto3 s3 client, only needed for s3 files.
+        :return: Number of rows loaded.
+        """
+        start = time.perf_counter()
+        if self.copy_manifest and self.copy_format != "json":
+            rows = copy_converted(conn, table, self.schema.columns, [obj["key"] for obj in objects],
+                                  self.copy_format, s3_client, self.batch_size)
+        else:
+            columns = [name for name, _ in STAGING_COLUMNS[self.staging_type]]
+            lines = iter_staging_lines(iter_json_records(objects, s3_client), self.staging_type, self.json_conf)
+            rows = copy_lines(conn, table, columns, lines, self.batch_size)
+        record_metric(db, f"COPY {table} FROM STDIN", time.perf_counter() - start, rows)
+        return rows
+
+    def copy_chunked(self, db, table, redshift, rendered_key, context, completed):
+        """
+        Loads the files of the source chunk by chunk. Every chunk is copied, recorded in the checkpoint table (and
+        in the ledger, with incremental) in a single transaction, so a failure rolls back the chunk being loaded
+        only, and a retry of the run skips the chunks already recorded for it.
+        :param db: PostgresHook to the database.
+        :param table: Table the files are loaded into.
+        :param redshift: Bool, whether the database is Redshift.
+        :param rendered_key: s3 key rendered for the current execution_date.
+        :param context:
+        :param completed: Set of the ids of the chunks already loaded by the run.
+        :return:
+        """
+        source, s3_client = self.source_path(redshift, rendered_key, context)
+        objects = list_source_objects(source, s3_client)
+        incremental = self.incremental and not self.batched
+        replaced = set()
+        if incremental:
+            objects, replaced = self.pending_load(db, objects)
+        chunks = plan_load_chunks(objects, self.chunk_size)
+        pending = [(chunk_id, chunk) for chunk_id, chunk in chunks if chunk_id not in completed]
+        self.log.info(f"Loading {len(objects)} files from {source} into {table} in {len(chunks)} chunks, "
+                      f"{len(chunks) - len(pending)} already loaded by run {context['run_id']}.")
+        for chunk_id, chunk in pending:
+            loaded_at = datetime.datetime.utcnow().strftime("%Y-%m-%d %H:%M:%S")
+            before = []
+            target = table
+            bookkeeping = [SqlQueries.staging_checkpoint_insert(self.checkpoint_table, context["run_id"], table,
+                                                                chunk_id, len(chunk), loaded_at)]
+            if incremental:
+                # The replaced loads go with the first chunk: their files left in the ledger are pending again.
+                target, scratch_create = self.scratch_table(db, table, redshift)
+                before = self.replace_statements(table, replaced) + [scratch_create]
+                replaced = set()
+                bookkeeping = self.record_statements(table, target, ledger_entries(chunk),
+                                                     self.load_key(context, chunk_id)) + bookkeeping
+            if redshift:
+                manifest_path = self.write_chunk_manifest(chunk, table, chunk_id, context)
+                db.run(before + [self.manifest_copy_query(target, manifest_path, compacted=bool(self.copy_manifest))]
+                       + bookkeeping)
             else:
-                copy_query = self.copy_table_logs(copy_table=self.table, source=s3_path, json_conf=self.json_conf)
-            db.run(copy_query)
-            self.log.info(f"Data copied successfully into {self.table}")
+                conn = db.get_conn()
+                try:
+                    with conn.cursor() as cursor:
+                        for statement in before:
+                            cursor.execute(statement)
+                    self.stream_objects(db, conn, target, chunk, s3_client)
+                    with conn.cursor() as cursor:
+                        for statement in bookkeeping:
+                            cursor.execute(statement)
+                    conn.commit()
+                finally:
+                    conn.close()
+            self.log.info(f"Loaded chunk {chunk_id} ({len(chunk)} files) into {table}.")
+
+    def pending_load(self, db, objects):
+        """
+        Reads the ledger of the table and picks the objects to copy: the new or changed ones, and the ones copied by
+        a load that also copied a previous version of a changed object.
+        :param db: PostgresHook to the database.
+        :param objects: List of objects as returned by list_s3_objects or list_source_objects.
+        :return: Tuple with the list of the objects to copy and the set of the replaced loads.
+        """
+        loaded, loads = read_ledger(db, self.ledger_table, self.table)
+        replaced = replaced_loads(objects, loaded, loads)
+        if replaced:
+            self.log.info(f"Replacing the rows of {len(replaced)} loads with changed files: {', '.join(replaced)}")
+        return pending_objects(objects, loaded, reloaded_keys(loads, replaced)), replaced
+
+    def load_key(self, context, chunk_id=""):
+        return f"{context['run_id']}/{chunk_id}" if chunk_id else context["run_id"]
+
+    def scratch_table(self, db, table, redshift):
+        """
+        Builds the temporary table a load is copied into before its rows are inserted with their load key, with the
+        VARCHAR widths of the table.
+        :param db: PostgresHook to the database.
+        :param table: Table the load is for.
+        :param redshift: Bool, whether the database is Redshift.
+        :return: Tuple with the name of the scratch table and the statement that creates it.
+        """
+        scratch = f"{table}_pending"
+        schema = apply_widths(self.schema, dict(db.get_records(SqlQueries.column_widths(table))))
+        return scratch, adapt_sql(SqlQueries.staging_table_create(scratch, schema, temporary=True), redshift)
+
+    def replace_statements(self, table, replaced):
+        """
+        Deletes the rows and the ledger entries of the replaced loads, in the transaction of the load replacing them.
+        :param table: Table of the load.
+        :param replaced: Set of the load keys to replace.
+        :return: List of statements.
+        """
+        if not replaced:
+            return []
+        return [SqlQueries.staging_load_delete(table, replaced),
+                SqlQueries.staging_ledger_delete_loads(self.ledger_table, self.table, replaced)]
+
+    def record_statements(self, table, scratch, entries, load_key):
+        """
+        Inserts the rows of the scratch table into the table with the load key, and records the files in the ledger.
+        :param table: Table of the load.
+        :param scratch: Scratch table the load was copied into.
+        :param entries: Objects to record in the ledger, see ledger_entries.
+        :param load_key: Key of the load.
+        :return: List of statements.
+        """
+        loaded_at = datetime.datetime.utcnow().strftime("%Y-%m-%d %H:%M:%S")
+        return [SqlQueries.staging_load_insert(table, scratch, self.schema, load_key),
+                SqlQueries.delete_table(scratch),
+                SqlQueries.staging_ledger_delete(self.ledger_table, self.table, [obj["key"] for obj in entries]),
+                SqlQueries.staging_ledger_insert(self.ledger_table, self.table, entries, loaded_at, load_key)]
+
+    def write_chunk_manifest(self, chunk, table, chunk_id, context):
+        """
+        Writes the COPY manifest of a chunk next to the manifests of the incremental mode.
+        :param chunk: List of the objects of the chunk.
+        :param table: Table the chunk is loaded into.
+        :param chunk_id: Id of the chunk.
+        :param context:
+        :return: Full s3 path of the manifest.
+        """
+        s3 = S3Hook(aws_conn_id=self.aws_credentials_id)
+        manifest_bucket = self.manifest_bucket or Variable.get('staging_manifest_bucket', default_var=self.s3_bucket)
+        manifest_key = f"{self.manifest_prefix}{table}/{context['ts_nodash']}/chunk-{chunk_id}.manifest"
+        s3.load_string(chunk_manifest(chunk), key=manifest_key, bucket_name=manifest_bucket, replace=True)
+        return f"s3://{manifest_bucket}/{manifest_key}"
+
+    def source_path(self, redshift, rendered_key, context):
+        """
+        Resolves where the files of the run are read from: the manifest of compacted chunks if set, the local_path
+        when the database is a plain Postgres, the s3 prefix otherwise.
+        :param redshift: Bool, whether the database is Redshift.
+        :param rendered_key: s3 key rendered for the current execution_date.
+        :param context:
+        :return: Tuple with the source and the boto3 s3 client to read it (None for local sources).
+        """
+        if self.copy_manifest:
+            source = self.copy_manifest.format(**context)
+        elif self.local_path and not redshift:
+            source = self.local_path.format(**context)
         else:
-            self.log.info(f"Skipping step after user selection.")
+            source = f"s3://{self.s3_bucket}/{rendered_key}"
+        s3_client = S3Hook(aws_conn_id=self.aws_credentials_id).get_conn() if source.startswith("s3://") else None
+        return source, s3_client
+
+    def input_fingerprint(self, redshift, table, rendered_key, context):
+        """
+        Fingerprints the files the run loads, with the table they are loaded into.
+        :param redshift: Bool, whether the database is Redshift.
+        :param table: Table the run loads into.
+        :param rendered_key: s3 key rendered for the current execution_date.
+        :param context:
+        :return: The fingerprint.
+        """
+        source, s3_client = self.source_path(redshift, rendered_key, context)
+        objects = list_source_objects(source, s3_client)
+        return combine_fingerprints({"source": objects_fingerprint(objects), "table": table,
+                                     "match_keys_table": self.match_keys_table})
+
+    def validated_widths(self, context):
+        """
+        Reads the VARCHAR widths an upstream ValidateRecordsOperator checked the records of the run against.
+        :param context:
+        :return: Dictionary with the widths by column name, or None if no upstream task pushed them.
+        """
+        task_instance = context.get("ti") or context.get("task_instance")
+        if task_instance is None:
+            return None
+        for task_id in sorted(self.upstream_task_ids):
+            widths = task_instance.xcom_pull(task_ids=task_id, key=WIDTHS_KEY)
+            if widths:
+                return widths
+        return None
+
+    def sample_schema(self, redshift, rendered_key, context):
+        """
+        Sizes the VARCHAR columns of the schema from the first sample_size records of the source.
+        :param redshift: Bool, whether the database is Redshift.
+        :param rendered_key: s3 key rendered for the current execution_date.
+        :param context:
+        :return: The sampled StagingSchema.
+        """
+        source, s3_client = self.source_path(redshift, rendered_key, context)
+        records = itertools.islice(iter_json_records(list_source_objects(source, s3_client), s3_client),
+                                   self.sample_size)
+        schema = sample_widths(self.schema, records, record_fields(self.staging_type, self.json_conf))
+        widths = ", ".join(f"{column.name}({column.width})" for column in schema.columns if column.width)
+        self.log.info(f"Sampled the VARCHAR widths of {self.table} from {source}: {widths}")
+        return schema
+
+    def drop_expired_batches(self, db, batch_id):
+        """
+        Drops the batch tables that fall out of the retention, in a single transaction. Dropping whole tables leaves
+        nothing behind for a vacuum to reclaim, unlike deleting the old rows.
+        :param db: PostgresHook to the database.
+        :param batch_id: Id of the current batch.
+        :return:
+        """
+        tables = [name for name, in db.get_records(SqlQueries.batch_tables(self.table))]
+        expired = expired_batches(self.table, tables, batch_id, self.retention_days)
+        if expired:
+            self.log.info(f"Dropping {len(expired)} batches out of the {self.retention_days} days retention: "
+                          f"{', '.join(expired)}")
+            db.run([SqlQueries.delete_table(name) for name in expired])
 
     def clean_table(self):
         return f"DELETE FROM {self.table};"
 
     @staticmethod
-    def copy_table_songs(copy_table="", source=""):
+    def copy_table_songs(copy_table="", source="", manifest=False, gzip=False):
         arn = Variable.get('redshift_iam_arn')
-        return SqlQueries.staging_songs_table_copy(copy_table, source, arn)
+        return SqlQueries.staging_songs_table_copy(copy_table, source, arn, manifest, gzip)
 
     @staticmethod
-    def copy_table_logs(copy_table="", source="", json_conf=""):
+    def copy_table_logs(copy_table="", source="", json_conf="", manifest=False, gzip=False):
         arn = Variable.get('redshift_iam_arn')
-        return SqlQueries.staging_logs_table_copy(copy_table, source, arn, json_conf)
+        return SqlQueries.staging_logs_table_copy(copy_table, source, arn, json_conf, manifest, gzip)
@@ -0,0 +1,75 @@
+import time
+
+from airflow.hooks.postgres_hook import PostgresHook
+from airflow.models import BaseOperator
+from airflow.utils.decorators import apply_defaults
+
+from helpers import (is_redshift, instrument, publish_metrics, TableHealth, health_query, plan_maintenance,
+                     DEFAULT_THRESHOLDS)
+
+
+class TableMaintenanceOperator(BaseOperator):
+    ui_color = '#b0b0e8'
+
+    @apply_defaults
+    def __init__(self, db_conn_id="", tables=(), thresholds=None, time_budget=1800, skip=False, instrument=False,
+                 *args, **kwargs):
+        """
+        Initiates the operator.
+        :param db_conn_id: Connection to the Redshift database saved in Airflow.
+        :param tables: Names of the tables to maintain.
+        :param thresholds: Dictionary with the unsorted, stats_off and deleted thresholds, in percents, past which a
+        table is vacuumed or analyzed. Missing keys default to helpers.maintenance.DEFAULT_THRESHOLDS.
+        :param time_budget: Seconds the maintenance may take. No new VACUUM or ANALYZE is started once it is spent,
+        the remaining tables are left for the next run (the worst ones go first).
+        :param skip: Bool, if set to True, the operator will skip.
+        :param instrument: Bool, if set to True, every statement is timed and its row count captured, and the
+        metrics are pushed to XCom (key query_metrics) and to StatsD (Airflow's [scheduler] statsd_* settings).
+        :param args:
+        :param kwargs:
+        """
+        super(TableMaintenanceOperator, self).__init__(*args, **kwargs)
+        self.db_conn_id = db_conn_id
+        self.tables = tables
+        self.thresholds = dict(DEFAULT_THRESHOLDS, **(thresholds or {}))
+        self.time_budget = time_budget
+        self.skip = skip
+        self.instrument = instrument
+
+    def execute(self, context):
+        """
+        Reads the health of the tables, and vacuums or analyzes the ones past the thresholds, the worst first, until
+        the time budget is spent.
+        :param context:
+        :return:
+        """
+        if not self.skip:
+            db = instrument(self, PostgresHook(self.db_conn_id))
+            try:
+                redshift = is_redshift(db)
+                health = [TableHealth(table, rows or 0, float(unsorted), float(stats_off), float(deleted))
+                          for table, rows, unsorted, stats_off, deleted
+                          in db.get_records(health_query(self.tables, redshift))]
+                for table in health:
+                    self.log.info(f"{table.table}: {table.rows} rows, {table.unsorted:.1f}% unsorted, statistics "
+                                  f"{table.stats_off:.1f}% off, {table.deleted:.1f}% deleted.")
+                tasks = plan_maintenance(health, self.thresholds, redshift)
+                if not tasks:
+                    self.log.info("Every table is within the thresholds.")
+                    return
+                start = time.perf_counter()
+                for index, task in enumerate(tasks):
+                    elapsed = time.perf_counter() - start
+                    if elapsed >= self.time_budget:
+                        deferred = ", ".join(f"{left.action} {left.table}" for left in tasks[index:])
+                        self.log.warning(f"Time budget of {self.time_budget}s spent, deferring to the next run: "
+                                         f"{deferred}")
+                        break
+                    self.log.info(f"Running {task.statement} ({task.reason}).")
+                    # VACUUM cannot run inside a transaction block.
+                    db.run(task.statement, autocommit=True)
+                self.log.info(f"Maintenance done in {time.perf_counter() - start:.1f}s.")
+            finally:
+                publish_metrics(db, context)
+        else:
+            self.log.info("Skipping step after user selection.")
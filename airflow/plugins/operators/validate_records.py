@@ -0,0 +1,159 @@
+import itertools
+import time
+
+from airflow.contrib.hooks.aws_hook import AwsHook
+from airflow.hooks.postgres_hook import PostgresHook
+from airflow.models import BaseOperator
+from airflow.utils.decorators import apply_defaults
+
+from helpers import (SqlQueries, is_redshift, list_source_objects, validate_files, record_fields, STAGING_SCHEMAS,
+                     execution_window, partition_context, HOUR_MS, iter_json_records, sample_widths, apply_widths,
+                     schema_widths, batch_table, WIDTHS_KEY)
+
+
+class ValidateRecordsOperator(BaseOperator):
+    ui_color = '#c9e87f'
+
+    @apply_defaults
+    def __init__(self, db_conn_id="", aws_credentials_id="", source="", staging_prefix="", quarantine_prefix="",
+                 staging_type="", json_conf="", schema=None, ts_slack_hours=24, max_reject_ratio=0.05, slices=0,
+                 target_chunk_size=64 * 1024 * 1024, workers=None, skip=False, partition="", table="", batched=False,
+                 sample_size=0, *args, **kwargs):
+        """
+        Initiates the operator.
+        :param db_conn_id: Connection to the Redshift database saved in Airflow. Used to read the number of slices.
+        :param aws_credentials_id: Connection to the aws credentials saved in Airflow.
+        :param source: s3://bucket/prefix or local path with the json files. It is rendered with the context.
+        :param staging_prefix: s3://bucket/prefix/ or local directory where the valid records and their manifest are
+        written. It is rendered with the context.
+        :param quarantine_prefix: s3://bucket/prefix/ or local directory where the rejected records and the summary of
+        the errors of every file are written. It is rendered with the context.
+        :param staging_type: songs or logs. Selects the columns and the json mapping.
+        :param json_conf: Local jsonpaths file of the logs. Defaults to the layout of
+        s3://udacity-dend/log_json_path.json.
+        :param schema: StagingSchema the records are checked against. Defaults to the schema registered for the
+        staging_type. Its VARCHAR widths are replaced by the ones the staging table is created with (see table).
+        :param ts_slack_hours: Records whose ts falls more than this many hours outside of the run's window are
+        rejected. None accepts any ts.
+        :param max_reject_ratio: The task fails if more than this share of the records is rejected, as the source is
+        then more likely broken than dirty.
+        :param slices: Number of slices of the cluster. If 0, it is read from the database (1 for plain Postgres).
+        :param target_chunk_size: Target size of every chunk of valid records in bytes, before compression.
+        :param workers: Number of worker processes. Defaults to the number of cpus.
+        :param skip: Bool, if set to True, the operator will skip.
+        :param partition: Day (YYYY-MM-DD) the task is scoped to, for the backfill groups. The context is rendered as
+        if the run had been scheduled for that day (see helpers.batch_window.partition_context).
+        :param table: Staging table the valid records are loaded into. If it exists, the records are checked against
+        the VARCHAR widths of its columns.
+        :param batched: Bool, whether the staging table is a batch table of the run (see RedshiftStagingOperator).
+        :param sample_size: If greater than 0 and the staging table does not exist yet, the VARCHAR widths are
+        sampled from the first sample_size records of the source, as the staging operator would. The widths checked
+        are pushed to XCom (key staging_widths), and the staging operator creates the table with them.
+        :param args:
+        :param kwargs:
+        """
+        super(ValidateRecordsOperator, self).__init__(*args, **kwargs)
+        self.db_conn_id = db_conn_id
+        self.aws_credentials_id = aws_credentials_id
+        self.source = source
+        self.staging_prefix = staging_prefix
+        self.quarantine_prefix = quarantine_prefix
+        self.staging_type = staging_type
+        self.json_conf = json_conf
+        self.schema = schema or STAGING_SCHEMAS.get(staging_type)
+        self.ts_slack_hours = ts_slack_hours
+        self.max_reject_ratio = max_reject_ratio
+        self.slices = slices
+        self.target_chunk_size = target_chunk_size
+        self.workers = workers
+        self.skip = skip
+        self.partition = partition
+        self.table = table
+        self.batched = batched
+        self.sample_size = sample_size
+
+    def execute(self, context):
+        """
+        Checks every record of the source against the staging schema ahead of COPY, so a malformed record is set
+        aside instead of failing the load. The valid records are written as gzip json chunks with a COPY manifest,
+        and the rejects to the quarantine prefix.
+        :param context:
+        :return: The path of the manifest, so the staging operator can COPY from it.
+        """
+        if not self.skip:
+            context = partition_context(context, self.partition)
+            source = self.source.format(**context)
+            staging_prefix = self.staging_prefix.format(**context)
+            quarantine_prefix = self.quarantine_prefix.format(**context)
+            client_kwargs = {}
+            s3_client = None
+            if any(path.startswith("s3://") for path in (source, staging_prefix, quarantine_prefix)):
+                aws_hook = AwsHook(self.aws_credentials_id)
+                credentials = aws_hook.get_credentials()
+                client_kwargs = {"aws_access_key_id": credentials.access_key,
+                                 "aws_secret_access_key": credentials.secret_key,
+                                 "aws_session_token": credentials.token}
+                s3_client = aws_hook.get_client_type("s3")
+            ts_range = None
+            if self.ts_slack_hours is not None:
+                window = execution_window(context)
+                slack = self.ts_slack_hours * HOUR_MS
+                ts_range = (window[0] - slack, window[1] + slack)
+            objects = list_source_objects(source, s3_client)
+            slices = self.slices or self.get_slices()
+            schema = self.target_schema(objects, s3_client, context)
+            task_instance = context.get("ti") or context.get("task_instance")
+            if task_instance is not None:
+                task_instance.xcom_push(key=WIDTHS_KEY, value=schema_widths(schema))
+            self.log.info(f"Validating {len(objects)} files from {source} against the {self.staging_type} schema.")
+            start = time.perf_counter()
+            manifest_path, summary, results = validate_files(objects, staging_prefix, quarantine_prefix, schema,
+                                                             record_fields(self.staging_type, self.json_conf),
+                                                             ts_range, slices, self.target_chunk_size, self.workers,
+                                                             client_kwargs)
+            elapsed = time.perf_counter() - start
+            records = sum(file_summary["records"] for file_summary in summary.values())
+            rejected = sum(file_summary["rejected"] for file_summary in summary.values())
+            for key, file_summary in summary.items():
+                if file_summary["rejected"]:
+                    errors = ", ".join(f"{kind} ({count})" for kind, count in sorted(file_summary["errors"].items()))
+                    self.log.warning(f"Quarantined {file_summary['rejected']} of {file_summary['records']} records "
+                                     f"of {key}: {errors}")
+            self.log.info(f"Validated {records} records in {elapsed:.1f}s ({records / max(elapsed, 1e-9):.0f} "
+                          f"records/s), {rejected} quarantined under {quarantine_prefix}. Wrote {len(results)} "
+                          f"chunks and the manifest {manifest_path}")
+            if records and rejected / records > self.max_reject_ratio:
+                raise ValueError(f"{rejected} of {records} records failed the validation, more than the "
+                                 f"{self.max_reject_ratio:.0%} allowed. See {quarantine_prefix}summary.json")
+            return manifest_path
+        else:
+            self.log.info("Skipping step after user selection.")
+
+    def target_schema(self, objects, s3_client, context):
+        """
+        Resolves the schema the staging table of the run is created with: the widths of the table if it exists,
+        otherwise the widths sampled from the source with sample_size, otherwise the schema itself.
+        :param objects: List of the objects of the source, as returned by list_source_objects.
+        :param s3_client: boto3 s3 client, only needed for s3 sources.
+        :param context:
+        :return: The StagingSchema to check the records against.
+        """
+        if self.table:
+            table = batch_table(self.table, context["ds_nodash"]) if self.batched else self.table
+            widths = dict(PostgresHook(self.db_conn_id).get_records(SqlQueries.column_widths(table)))
+            if widths:
+                self.log.info(f"Checking the VARCHAR widths of the existing table {table}.")
+                return apply_widths(self.schema, widths)
+        if self.sample_size:
+            records = itertools.islice(iter_json_records(objects, s3_client), self.sample_size)
+            schema = sample_widths(self.schema, records, record_fields(self.staging_type, self.json_conf))
+            widths = ", ".join(f"{name}({width})" for name, width in schema_widths(schema).items())
+            self.log.info(f"Sampled the VARCHAR widths from the first {self.sample_size} records: {widths}")
+            return schema
+        return self.schema
+
+    def get_slices(self):
+        db = PostgresHook(self.db_conn_id)
+        if not is_redshift(db):
+            return 1
+        return db.get_first(SqlQueries.cluster_slices())[0]
@@ -0,0 +1,93 @@
+"""
+Benchmark of the small-file compaction step on the bundled song_data scaled up.
+
+Copies every file of resources/song_data --scale times into a temporary directory, compacts them with
+helpers.compaction and reports the files/sec of the compaction. If --dsn is given, it also loads the raw files and the
+compacted chunks into a Postgres staging table with the local COPY backend and compares both load times.
+
+    python benchmarks/compaction_benchmark.py --scale 1000 --dsn "dbname=sparkify user=postgres"
+"""
+import argparse
+import json
+import os
+import shutil
+import sys
+import tempfile
+import time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, os.path.join(ROOT, "airflow", "plugins"))
+
+from helpers import (SqlQueries, STAGING_COLUMNS, adapt_sql, list_source_objects, iter_json_records,  # noqa: E402
+                     iter_staging_lines, copy_lines, compact_files)
+
+
+def scale_song_data(source, destination, scale):
+    objects = list_source_objects(source)
+    for i in range(scale):
+        copy_dir = os.path.join(destination, f"copy-{i:05d}")
+        os.makedirs(copy_dir)
+        for obj in objects:
+            shutil.copyfile(obj["key"], os.path.join(copy_dir, os.path.basename(obj["key"])))
+    return len(objects) * scale
+
+
+def time_copy(dsn, source):
+    import psycopg2
+    table = "benchmark_songs_raw_data"
+    conn = psycopg2.connect(dsn)
+    try:
+        with conn.cursor() as cursor:
+            cursor.execute(SqlQueries.delete_table(table))
+            cursor.execute(adapt_sql(SqlQueries.staging_songs_table_create(table), redshift=False))
+        conn.commit()
+        start = time.perf_counter()
+        objects = list_source_objects(source)
+        lines = iter_staging_lines(iter_json_records(objects), "songs")
+        rows = copy_lines(conn, table, [name for name, _ in STAGING_COLUMNS["songs"]], lines)
+        conn.commit()
+        elapsed = time.perf_counter() - start
+        with conn.cursor() as cursor:
+            cursor.execute(SqlQueries.delete_table(table))
+        conn.commit()
+    finally:
+        conn.close()
+    return {"rows": rows, "seconds": elapsed}
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--scale", type=int, default=1000)
+    parser.add_argument("--slices", type=int, default=4)
+    parser.add_argument("--target-chunk-size", type=int, default=8 * 1024 * 1024)
+    parser.add_argument("--workers", type=int, default=None)
+    parser.add_argument("--dsn", default="", help="Postgres dsn. If set, the COPY times are measured too.")
+    args = parser.parse_args()
+
+    work_dir = tempfile.mkdtemp(prefix="sparkify-compaction-")
+    try:
+        raw_dir = os.path.join(work_dir, "song_data")
+        n_files = scale_song_data(os.path.join(ROOT, "resources", "song_data"), raw_dir, args.scale)
+        start = time.perf_counter()
+        objects = list_source_objects(raw_dir)
+        manifest_path, chunks = compact_files(objects, os.path.join(work_dir, "compacted"), args.slices,
+                                              args.target_chunk_size, args.workers)
+        elapsed = time.perf_counter() - start
+        results = {
+            "files": n_files,
+            "chunks": len(chunks),
+            "compaction_seconds": elapsed,
+            "files_per_second": n_files / elapsed,
+            "bytes_in": sum(chunk["bytes_in"] for chunk in chunks),
+            "bytes_out": sum(chunk["bytes_out"] for chunk in chunks),
+        }
+        if args.dsn:
+            results["copy_raw"] = time_copy(args.dsn, raw_dir)
+            results["copy_compacted"] = time_copy(args.dsn, manifest_path)
+        print(json.dumps(results, indent=2))
+    finally:
+        shutil.rmtree(work_dir)
+
+
+if __name__ == "__main__":
+    main()
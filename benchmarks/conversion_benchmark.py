@@ -0,0 +1,125 @@
+"""
+Benchmark of the conversion stage ahead of COPY: the json files of a scaled dataset are merged as gzip json chunks
+(the compaction step) and converted to gzip CSV and, if pyarrow is installed, to Parquet, with the same process pool.
+Reports the throughput of every output format and the size of its output relative to the raw json.
+
+If --dsn is given, the chunks of every format are also loaded into a Postgres staging table with the local COPY
+backend, and the load times are compared.
+
+    python benchmarks/conversion_benchmark.py --scale 20 --density 5 --dsn "dbname=sparkify user=postgres"
+"""
+import argparse
+import importlib.util
+import json
+import os
+import shutil
+import sys
+import tempfile
+import time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, os.path.join(ROOT, "airflow", "plugins"))
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+import workload  # noqa: E402
+from helpers import (SqlQueries, STAGING_COLUMNS, STAGING_SCHEMAS, adapt_sql, list_source_objects,  # noqa: E402
+                     iter_json_records, iter_staging_lines, copy_lines, compact_files, convert_files, copy_converted,
+                     record_fields)
+
+
+def output_formats():
+    formats = ["json", "csv"]
+    if importlib.util.find_spec("pyarrow") is None:
+        print("pyarrow is not installed, skipping parquet.", file=sys.stderr)
+    else:
+        formats.append("parquet")
+    return formats
+
+
+def convert(objects, staging_prefix, staging_type, output_format, slices, target_chunk_size, workers):
+    start = time.perf_counter()
+    if output_format == "json":
+        manifest_path, chunks = compact_files(objects, staging_prefix, slices, target_chunk_size, workers)
+    else:
+        manifest_path, chunks = convert_files(objects, staging_prefix, STAGING_SCHEMAS[staging_type],
+                                              record_fields(staging_type), output_format, slices,
+                                              target_chunk_size, workers)
+    elapsed = time.perf_counter() - start
+    bytes_in = sum(obj["size"] for obj in objects)
+    bytes_out = sum(chunk["bytes_out"] for chunk in chunks)
+    records = sum(chunk["records"] for chunk in chunks)
+    return manifest_path, {
+        "chunks": len(chunks),
+        "records": records,
+        "seconds": elapsed,
+        "records_per_second": records / elapsed,
+        "mb_per_second": bytes_in / elapsed / 1024 / 1024,
+        "bytes_in": bytes_in,
+        "bytes_out": bytes_out,
+        "size_ratio": bytes_out / bytes_in,
+    }
+
+
+def time_copy(dsn, manifest_path, staging_type, output_format):
+    import psycopg2
+    table = f"benchmark_{staging_type}_{output_format}"
+    conn = psycopg2.connect(dsn)
+    try:
+        with conn.cursor() as cursor:
+            cursor.execute(SqlQueries.delete_table(table))
+            cursor.execute(adapt_sql(SqlQueries.staging_table_create(table, STAGING_SCHEMAS[staging_type]),
+                                     redshift=False))
+        conn.commit()
+        start = time.perf_counter()
+        objects = list_source_objects(manifest_path)
+        if output_format == "json":
+            lines = iter_staging_lines(iter_json_records(objects), staging_type)
+            rows = copy_lines(conn, table, [name for name, _ in STAGING_COLUMNS[staging_type]], lines)
+        else:
+            rows = copy_converted(conn, table, STAGING_SCHEMAS[staging_type].columns,
+                                  [obj["key"] for obj in objects], output_format)
+        conn.commit()
+        elapsed = time.perf_counter() - start
+        with conn.cursor() as cursor:
+            cursor.execute(SqlQueries.delete_table(table))
+        conn.commit()
+    finally:
+        conn.close()
+    return {"rows": rows, "seconds": elapsed}
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--scale", type=int, default=10, help="Multiplier of the song and log files.")
+    parser.add_argument("--density", type=int, default=1, help="Multiplier of the events per day.")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--slices", type=int, default=4)
+    parser.add_argument("--target-chunk-size", type=int, default=64 * 1024 * 1024)
+    parser.add_argument("--workers", type=int, default=None)
+    parser.add_argument("--dsn", default="", help="Postgres dsn. If set, the COPY times are measured too.")
+    args = parser.parse_args()
+
+    work_dir = tempfile.mkdtemp(prefix="sparkify-conversion-")
+    try:
+        profile = workload.learn_profile(os.path.join(ROOT, "resources"))
+        workload.generate(profile, work_dir, scale=args.scale, density=args.density, seed=args.seed,
+                          workers=args.workers)
+        results = {}
+        for staging_type, folder in [("songs", "song_data"), ("logs", "log-data")]:
+            objects = list_source_objects(os.path.join(work_dir, folder))
+            results[staging_type] = {}
+            for output_format in output_formats():
+                manifest_path, result = convert(objects, os.path.join(work_dir, "converted", staging_type,
+                                                                      output_format),
+                                                staging_type, output_format, args.slices, args.target_chunk_size,
+                                                args.workers)
+                if args.dsn:
+                    result["copy"] = time_copy(args.dsn, manifest_path, staging_type, output_format)
+                results[staging_type][output_format] = result
+        print(json.dumps(results, indent=2))
+    finally:
+        shutil.rmtree(work_dir, ignore_errors=True)
+
+
+if __name__ == "__main__":
+    main()
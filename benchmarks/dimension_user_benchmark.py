@@ -0,0 +1,102 @@
+"""
+Benchmark of the user dimension builders on scaled log data: the legacy one (latest ts per user through
+WHERE (userid, ts) IN (SELECT userid, MAX(ts) ...), a second scan of the logs) against the ROW_NUMBER() one (a single
+pass), both for a whole table rebuild and for a one-day batch.
+
+Generates the logs with benchmarks/workload.py, loads them into a Postgres staging table with the local COPY backend,
+runs each builder --repeat times and checks that both produce the same users.
+
+    python benchmarks/dimension_user_benchmark.py --dsn "dbname=sparkify user=postgres" --density 50 --days 30
+"""
+import argparse
+import datetime
+import json
+import os
+import shutil
+import statistics
+import sys
+import tempfile
+import time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, os.path.join(ROOT, "airflow", "plugins"))
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+import workload  # noqa: E402
+from helpers import SqlQueries, adapt_sql, epoch_ms  # noqa: E402
+
+LOGS_TABLE = "benchmark_logs_raw_data"
+BUILDERS = {
+    "legacy": SqlQueries.dimension_user_insert,
+    "row_number": SqlQueries.dimension_user_insert_latest,
+}
+
+
+def time_builder(conn, builder, window, repeat):
+    table = f"benchmark_dimension_user_{builder}"
+    timings = []
+    for _ in range(repeat):
+        with conn.cursor() as cursor:
+            cursor.execute(SqlQueries.delete_table(table))
+            cursor.execute(adapt_sql(SqlQueries.dimension_user_create(table), redshift=False))
+            start = time.perf_counter()
+            cursor.execute(BUILDERS[builder](table, LOGS_TABLE, window))
+            timings.append(time.perf_counter() - start)
+            rows = cursor.rowcount
+        conn.commit()
+    return table, {"rows": rows, "median_seconds": statistics.median(timings), "seconds": timings}
+
+
+def compare_tables(conn, left, right):
+    columns = "user_id, first_name, last_name, gender, level"
+    with conn.cursor() as cursor:
+        cursor.execute(f"""
+            SELECT
+                (SELECT COUNT(*) FROM (SELECT {columns} FROM {left} EXCEPT SELECT {columns} FROM {right}) l),
+                (SELECT COUNT(*) FROM (SELECT {columns} FROM {right} EXCEPT SELECT {columns} FROM {left}) r);
+        """)
+        only_left, only_right = cursor.fetchone()
+    return {"only_legacy": only_left, "only_row_number": only_right}
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--dsn", required=True, help="Postgres dsn.")
+    parser.add_argument("--density", type=int, default=10, help="Multiplier of the users and sessions per day.")
+    parser.add_argument("--days", type=int, default=30)
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--repeat", type=int, default=3)
+    args = parser.parse_args()
+
+    import psycopg2
+
+    work_dir = tempfile.mkdtemp(prefix="sparkify-dimension-user-")
+    conn = psycopg2.connect(args.dsn)
+    try:
+        profile = workload.learn_profile(os.path.join(ROOT, "resources"))
+        workload.generate(profile, work_dir, scale=1, density=args.density, seed=args.seed, days=args.days)
+        results = {"events": workload.load_staging_table(conn, LOGS_TABLE, "logs", os.path.join(work_dir, "log-data")),
+                   "runs": {}}
+        last_day = datetime.datetime.fromisoformat(profile["first_day"]) + datetime.timedelta(days=args.days - 1)
+        windows = {"full": None, "one_day": (epoch_ms(last_day), epoch_ms(last_day + datetime.timedelta(days=1)))}
+        for name, window in windows.items():
+            tables = {}
+            run = {}
+            for builder in BUILDERS:
+                tables[builder], run[builder] = time_builder(conn, builder, window, args.repeat)
+            run["diff"] = compare_tables(conn, tables["legacy"], tables["row_number"])
+            run["speedup"] = run["legacy"]["median_seconds"] / run["row_number"]["median_seconds"]
+            results["runs"][name] = run
+        with conn.cursor() as cursor:
+            for builder in BUILDERS:
+                cursor.execute(SqlQueries.delete_table(f"benchmark_dimension_user_{builder}"))
+            cursor.execute(SqlQueries.delete_table(LOGS_TABLE))
+        conn.commit()
+        print(json.dumps(results, indent=2))
+    finally:
+        conn.close()
+        shutil.rmtree(work_dir, ignore_errors=True)
+
+
+if __name__ == "__main__":
+    main()
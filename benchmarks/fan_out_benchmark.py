@@ -0,0 +1,138 @@
+"""
+Benchmark of the single-scan fan-out of the logs: the rows and bytes read from the tables by the log-based loads
+(fact, user dimension, time dimension) when they all read the logs staging table, against when the song events of
+the batch are extracted once into the song_events working table and the loads read that.
+
+Generates the logs with benchmarks/workload.py, loads them into a Postgres staging table with the local COPY backend,
+runs both paths for the last day and reads the deltas of pg_stat_user_tables (rows read by sequential and index
+scans) and pg_statio_user_tables (heap blocks read or hit, 8kB each) of the tables involved.
+
+    python benchmarks/fan_out_benchmark.py --dsn "dbname=sparkify user=postgres" --density 20 --days 30
+"""
+import argparse
+import datetime
+import json
+import os
+import shutil
+import sys
+import tempfile
+import time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, os.path.join(ROOT, "airflow", "plugins"))
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+import workload  # noqa: E402
+from helpers import SqlQueries, adapt_sql, epoch_ms  # noqa: E402
+
+SONGS_TABLE = "benchmark_songs_raw_data"
+LOGS_TABLE = "benchmark_logs_raw_data"
+EVENTS_TABLE = "benchmark_song_events"
+TARGETS = {
+    "songplays": SqlQueries.songplays_table_create,
+    "dimension_user": SqlQueries.dimension_user_create,
+    "dimension_time": SqlQueries.dimension_time_create,
+}
+BLOCK_SIZE = 8192
+
+
+def table_reads(dsn, tables):
+    """
+    Reads the cumulative scan statistics of the tables, from a new connection so the statistics of the connections
+    already closed are flushed.
+    """
+    import psycopg2
+    conn = psycopg2.connect(dsn)
+    try:
+        with conn.cursor() as cursor:
+            cursor.execute(f"""
+                SELECT s.relname,
+                       COALESCE(s.seq_tup_read, 0) + COALESCE(s.idx_tup_fetch, 0),
+                       COALESCE(io.heap_blks_read, 0) + COALESCE(io.heap_blks_hit, 0)
+                FROM pg_stat_user_tables s JOIN pg_statio_user_tables io ON io.relid = s.relid
+                WHERE s.relname IN ({", ".join(f"'{table}'" for table in tables)});
+            """)
+            return {name: {"rows": rows, "bytes": blocks * BLOCK_SIZE} for name, rows, blocks in cursor.fetchall()}
+    finally:
+        conn.close()
+
+
+def run_path(dsn, queries):
+    import psycopg2
+    conn = psycopg2.connect(dsn)
+    try:
+        with conn.cursor() as cursor:
+            for table, create in TARGETS.items():
+                cursor.execute(SqlQueries.delete_table(f"benchmark_{table}"))
+                cursor.execute(adapt_sql(create(f"benchmark_{table}"), redshift=False))
+            conn.commit()
+            start = time.perf_counter()
+            for query in queries:
+                cursor.execute(query)
+            conn.commit()
+            return time.perf_counter() - start
+    finally:
+        conn.close()
+
+
+def measure(dsn, queries):
+    tables = [SONGS_TABLE, LOGS_TABLE, EVENTS_TABLE]
+    before = table_reads(dsn, tables)
+    seconds = run_path(dsn, queries)
+    # The statistics are flushed by the backends asynchronously, shortly after their transactions end.
+    time.sleep(1.5)
+    after = table_reads(dsn, tables)
+    reads = {table: {key: after[table][key] - before.get(table, {}).get(key, 0) for key in ("rows", "bytes")}
+             for table in after}
+    return {"seconds": seconds, "tables": reads,
+            "total_rows": sum(read["rows"] for read in reads.values()),
+            "total_bytes": sum(read["bytes"] for read in reads.values())}
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--dsn", required=True, help="Postgres dsn.")
+    parser.add_argument("--density", type=int, default=10, help="Multiplier of the users and sessions per day.")
+    parser.add_argument("--days", type=int, default=30)
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+
+    import psycopg2
+
+    work_dir = tempfile.mkdtemp(prefix="sparkify-fan-out-")
+    conn = psycopg2.connect(args.dsn)
+    try:
+        profile = workload.learn_profile(os.path.join(ROOT, "resources"))
+        workload.generate(profile, work_dir, scale=1, density=args.density, seed=args.seed, days=args.days)
+        results = {"staged_rows": workload.load_staging(conn, work_dir, SONGS_TABLE, LOGS_TABLE)}
+        with conn.cursor() as cursor:
+            cursor.execute(SqlQueries.delete_table(EVENTS_TABLE))
+            cursor.execute(adapt_sql(SqlQueries.song_events_create(EVENTS_TABLE), redshift=False))
+        conn.commit()
+        last_day = datetime.datetime.fromisoformat(profile["first_day"]) + datetime.timedelta(days=args.days - 1)
+        window = (epoch_ms(last_day), epoch_ms(last_day + datetime.timedelta(days=1)))
+
+        def loads(logs_table, time_insert):
+            return [
+                SqlQueries.songplays_table_insert_hash_join("benchmark_songplays", SONGS_TABLE, logs_table, window),
+                SqlQueries.dimension_user_insert_latest("benchmark_dimension_user", logs_table, window),
+                time_insert("benchmark_dimension_time", logs_table, window),
+            ]
+
+        results["logs_scans"] = measure(args.dsn, loads(LOGS_TABLE, SqlQueries.dimension_time_insert_new))
+        results["fan_out"] = measure(args.dsn, [SqlQueries.song_events_insert(EVENTS_TABLE, LOGS_TABLE, window)] +
+                                     loads(EVENTS_TABLE, SqlQueries.dimension_time_insert_events))
+        results["rows_ratio"] = results["fan_out"]["total_rows"] / max(results["logs_scans"]["total_rows"], 1)
+        results["bytes_ratio"] = results["fan_out"]["total_bytes"] / max(results["logs_scans"]["total_bytes"], 1)
+        with conn.cursor() as cursor:
+            for table in [SONGS_TABLE, LOGS_TABLE, EVENTS_TABLE] + [f"benchmark_{table}" for table in TARGETS]:
+                cursor.execute(SqlQueries.delete_table(table))
+        conn.commit()
+        print(json.dumps(results, indent=2))
+    finally:
+        conn.close()
+        shutil.rmtree(work_dir, ignore_errors=True)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,162 @@
+"""
+Benchmark of the song resolution of the fact load: the hash_join strategy (exact equality on title, artist name and
+duration, long VARCHARs on both sides) against the match_key strategy (one BIGINT key per song and per event, computed
+at staging time from the normalised title and artist and the rounded duration).
+
+Generates the dataset with benchmarks/workload.py and loads it into Postgres staging tables with the local COPY
+backend. --perturb of the NextSong events then get their song and artist rewritten the way they drift in real logs
+(upper case, doubled spaces, decomposed unicode), before the song events are extracted. Reports the time of each fact
+load, of the match key build, and how many NextSong events each strategy resolved.
+
+Before the perturbation, both strategies load the facts of the same events, and every event the hash_join strategy
+resolves must be resolved by the match_key strategy too. Exits with status 1 otherwise.
+
+    python benchmarks/match_key_benchmark.py --dsn "dbname=sparkify user=postgres" --scale 10 --density 10
+"""
+import argparse
+import json
+import os
+import shutil
+import sys
+import tempfile
+import time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, os.path.join(ROOT, "airflow", "plugins"))
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+import workload  # noqa: E402
+from helpers import SqlQueries, adapt_sql  # noqa: E402
+
+SONGS_TABLE = "benchmark_songs_raw_data"
+LOGS_TABLE = "benchmark_logs_raw_data"
+EVENTS_TABLE = "benchmark_song_events"
+KEYS_TABLE = "benchmark_song_match_keys"
+FACT_TABLE = "benchmark_songplays"
+# Rewrites of the song and artist of an event, picked by ts so the perturbation is deterministic.
+PERTURBATIONS = [
+    "UPPER({column})",
+    "REPLACE({column}, ' ', '  ')",
+    "NORMALIZE({column}, NFD)",
+]
+
+
+def perturb(conn, percent):
+    """
+    Rewrites the song and artist of percent % of the NextSong events, spread over the PERTURBATIONS.
+    """
+    with conn.cursor() as cursor:
+        total = 0
+        for index, rewrite in enumerate(PERTURBATIONS):
+            cursor.execute(f"""
+                UPDATE {LOGS_TABLE}
+                SET song = {rewrite.format(column="song")}, artist = {rewrite.format(column="artist")}
+                WHERE page = 'NextSong' AND ts % 100 < {percent} AND ts % {len(PERTURBATIONS)} = {index};
+            """)
+            total += cursor.rowcount
+        cursor.execute(f"ANALYZE {LOGS_TABLE};")
+    conn.commit()
+    return total
+
+
+def timed(conn, statements):
+    with conn.cursor() as cursor:
+        start = time.perf_counter()
+        for statement in statements:
+            cursor.execute(adapt_sql(statement, redshift=False))
+        rows = cursor.rowcount
+    conn.commit()
+    return {"seconds": time.perf_counter() - start, "rows": rows}
+
+
+def load_fact(conn, insert):
+    with conn.cursor() as cursor:
+        cursor.execute(SqlQueries.delete_table(FACT_TABLE))
+        cursor.execute(adapt_sql(SqlQueries.songplays_table_create(FACT_TABLE), redshift=False))
+    conn.commit()
+    return timed(conn, [insert])
+
+
+def prepare_events(conn):
+    """
+    Extracts the song events of the logs staging table and builds the match keys of the songs, into new tables.
+    :return: Tuple with the timings of the extraction and of the match key build.
+    """
+    with conn.cursor() as cursor:
+        for table in (EVENTS_TABLE, KEYS_TABLE):
+            cursor.execute(SqlQueries.delete_table(table))
+        cursor.execute(adapt_sql(SqlQueries.song_events_create(EVENTS_TABLE), redshift=False))
+        cursor.execute(adapt_sql(SqlQueries.song_match_keys_create(KEYS_TABLE), redshift=False))
+    conn.commit()
+    extract = timed(conn, [SqlQueries.song_events_insert(EVENTS_TABLE, LOGS_TABLE)])
+    build = timed(conn, [SqlQueries.song_match_keys_insert(KEYS_TABLE, SONGS_TABLE),
+                         f"ANALYZE {KEYS_TABLE};", f"ANALYZE {EVENTS_TABLE};"])
+    return extract, build
+
+
+def missed_by_match_key(conn):
+    """
+    Loads the facts of the unperturbed events with both strategies, and counts the plays the hash_join strategy
+    resolves and the match_key strategy does not, by event. It must be 0: an exact match of the title, artist and
+    duration is always a match of their keys.
+    """
+    prepare_events(conn)
+    match_key_table = f"{FACT_TABLE}_match_key"
+    load_fact(conn, SqlQueries.songplays_table_insert_hash_join(FACT_TABLE, SONGS_TABLE, EVENTS_TABLE))
+    with conn.cursor() as cursor:
+        cursor.execute(SqlQueries.delete_table(match_key_table))
+        cursor.execute(adapt_sql(SqlQueries.songplays_table_create(match_key_table), redshift=False))
+        cursor.execute(SqlQueries.songplays_table_insert_match_key(match_key_table, KEYS_TABLE, EVENTS_TABLE))
+        cursor.execute(SqlQueries.table_diff(FACT_TABLE, match_key_table, ["start_time", "user_id", "session_id"]))
+        only_hash_join, _ = cursor.fetchone()
+        cursor.execute(SqlQueries.delete_table(match_key_table))
+    conn.commit()
+    return only_hash_join
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--dsn", required=True, help="Postgres dsn (Postgres 13 or later, for NORMALIZE).")
+    parser.add_argument("--scale", type=int, default=10, help="Multiplier of the song and log files.")
+    parser.add_argument("--density", type=int, default=10, help="Multiplier of the users and sessions per day.")
+    parser.add_argument("--days", type=int, default=30)
+    parser.add_argument("--perturb", type=int, default=10, help="Percent of the NextSong events to perturb.")
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+
+    import psycopg2
+
+    work_dir = tempfile.mkdtemp(prefix="sparkify-match-key-")
+    conn = psycopg2.connect(args.dsn)
+    try:
+        profile = workload.learn_profile(os.path.join(ROOT, "resources"))
+        workload.generate(profile, work_dir, scale=args.scale, density=args.density, seed=args.seed, days=args.days)
+        results = {"staged_rows": workload.load_staging(conn, work_dir, SONGS_TABLE, LOGS_TABLE)}
+        results["unperturbed_missed_by_match_key"] = missed_by_match_key(conn)
+        results["perturbed_events"] = perturb(conn, args.perturb)
+        results["extract_song_events"], results["build_match_keys"] = prepare_events(conn)
+        results["hash_join"] = load_fact(conn, SqlQueries.songplays_table_insert_hash_join(FACT_TABLE, SONGS_TABLE,
+                                                                                           EVENTS_TABLE))
+        results["match_key"] = load_fact(conn, SqlQueries.songplays_table_insert_match_key(FACT_TABLE, KEYS_TABLE,
+                                                                                           EVENTS_TABLE))
+        with conn.cursor() as cursor:
+            cursor.execute(adapt_sql(SqlQueries.match_hit_rate(KEYS_TABLE, EVENTS_TABLE), redshift=False))
+            events, keyed, resolved = cursor.fetchone()
+            for table in (SONGS_TABLE, LOGS_TABLE, EVENTS_TABLE, KEYS_TABLE, FACT_TABLE):
+                cursor.execute(SqlQueries.delete_table(table))
+        conn.commit()
+        results["next_song_events"] = events
+        results["keyed_events"] = keyed
+        for strategy in ("hash_join", "match_key"):
+            results[strategy]["hit_rate"] = results[strategy]["rows"] / events if events else None
+        results["speedup"] = results["hash_join"]["seconds"] / results["match_key"]["seconds"]
+        print(json.dumps(results, indent=2))
+    finally:
+        conn.close()
+        shutil.rmtree(work_dir, ignore_errors=True)
+    if results["unperturbed_missed_by_match_key"]:
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,72 @@
+"""
+Benchmark of the unique data quality check, exact COUNT(DISTINCT ...) against the approximate mode (client-side
+HyperLogLog over a streamed cursor on Postgres), for growing table sizes.
+
+    python benchmarks/quality_check_benchmark.py --dsn "dbname=sparkify user=postgres" --sizes 100000 1000000 10000000
+"""
+import argparse
+import json
+import os
+import sys
+import time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, os.path.join(ROOT, "airflow", "plugins"))
+
+from helpers import SqlQueries, run_checks, stream_column  # noqa: E402
+
+TABLE = "benchmark_quality_keys"
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--dsn", required=True, help="Postgres dsn.")
+    parser.add_argument("--sizes", type=int, nargs="+", default=[100000, 1000000, 5000000])
+    parser.add_argument("--error", type=float, default=0.01)
+    parser.add_argument("--max-duplicate-ratio", type=float, default=0.05)
+    args = parser.parse_args()
+
+    import psycopg2
+
+    def get_conn():
+        return psycopg2.connect(args.dsn)
+
+    def get_records(query):
+        conn = get_conn()
+        try:
+            with conn.cursor() as cursor:
+                cursor.execute(query)
+                return cursor.fetchall()
+        finally:
+            conn.close()
+
+    def run(query):
+        conn = get_conn()
+        try:
+            with conn.cursor() as cursor:
+                cursor.execute(query)
+            conn.commit()
+        finally:
+            conn.close()
+
+    results = []
+    for size in args.sizes:
+        run(SqlQueries.delete_table(TABLE))
+        run(f"CREATE TABLE {TABLE} AS SELECT CAST(g AS VARCHAR) AS key FROM generate_series(1, {size}) g;")
+        check = {"type": "unique", "table": TABLE, "column": "key", "error": args.error,
+                 "max_duplicate_ratio": args.max_duplicate_ratio}
+        timings = {"rows": size}
+        for mode in ("exact", "approximate"):
+            start = time.perf_counter()
+            result, = run_checks(get_records, [dict(check, approximate=mode == "approximate")], redshift=False,
+                                 stream_values=lambda query: stream_column(get_conn, query))
+            timings[f"{mode}_seconds"] = time.perf_counter() - start
+            timings[f"{mode}_passed"] = result.passed
+            timings[f"{mode}_observed"] = result.observed
+        results.append(timings)
+    run(SqlQueries.delete_table(TABLE))
+    print(json.dumps(results, indent=2))
+
+
+if __name__ == "__main__":
+    main()
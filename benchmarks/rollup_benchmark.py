@@ -0,0 +1,185 @@
+"""
+Benchmark and consistency check of the incremental rollups on a local Postgres database.
+
+Fills a songplays table with synthetic plays day after day and, after every day, merges that day into the rollups
+the way the sparkify DAG does (SqlQueries.rollup_delete and the rollup insert over the run's window). One day is
+merged twice, like a retried task. The rollups are then recomputed from the whole fact table into separate tables,
+and every incremental rollup is diffed against its full recompute.
+
+    python benchmarks/rollup_benchmark.py --dsn "dbname=sparkify user=postgres" --days 30 --plays 200000
+
+Exits with status 1 if any incremental rollup differs from its full recompute.
+"""
+import argparse
+import datetime
+import json
+import os
+import random
+import statistics
+import sys
+import time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, os.path.join(ROOT, "airflow", "plugins"))
+
+from helpers import SqlQueries, adapt_sql, align_window, copy_lines, epoch_ms, DAY_MS, HOUR_MS  # noqa: E402
+
+FACT_TABLE = "benchmark_songplays"
+FACT_COLUMNS = ["start_time", "user_id", "level", "song_id", "artist_id", "session_id", "location", "user_agent",
+                "ts"]
+ROLLUPS = {
+    "benchmark_rollup_daily_song_plays": (SqlQueries.rollup_daily_song_create, SqlQueries.rollup_daily_song_insert,
+                                          "day_start", DAY_MS),
+    "benchmark_rollup_daily_artist_plays": (SqlQueries.rollup_daily_artist_create,
+                                            SqlQueries.rollup_daily_artist_insert, "day_start", DAY_MS),
+    "benchmark_rollup_daily_level_plays": (SqlQueries.rollup_daily_level_create,
+                                           SqlQueries.rollup_daily_level_insert, "day_start", DAY_MS),
+    "benchmark_rollup_hourly_concurrency": (SqlQueries.rollup_hourly_concurrency_create,
+                                            SqlQueries.rollup_hourly_concurrency_insert, "hour_start", HOUR_MS),
+}
+ROLLUP_COLUMNS = {
+    "benchmark_rollup_daily_song_plays": ["day_start", "play_date", "song_id", "artist_id", "plays", "users"],
+    "benchmark_rollup_daily_artist_plays": ["day_start", "play_date", "artist_id", "plays", "songs", "users"],
+    "benchmark_rollup_daily_level_plays": ["day_start", "play_date", "level", "plays", "resolved_plays", "users",
+                                           "sessions"],
+    "benchmark_rollup_hourly_concurrency": ["hour_start", "hour", "plays", "active_users", "active_sessions"],
+}
+
+
+def day_lines(rng, window, plays, users, songs, hit_rate):
+    """
+    Generates the plays of a day as lines of the COPY text format, with a level per user, a session per user and
+    hour, and hit_rate of the plays resolved to a song.
+    """
+    for _ in range(plays):
+        ts = rng.randrange(*window)
+        user_id = rng.randrange(users)
+        song = rng.randrange(songs)
+        resolved = rng.random() < hit_rate
+        yield "\t".join([
+            str(ts),
+            str(user_id),
+            "paid" if user_id % 4 == 0 else "free",
+            f"SO{song:06d}" if resolved else "\\N",
+            f"AR{song % (songs // 5 + 1):06d}" if resolved else "\\N",
+            str(user_id * 100 + (ts - window[0]) // HOUR_MS),
+            "\\N",
+            "\\N",
+            str(ts),
+        ]) + "\n"
+
+
+def merge_day(conn, window):
+    """
+    Merges the fact rows of a day into every rollup, like LoadRollupOperator does with incremental=True.
+    :return: Seconds taken by every rollup.
+    """
+    timings = {}
+    for table, (_, insert_func, bucket_column, grain_ms) in ROLLUPS.items():
+        aligned = align_window(window, grain_ms)
+        start = time.perf_counter()
+        with conn.cursor() as cursor:
+            cursor.execute(SqlQueries.rollup_delete(table, bucket_column, aligned))
+            cursor.execute(insert_func(table, FACT_TABLE, aligned))
+        conn.commit()
+        timings[table] = time.perf_counter() - start
+    return timings
+
+
+def create_tables(conn):
+    """
+    Creates the fact table and, for every rollup, the incremental table and the table of its full recompute.
+    """
+    with conn.cursor() as cursor:
+        cursor.execute(SqlQueries.delete_table(FACT_TABLE))
+        cursor.execute(adapt_sql(SqlQueries.songplays_table_create(FACT_TABLE), redshift=False))
+        for table, (create_func, _, _, _) in ROLLUPS.items():
+            for name in (table, f"{table}_full"):
+                cursor.execute(SqlQueries.delete_table(name))
+                cursor.execute(adapt_sql(create_func(name), redshift=False))
+    conn.commit()
+
+
+def load_days(conn, rng, first_day, days, plays, users, songs, hit_rate):
+    """
+    Loads the plays of every day into the fact table and merges the day into the rollups. The day in the middle is
+    merged twice, like a retried task.
+    :return: Dictionary with the seconds taken by every merge of every rollup.
+    """
+    incremental = {table: [] for table in ROLLUPS}
+    for day in range(days):
+        window = (epoch_ms(first_day + datetime.timedelta(days=day)),
+                  epoch_ms(first_day + datetime.timedelta(days=day + 1)))
+        copy_lines(conn, FACT_TABLE, FACT_COLUMNS, day_lines(rng, window, plays, users, songs, hit_rate))
+        conn.commit()
+        for table, seconds in merge_day(conn, window).items():
+            incremental[table].append(seconds)
+        if day == days // 2:
+            merge_day(conn, window)
+    return incremental
+
+
+def compare_full(conn):
+    """
+    Recomputes every rollup from the whole fact table, and diffs it against the incremental rollup.
+    :return: Dictionary with the seconds of the recompute and the rows found in only one of the tables, by rollup.
+    """
+    results = {}
+    for table, (_, insert_func, _, _) in ROLLUPS.items():
+        start = time.perf_counter()
+        with conn.cursor() as cursor:
+            cursor.execute(insert_func(f"{table}_full", FACT_TABLE))
+        conn.commit()
+        full_seconds = time.perf_counter() - start
+        with conn.cursor() as cursor:
+            cursor.execute(SqlQueries.table_diff(table, f"{table}_full", ROLLUP_COLUMNS[table]))
+            only_incremental, only_full = cursor.fetchone()
+        results[table] = {"full_recompute_seconds": full_seconds, "only_incremental": only_incremental,
+                          "only_full_recompute": only_full}
+    return results
+
+
+def drop_tables(conn):
+    with conn.cursor() as cursor:
+        for table in ROLLUPS:
+            cursor.execute(SqlQueries.delete_table(table))
+            cursor.execute(SqlQueries.delete_table(f"{table}_full"))
+        cursor.execute(SqlQueries.delete_table(FACT_TABLE))
+    conn.commit()
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--dsn", required=True, help="Postgres dsn.")
+    parser.add_argument("--days", type=int, default=30)
+    parser.add_argument("--plays", type=int, default=100000, help="Plays per day.")
+    parser.add_argument("--users", type=int, default=5000)
+    parser.add_argument("--songs", type=int, default=20000)
+    parser.add_argument("--hit-rate", type=float, default=0.7)
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+
+    import psycopg2
+
+    rng = random.Random(args.seed)
+    conn = psycopg2.connect(args.dsn)
+    try:
+        create_tables(conn)
+        incremental = load_days(conn, rng, datetime.datetime(2018, 11, 1), args.days, args.plays, args.users,
+                                args.songs, args.hit_rate)
+        rollups = compare_full(conn)
+        for table, result in rollups.items():
+            result["incremental_median_seconds"] = statistics.median(incremental[table])
+        consistent = all(result["only_incremental"] == result["only_full_recompute"] == 0
+                         for result in rollups.values())
+        drop_tables(conn)
+        print(json.dumps({"days": args.days, "plays_per_day": args.plays, "rollups": rollups,
+                          "consistent": consistent}, indent=2))
+    finally:
+        conn.close()
+    if not consistent:
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,98 @@
+"""
+Benchmark of the pre-COPY validation of the logs: generates a scaled dataset with benchmarks/workload.py, corrupts
+--corrupt of its records (broken json, non numeric userId, ts in seconds, oversized song), and validates it against
+the staging schema with the process pool. Reports the records per second for every worker count, and checks that
+exactly the corrupted records were quarantined.
+
+    python benchmarks/validation_benchmark.py --density 20 --days 30 --workers 1 2 4
+"""
+import argparse
+import datetime
+import json
+import os
+import random
+import shutil
+import sys
+import tempfile
+import time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, os.path.join(ROOT, "airflow", "plugins"))
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+import workload  # noqa: E402
+from helpers import (STAGING_SCHEMAS, epoch_ms, list_source_objects, record_fields,  # noqa: E402
+                     validate_files)
+
+CORRUPTIONS = [
+    lambda record: json.dumps(record)[:-1],
+    lambda record: json.dumps(dict(record, userId="guest")),
+    lambda record: json.dumps(dict(record, ts=record["ts"] // 1000)),
+    lambda record: json.dumps(dict(record, song="x" * 1024)),
+]
+
+
+def corrupt(log_dir, ratio, seed):
+    """
+    Rewrites ratio of the records of every log file with one of the CORRUPTIONS.
+    :return: Number of corrupted records.
+    """
+    rng = random.Random(seed)
+    corrupted = 0
+    for name in sorted(os.listdir(log_dir)):
+        path = os.path.join(log_dir, name)
+        with open(path) as f:
+            lines = [line for line in f if line.strip()]
+        with open(path, "w") as f:
+            for line in lines:
+                if rng.random() < ratio:
+                    line = rng.choice(CORRUPTIONS)(json.loads(line)) + "\n"
+                    corrupted += 1
+                f.write(line)
+    return corrupted
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--density", type=int, default=10, help="Multiplier of the users and sessions per day.")
+    parser.add_argument("--days", type=int, default=30)
+    parser.add_argument("--corrupt", type=float, default=0.001, help="Share of the records to corrupt.")
+    parser.add_argument("--workers", type=int, nargs="+", default=[1, 4])
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+
+    work_dir = tempfile.mkdtemp(prefix="sparkify-validation-")
+    try:
+        profile = workload.learn_profile(os.path.join(ROOT, "resources"))
+        workload.generate(profile, work_dir, scale=1, density=args.density, seed=args.seed, days=args.days)
+        log_dir = os.path.join(work_dir, "log-data")
+        results = {"corrupted": corrupt(log_dir, args.corrupt, args.seed), "runs": {}}
+        objects = list_source_objects(log_dir)
+        first_day = datetime.datetime.fromisoformat(profile["first_day"])
+        ts_range = (epoch_ms(first_day - datetime.timedelta(days=1)),
+                    epoch_ms(first_day + datetime.timedelta(days=args.days + 1)))
+        for workers in args.workers:
+            output = os.path.join(work_dir, f"validated-{workers}")
+            start = time.perf_counter()
+            _, summary, chunks = validate_files(objects, os.path.join(output, "valid"),
+                                                os.path.join(output, "quarantine"), STAGING_SCHEMAS["logs"],
+                                                record_fields("logs"), ts_range, workers=workers,
+                                                target_chunk_size=16 * 1024 * 1024)
+            elapsed = time.perf_counter() - start
+            records = sum(file_summary["records"] for file_summary in summary.values())
+            rejected = sum(file_summary["rejected"] for file_summary in summary.values())
+            results["runs"][workers] = {
+                "records": records,
+                "rejected": rejected,
+                "all_corrupted_rejected": rejected == results["corrupted"],
+                "chunks": len(chunks),
+                "seconds": elapsed,
+                "records_per_second": records / elapsed,
+            }
+        print(json.dumps(results, indent=2))
+    finally:
+        shutil.rmtree(work_dir, ignore_errors=True)
+
+
+if __name__ == "__main__":
+    main()
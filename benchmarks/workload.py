@@ -0,0 +1,299 @@
+"""
+Synthetic Sparkify workload generator.
+
+Learns the distributions of the bundled sample (songs per artist, events per session, page mix, level transitions,
+ts spacing, user agent and location vocabularies) and writes a dataset with the same json layout and daily file
+naming, --scale times as many song and log files (and --density times as many events per day). The output is a pure
+function of the seed: every file is generated independently from (seed, file), streamed to disk, and the files are
+spread over a process pool, so memory stays constant and the worker count does not change the result.
+
+    python benchmarks/workload.py --output /data/sparkify-x100 --scale 100 --density 10 --seed 7
+"""
+import argparse
+import collections
+import datetime
+import json
+import os
+import random
+import string
+import sys
+from concurrent.futures import ProcessPoolExecutor
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, os.path.join(ROOT, "airflow", "plugins"))
+
+from helpers import (SqlQueries, STAGING_COLUMNS, STAGING_SCHEMAS, adapt_sql, list_source_objects,  # noqa: E402
+                     iter_json_records, iter_staging_lines, copy_lines)
+
+DAY_MS = 24 * 3600 * 1000
+SONGS_PER_SHARD = 1000
+ID_CHARS = string.ascii_uppercase + string.digits
+
+
+def load_staging_table(conn, table, staging_type, source):
+    """
+    Loads json files into a new Postgres staging table with the local COPY backend, and analyzes it.
+    :param conn: psycopg2 connection.
+    :param table: Staging table, dropped and created again with the schema of the staging_type.
+    :param staging_type: songs or logs
+    :param source: Local directory, file or path prefix of the json files.
+    :return: Number of rows loaded.
+    """
+    with conn.cursor() as cursor:
+        cursor.execute(SqlQueries.delete_table(table))
+        cursor.execute(adapt_sql(SqlQueries.staging_table_create(table, STAGING_SCHEMAS[staging_type]),
+                                 redshift=False))
+    lines = iter_staging_lines(iter_json_records(list_source_objects(source)), staging_type)
+    rows = copy_lines(conn, table, [name for name, _ in STAGING_COLUMNS[staging_type]], lines)
+    with conn.cursor() as cursor:
+        cursor.execute(f"ANALYZE {table};")
+    conn.commit()
+    return rows
+
+
+def load_staging(conn, data_dir, songs_table, logs_table):
+    """
+    Loads a dataset written by generate (or the resources folder) into the songs and logs staging tables.
+    :param conn: psycopg2 connection.
+    :param data_dir: Folder with the song_data and log-data folders.
+    :param songs_table: Songs staging table.
+    :param logs_table: Logs staging table.
+    :return: Dictionary with the rows loaded by table.
+    """
+    tables = [(songs_table, "songs", "song_data"), (logs_table, "logs", "log-data")]
+    return {table: load_staging_table(conn, table, staging_type, os.path.join(data_dir, folder))
+            for table, staging_type, folder in tables}
+
+
+def learn_profile(resources_dir):
+    """
+    Learns the distributions of the sample dataset.
+    :param resources_dir: Folder with the log-data and song_data folders.
+    :return: Dictionary with the profile, small and picklable.
+    """
+    songs = list(iter_json_records(list_source_objects(os.path.join(resources_dir, "song_data"))))
+    songs_per_artist = collections.Counter(song["artist_id"] for song in songs)
+    artists = {}
+    for song in songs:
+        artists[song["artist_id"]] = (song["artist_name"], song["artist_location"], song["artist_latitude"],
+                                      song["artist_longitude"])
+
+    log_files = list_source_objects(os.path.join(resources_dir, "log-data"))
+    first_day = os.path.basename(log_files[0]["key"])[:10]
+    sessions_per_day = []
+    events_per_session = collections.Counter()
+    gaps = []
+    pages = collections.Counter()
+    users = {}
+    user_levels = collections.defaultdict(list)
+    played = set()
+    for obj in log_files:
+        events = list(iter_json_records([obj]))
+        by_session = collections.defaultdict(list)
+        for event in events:
+            by_session[event["sessionId"]].append(event)
+            pages[(event["page"], event["auth"], event["method"], event["status"])] += 1
+            if event["page"] == "NextSong":
+                played.add((event["artist"], event["song"], event["length"]))
+            if event["userId"]:
+                users[event["userId"]] = (event["firstName"], event["lastName"], event["gender"], event["location"],
+                                          event["userAgent"], event["registration"])
+                user_levels[event["userId"]].append((event["ts"], event["level"]))
+        sessions_per_day.append(len(by_session))
+        for session in by_session.values():
+            events_per_session[len(session)] += 1
+            timestamps = sorted(event["ts"] for event in session)
+            gaps.extend(b - a for a, b in zip(timestamps, timestamps[1:]))
+
+    first_levels = collections.Counter()
+    upgrades = 0
+    for levels in user_levels.values():
+        levels = [level for _, level in sorted(levels)]
+        first_levels[levels[0]] += 1
+        upgrades += levels[0] == "free" and "paid" in levels
+    free_users = first_levels["free"] or 1
+    return {
+        "first_day": first_day,
+        "days": len(log_files),
+        "songs": len(songs),
+        "songs_per_artist": sum(songs_per_artist.values()) / len(songs_per_artist),
+        "artists": sorted(artists.values(), key=lambda artist: artist[0]),
+        "titles": sorted(song["title"] for song in songs),
+        "durations": sorted(song["duration"] for song in songs),
+        "years": sorted(song["year"] for song in songs),
+        "sessions_per_day": sessions_per_day,
+        "events_per_session": sorted(events_per_session.items()),
+        "gaps": sorted(gaps),
+        "pages": sorted(pages.items()),
+        "users": sorted(users.items(), key=lambda user: int(user[0])),
+        "first_levels": sorted(first_levels.items()),
+        "upgrade_probability": upgrades / free_users,
+        "played": sorted(played, key=lambda triple: (triple[0], triple[1], triple[2])),
+    }
+
+
+def _id(rng, prefix):
+    return prefix + "".join(rng.choice(string.ascii_uppercase) for _ in range(3)) + \
+        "".join(rng.choice(ID_CHARS) for _ in range(13))
+
+
+def _weighted(rng, pairs):
+    values, weights = zip(*pairs)
+    return rng.choices(values, weights)[0]
+
+
+def _variant(values, index):
+    base = values[index % len(values)]
+    copy = index // len(values)
+    return base if copy == 0 else f"{base} {copy}"
+
+
+def artist_record(profile, seed, index):
+    rng = random.Random(f"{seed}-artist-{index}")
+    _, location, latitude, longitude = profile["artists"][index % len(profile["artists"])]
+    return {
+        "artist_id": _id(rng, "AR"),
+        "artist_name": _variant([artist[0] for artist in profile["artists"]], index),
+        "artist_location": location,
+        "artist_latitude": latitude,
+        "artist_longitude": longitude,
+    }
+
+
+def song_record(profile, seed, index, n_songs):
+    """
+    Generates the song at a position of the catalog. Depends only on (seed, index), so the log generator can
+    regenerate any song of the catalog without holding it in memory.
+    """
+    rng = random.Random(f"{seed}-song-{index}")
+    n_artists = max(1, round(n_songs / profile["songs_per_artist"]))
+    artist = artist_record(profile, seed, rng.randrange(n_artists))
+    record = {"num_songs": 1, "artist_id": artist["artist_id"], "artist_latitude": artist["artist_latitude"],
+              "artist_longitude": artist["artist_longitude"], "artist_location": artist["artist_location"],
+              "artist_name": artist["artist_name"], "song_id": _id(rng, "SO"),
+              "title": _variant(profile["titles"], index),
+              "duration": round(rng.choice(profile["durations"]) * rng.uniform(0.9, 1.1), 5),
+              "year": rng.choice(profile["years"])}
+    return _id(rng, "TR"), record
+
+
+def write_song_shard(profile, seed, shard, n_songs, output):
+    written = 0
+    for index in range(shard * SONGS_PER_SHARD, min((shard + 1) * SONGS_PER_SHARD, n_songs)):
+        track_id, record = song_record(profile, seed, index, n_songs)
+        directory = os.path.join(output, "song_data", *track_id[2:5])
+        os.makedirs(directory, exist_ok=True)
+        data = json.dumps(record)
+        with open(os.path.join(directory, f"{track_id}.json"), "w") as f:
+            f.write(data)
+        written += len(data)
+    return written
+
+
+def user_record(profile, seed, index, total_days):
+    rng = random.Random(f"{seed}-user-{index}")
+    base_id, (first_name, last_name, gender, location, user_agent, registration) = \
+        profile["users"][index % len(profile["users"])]
+    level = _weighted(rng, profile["first_levels"])
+    upgrade_day = None
+    if level == "free" and rng.random() < profile["upgrade_probability"]:
+        upgrade_day = rng.randrange(total_days)
+    return {"userId": str(int(base_id) + 100000 * (index // len(profile["users"]))), "firstName": first_name,
+            "lastName": last_name, "gender": gender, "location": location, "userAgent": user_agent,
+            "registration": registration, "level": level, "upgrade_day": upgrade_day}
+
+
+def write_log_day(profile, seed, day, total_days, n_songs, density, hit_rate, output):
+    """
+    Generates the events of one day, session after session, writing them as they are generated.
+    """
+    rng = random.Random(f"{seed}-day-{day}")
+    date = datetime.date.fromisoformat(profile["first_day"]) + datetime.timedelta(days=day)
+    day_start = int(datetime.datetime(date.year, date.month, date.day,
+                                      tzinfo=datetime.timezone.utc).timestamp() * 1000)
+    n_users = len(profile["users"]) * density
+    n_sessions = profile["sessions_per_day"][day % len(profile["sessions_per_day"])] * density
+    path = os.path.join(output, "log-data", f"{date.isoformat()}-events.json")
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    written = 0
+    with open(path, "w") as f:
+        for session in range(n_sessions):
+            user = user_record(profile, seed, rng.randrange(n_users), total_days)
+            level = "paid" if user["level"] == "paid" or (user["upgrade_day"] is not None
+                                                          and day >= user["upgrade_day"]) else "free"
+            ts = day_start + rng.randrange(DAY_MS)
+            for item in range(_weighted(rng, profile["events_per_session"])):
+                page, auth, method, status = _weighted(rng, profile["pages"])
+                logged_in = auth == "Logged In"
+                artist = song = length = None
+                if page == "NextSong":
+                    if rng.random() < hit_rate:
+                        _, played = song_record(profile, seed, rng.randrange(n_songs), n_songs)
+                        artist, song, length = played["artist_name"], played["title"], played["duration"]
+                    else:
+                        artist, song, length = rng.choice(profile["played"])
+                event = {"artist": artist, "auth": auth,
+                         "firstName": user["firstName"] if logged_in else None,
+                         "gender": user["gender"] if logged_in else None, "itemInSession": item,
+                         "lastName": user["lastName"] if logged_in else None, "length": length,
+                         "level": level if logged_in else "free",
+                         "location": user["location"] if logged_in else None, "method": method, "page": page,
+                         "registration": user["registration"] if logged_in else None,
+                         "sessionId": day * 1000000 + session, "song": song, "status": status, "ts": ts,
+                         "userAgent": user["userAgent"] if logged_in else None,
+                         "userId": user["userId"] if logged_in else ""}
+                line = json.dumps(event, separators=(",", ":")) + "\n"
+                f.write(line)
+                written += len(line)
+                ts += rng.choice(profile["gaps"]) if profile["gaps"] else 1000
+    return written
+
+
+def _run_unit(args):
+    kind, profile, seed, index, options = args
+    if kind == "songs":
+        return write_song_shard(profile, seed, index, options["n_songs"], options["output"])
+    return write_log_day(profile, seed, index, options["days"], options["n_songs"], options["density"],
+                         options["hit_rate"], options["output"])
+
+
+def generate(profile, output, scale=1, density=1, seed=0, hit_rate=0.5, workers=None, days=None):
+    """
+    Generates a scaled dataset.
+    :param profile: Profile returned by learn_profile.
+    :param output: Folder where the log-data and song_data folders are written.
+    :param scale: Multiplier of the number of song files and daily log files.
+    :param density: Multiplier of the number of users and sessions per day.
+    :param seed: Seed of the dataset.
+    :param hit_rate: Share of the NextSong events that play a song of the generated catalog.
+    :param workers: Number of worker processes. Defaults to the number of cpus.
+    :param days: Number of daily log files to write. Defaults to scale times the days of the sample.
+    :return: Dictionary with the number of files and bytes written.
+    """
+    options = {"n_songs": profile["songs"] * scale, "days": days or profile["days"] * scale, "density": density,
+               "hit_rate": hit_rate, "output": output}
+    n_shards = -(-options["n_songs"] // SONGS_PER_SHARD)
+    units = [("songs", profile, seed, shard, options) for shard in range(n_shards)]
+    units += [("logs", profile, seed, day, options) for day in range(options["days"])]
+    with ProcessPoolExecutor(max_workers=workers) as executor:
+        written = sum(executor.map(_run_unit, units, chunksize=4))
+    return {"song_files": options["n_songs"], "log_files": options["days"], "bytes": written}
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--output", required=True)
+    parser.add_argument("--resources", default=os.path.join(ROOT, "resources"))
+    parser.add_argument("--scale", type=int, default=10)
+    parser.add_argument("--density", type=int, default=1)
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--hit-rate", type=float, default=0.5)
+    parser.add_argument("--workers", type=int, default=None)
+    args = parser.parse_args()
+    profile = learn_profile(args.resources)
+    print(json.dumps(generate(profile, args.output, args.scale, args.density, args.seed, args.hit_rate,
+                              args.workers)))
+
+
+if __name__ == "__main__":
+    main()
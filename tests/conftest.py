@@ -0,0 +1,131 @@
+"""
+Shared fixtures of the test suite.
+
+The tests that need a database run against a local Postgres, given by the SPARKIFY_TEST_DSN environment variable
+(e.g. "dbname=sparkify_test user=postgres"), and are skipped without it. The operator tests need apache-airflow,
+and the s3 tests moto, and are skipped when those are not installed.
+"""
+import datetime
+import os
+import sys
+
+import pytest
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+RESOURCES = os.path.join(ROOT, "resources")
+sys.path.insert(0, os.path.join(ROOT, "airflow", "plugins"))
+sys.path.insert(0, os.path.join(ROOT, "airflow", "dags"))
+sys.path.insert(0, os.path.join(ROOT, "benchmarks"))
+
+
+class LocalPostgresHook:
+    """
+    Stands in for the PostgresHook of the operators, on a psycopg2 connection to the test database. run executes a
+    list of statements in a single transaction, like PostgresHook.run.
+    """
+
+    postgres_conn_id = "redshift"
+    supports_autocommit = True
+
+    def __init__(self, dsn):
+        self.dsn = dsn
+
+    def get_conn(self):
+        import psycopg2
+        return psycopg2.connect(self.dsn)
+
+    def set_autocommit(self, conn, autocommit):
+        conn.autocommit = autocommit
+
+    def get_connection(self, conn_id):
+        class Connection:
+            conn_type = "postgres"
+            host = "localhost"
+        return Connection()
+
+    def run(self, sql, autocommit=False, parameters=None):
+        conn = self.get_conn()
+        try:
+            conn.autocommit = autocommit
+            with conn.cursor() as cursor:
+                for statement in ([sql] if isinstance(sql, str) else sql):
+                    cursor.execute(statement, parameters)
+            if not autocommit:
+                conn.commit()
+        finally:
+            conn.close()
+
+    def get_records(self, sql, parameters=None):
+        conn = self.get_conn()
+        try:
+            with conn.cursor() as cursor:
+                cursor.execute(sql, parameters)
+                return cursor.fetchall()
+        finally:
+            conn.close()
+
+    def get_first(self, sql, parameters=None):
+        records = self.get_records(sql, parameters)
+        return records[0] if records else None
+
+
+class StubTaskInstance:
+    """
+    Stands in for the TaskInstance of a task, keeping the XComs of the run in a dictionary shared by its tasks.
+    """
+
+    def __init__(self, task_id, xcoms):
+        self.task_id = task_id
+        self.xcoms = xcoms
+
+    def xcom_push(self, key, value, execution_date=None):
+        self.xcoms[(self.task_id, key)] = value
+
+    def xcom_pull(self, task_ids=None, key="return_value", **kwargs):
+        return self.xcoms.get((task_ids, key))
+
+
+def run_context(day, task_id="task", xcoms=None, run_id=None):
+    """
+    Builds the context of a daily run, as Airflow renders it for a task.
+    :param day: Execution date, as YYYY-MM-DD.
+    :param task_id: Task the context is for.
+    :param xcoms: Dictionary with the XComs of the run, shared by its tasks.
+    :param run_id: Defaults to scheduled__<execution date>.
+    """
+    execution_date = datetime.datetime.strptime(day, "%Y-%m-%d").replace(tzinfo=datetime.timezone.utc)
+    task_instance = StubTaskInstance(task_id, {} if xcoms is None else xcoms)
+    return {
+        "execution_date": execution_date,
+        "next_execution_date": execution_date + datetime.timedelta(days=1),
+        "ds": day,
+        "ds_nodash": execution_date.strftime("%Y%m%d"),
+        "ts": execution_date.isoformat(),
+        "ts_nodash": execution_date.strftime("%Y%m%dT%H%M%S"),
+        "run_id": run_id or f"scheduled__{execution_date.isoformat()}",
+        "ti": task_instance,
+        "task_instance": task_instance,
+    }
+
+
+@pytest.fixture
+def dsn():
+    value = os.environ.get("SPARKIFY_TEST_DSN")
+    if not value:
+        pytest.skip("SPARKIFY_TEST_DSN is not set.")
+    pytest.importorskip("psycopg2")
+    return value
+
+
+@pytest.fixture
+def db(dsn):
+    """
+    LocalPostgresHook on a clean public schema of the test database.
+    """
+    hook = LocalPostgresHook(dsn)
+    hook.run("DROP SCHEMA IF EXISTS public CASCADE; CREATE SCHEMA public;")
+    return hook
+
+
+def count_rows(db, table):
+    return db.get_first(f"SELECT COUNT(*) FROM {table};")[0]
@@ -0,0 +1,52 @@
+"""
+Chunked staging on a local Postgres: a load killed in the middle of a chunk is retried without loading a file twice.
+"""
+import glob
+import os
+import shutil
+
+import pytest
+
+from conftest import RESOURCES, count_rows, run_context
+
+pytest.importorskip("airflow.models")
+
+import operators.stage_redshift_operator as stage_module  # noqa: E402
+
+
+@pytest.fixture
+def song_dir(tmp_path):
+    paths = sorted(glob.glob(os.path.join(RESOURCES, "song_data", "**", "*.json"), recursive=True))[:10]
+    for i, path in enumerate(paths):
+        shutil.copy(path, tmp_path / f"{i:03d}.json")
+    return str(tmp_path)
+
+
+def test_retry_after_a_failure_mid_chunk_loads_every_file_once(monkeypatch, db, song_dir):
+    monkeypatch.setattr(stage_module, "PostgresHook", lambda conn_id: db)
+    operator = stage_module.RedshiftStagingOperator(task_id="stage_songs_into_db", db_conn_id="redshift",
+                                                    table="songs_raw_data", staging_type="songs", incremental=True,
+                                                    local_path=song_dir, chunk_size=3)
+    stream_objects = operator.stream_objects
+    calls = []
+
+    def killed_on_third_chunk(db, conn, table, objects, s3_client):
+        rows = stream_objects(db, conn, table, objects, s3_client)
+        calls.append(rows)
+        if len(calls) == 3:
+            raise RuntimeError("Worker killed mid-chunk.")
+        return rows
+
+    monkeypatch.setattr(operator, "stream_objects", killed_on_third_chunk)
+    context = run_context("2018-11-01", operator.task_id)
+    with pytest.raises(RuntimeError):
+        operator.execute(context)
+    assert count_rows(db, "songs_raw_data") == 6
+    assert count_rows(db, "staging_checkpoints") == 2
+
+    operator.execute(context)
+    assert calls == [3, 3, 3, 3, 1]
+    assert count_rows(db, "songs_raw_data") == 10
+    assert db.get_first("SELECT COUNT(DISTINCT song_id) FROM songs_raw_data;")[0] == 10
+    assert count_rows(db, "staging_checkpoints") == 4
+    assert count_rows(db, "staging_loaded_files") == 10
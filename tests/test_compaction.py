@@ -0,0 +1,88 @@
+"""
+Compaction of the song files into a stable prefix: the same files give the same chunks, and the ledger sees the
+source files of every chunk.
+"""
+import glob
+import os
+import shutil
+
+from conftest import RESOURCES
+
+from helpers import compact_files, list_source_objects, pending_objects, ledger_entries, replaced_loads, reloaded_keys
+from helpers.compaction import write_manifest
+from helpers.local_loader import manifest_sources_path
+
+
+def song_sources(tmp_path, count=12):
+    source = tmp_path / "song_data"
+    source.mkdir()
+    paths = sorted(glob.glob(os.path.join(RESOURCES, "song_data", "**", "*.json"), recursive=True))[:count]
+    for i, path in enumerate(paths):
+        shutil.copy(path, source / f"{i:03d}.json")
+    return str(source)
+
+
+def chunk_bytes(manifest_path):
+    return {obj["key"]: open(obj["key"], "rb").read() for obj in list_source_objects(manifest_path)}
+
+
+def test_same_files_give_the_same_chunks(tmp_path):
+    source = song_sources(tmp_path)
+    staging_prefix = str(tmp_path / "compacted") + "/"
+    objects = list_source_objects(source)
+    manifest_path, results = compact_files(objects, staging_prefix, slices=2, target_chunk_size=2048, workers=1)
+    first = chunk_bytes(manifest_path)
+    first_objects = list_source_objects(manifest_path)
+
+    manifest_path, _ = compact_files(list_source_objects(source), staging_prefix, slices=2, target_chunk_size=2048,
+                                     workers=1)
+    assert chunk_bytes(manifest_path) == first
+    assert list_source_objects(manifest_path) == first_objects
+    assert len(results) > 1
+    assert sorted(obj["key"] for obj in ledger_entries(first_objects)) == sorted(obj["key"] for obj in objects)
+
+
+def test_ledger_of_the_source_files_skips_loaded_chunks(tmp_path):
+    source = song_sources(tmp_path)
+    staging_prefix = str(tmp_path / "compacted") + "/"
+    manifest_path, _ = compact_files(list_source_objects(source), staging_prefix, slices=2, target_chunk_size=2048,
+                                     workers=1)
+    chunks = list_source_objects(manifest_path)
+    loaded = {obj["key"]: obj["etag"] for obj in ledger_entries(chunks)}
+    assert pending_objects(chunks, loaded) == []
+
+    changed = chunks[0]["sources"][0]
+    loaded[changed["key"]] = "stale"
+    assert [chunk["key"] for chunk in pending_objects(chunks, loaded)] == [chunks[0]["key"]]
+
+
+def test_a_changed_file_reloads_every_file_of_its_load(tmp_path):
+    source = song_sources(tmp_path)
+    staging_prefix = str(tmp_path / "compacted") + "/"
+    manifest_path, _ = compact_files(list_source_objects(source), staging_prefix, slices=2, target_chunk_size=2048,
+                                     workers=1)
+    chunks = list_source_objects(manifest_path)
+    entries = ledger_entries(chunks)
+    loaded = {obj["key"]: obj["etag"] for obj in entries}
+    first = {obj["key"] for obj in chunks[0]["sources"]}
+    loads = {obj["key"]: "run_1" if obj["key"] in first else "run_2" for obj in entries}
+    assert replaced_loads(chunks, loaded, loads) == set()
+
+    loaded[chunks[0]["sources"][0]["key"]] = "stale"
+    replaced = replaced_loads(chunks, loaded, loads)
+    assert replaced == {"run_1"}
+    assert reloaded_keys(loads, replaced) == first
+    assert [chunk["key"] for chunk in pending_objects(chunks, loaded, reloaded_keys(loads, replaced))] == \
+        [chunks[0]["key"]]
+
+
+def test_a_manifest_without_sources_removes_the_earlier_sources_file(tmp_path):
+    source = song_sources(tmp_path)
+    staging_prefix = str(tmp_path / "compacted") + "/"
+    manifest_path, results = compact_files(list_source_objects(source), staging_prefix, slices=2,
+                                           target_chunk_size=2048, workers=1)
+    assert os.path.exists(manifest_sources_path(manifest_path))
+
+    write_manifest([{"url": result["url"], "bytes_out": result["bytes_out"]} for result in results], staging_prefix)
+    assert not os.path.exists(manifest_sources_path(manifest_path))
+    assert all("sources" not in obj for obj in list_source_objects(manifest_path))
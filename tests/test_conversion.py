@@ -0,0 +1,40 @@
+"""
+The converted CSV chunks keep NULLs and empty strings apart when they are loaded back.
+"""
+import json
+
+from helpers import (SqlQueries, STAGING_SCHEMAS, adapt_sql, list_source_objects, record_fields, convert_files,
+                     copy_converted)
+
+
+def test_redshift_loads_empty_csv_fields_as_null():
+    sql = SqlQueries.staging_table_copy_converted("songs_raw_data", "s3://bucket/manifest", "arn", "csv")
+    assert "FORMAT AS CSV GZIP EMPTYASNULL" in sql
+    assert "EMPTYASNULL" not in SqlQueries.staging_table_copy_converted("songs_raw_data", "s3://bucket/manifest",
+                                                                        "arn", "parquet")
+
+
+def test_nulls_round_trip_through_the_converted_csv(db, tmp_path):
+    source = tmp_path / "song_data"
+    source.mkdir()
+    songs = [{"song_id": "SOA", "num_songs": 1, "title": "A", "artist_name": "X", "artist_latitude": None,
+              "year": 0, "duration": 1.5, "artist_id": "ARA", "artist_longitude": None, "artist_location": None},
+             {"song_id": "SOB", "num_songs": 1, "title": "B", "artist_name": "Y", "artist_latitude": 1.0,
+              "year": 2000, "duration": 2.5, "artist_id": "ARB", "artist_longitude": 2.0, "artist_location": ""}]
+    for song in songs:
+        (source / f"{song['song_id']}.json").write_text(json.dumps(song))
+    schema = STAGING_SCHEMAS["songs"]
+    _, results = convert_files(list_source_objects(str(source)), str(tmp_path / "converted") + "/", schema,
+                               record_fields("songs"), output_format="csv", workers=1)
+    db.run(adapt_sql(SqlQueries.staging_table_create("songs_raw_data", schema), redshift=False))
+    conn = db.get_conn()
+    try:
+        rows = copy_converted(conn, "songs_raw_data", schema.columns, [result["url"] for result in results], "csv")
+        conn.commit()
+    finally:
+        conn.close()
+    assert rows == 2
+    assert db.get_records("""
+        SELECT song_id, artist_location IS NULL, artist_location, artist_latitude IS NULL
+        FROM songs_raw_data ORDER BY song_id;
+    """) == [("SOA", True, None, True), ("SOB", False, "", False)]
@@ -0,0 +1,60 @@
+"""
+The ROW_NUMBER build of dimension_user against the former MAX(ts) build, on a local Postgres.
+"""
+import json
+import os
+
+import pytest
+
+from conftest import RESOURCES, count_rows
+
+from helpers import SqlQueries, adapt_sql
+
+LOGS_TABLE = "logs_raw_data"
+COLUMNS = ["user_id", "first_name", "last_name", "gender", "level"]
+
+
+def build(db, table, insert_func, window=None):
+    db.run([SqlQueries.delete_table(table), adapt_sql(SqlQueries.dimension_user_create(table), redshift=False),
+            insert_func(table, LOGS_TABLE, window)])
+
+
+def load_logs(db, source):
+    import workload
+    conn = db.get_conn()
+    try:
+        return workload.load_staging_table(conn, LOGS_TABLE, "logs", source)
+    finally:
+        conn.close()
+
+
+@pytest.mark.parametrize("window", [None, (1541030400000, 1541116800000)])
+def test_row_number_matches_the_former_build_on_the_bundled_logs(db, window):
+    load_logs(db, os.path.join(RESOURCES, "log-data"))
+    build(db, "dimension_user_legacy", SqlQueries.dimension_user_insert, window)
+    build(db, "dimension_user_latest", SqlQueries.dimension_user_insert_latest, window)
+    assert count_rows(db, "dimension_user_latest") > 0
+    assert db.get_first(SqlQueries.table_diff("dimension_user_legacy", "dimension_user_latest", COLUMNS)) == (0, 0)
+    assert count_rows(db, "dimension_user_latest") == db.get_first(
+        "SELECT COUNT(DISTINCT user_id) FROM dimension_user_latest;")[0]
+
+
+def test_the_latest_level_wins(db, tmp_path):
+    events = [
+        {"userId": "1", "firstName": "Ann", "lastName": "Lee", "gender": "F", "level": "free", "ts": 1000,
+         "sessionId": 1, "itemInSession": 0, "page": "NextSong"},
+        {"userId": "1", "firstName": "Ann", "lastName": "Lee", "gender": "F", "level": "paid", "ts": 2000,
+         "sessionId": 1, "itemInSession": 1, "page": "NextSong"},
+        {"userId": "2", "firstName": "Bo", "lastName": "Kim", "gender": "M", "level": "paid", "ts": 1500,
+         "sessionId": 2, "itemInSession": 0, "page": "NextSong"},
+        {"userId": "2", "firstName": "Bo", "lastName": "Kim", "gender": "M", "level": "free", "ts": 3000,
+         "sessionId": 3, "itemInSession": 0, "page": "Home"},
+    ]
+    source = tmp_path / "events.json"
+    source.write_text("\n".join(json.dumps(event) for event in events) + "\n")
+    load_logs(db, str(source))
+    build(db, "dimension_user_legacy", SqlQueries.dimension_user_insert)
+    build(db, "dimension_user_latest", SqlQueries.dimension_user_insert_latest)
+    expected = [(1, "Ann", "Lee", "F", "paid"), (2, "Bo", "Kim", "M", "free")]
+    for table in ("dimension_user_legacy", "dimension_user_latest"):
+        assert db.get_records(f"SELECT {', '.join(COLUMNS)} FROM {table} ORDER BY user_id;") == expected
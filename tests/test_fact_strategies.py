@@ -0,0 +1,111 @@
+"""
+The fact load strategies on the bundled resources, loaded into a local Postgres.
+"""
+import json
+
+import pytest
+
+from conftest import RESOURCES, count_rows, run_context
+
+from helpers import SqlQueries, adapt_sql
+
+SONGS_TABLE = "songs_raw_data"
+LOGS_TABLE = "logs_raw_data"
+
+
+@pytest.fixture
+def staged(db):
+    import workload
+    conn = db.get_conn()
+    try:
+        workload.load_staging(conn, RESOURCES, SONGS_TABLE, LOGS_TABLE)
+    finally:
+        conn.close()
+    return db
+
+
+@pytest.fixture
+def shared_song_key(db, tmp_path):
+    """
+    Two songs sharing their title, artist name and duration, whose smallest song_id and smallest artist_id belong to
+    different songs, and an event that plays them.
+    """
+    import workload
+    song = {"num_songs": 1, "title": "Intro", "artist_name": "Band", "duration": 100.5, "year": 0,
+            "artist_latitude": None, "artist_longitude": None, "artist_location": ""}
+    songs = tmp_path / "songs.json"
+    songs.write_text(json.dumps(dict(song, song_id="SOA", artist_id="ARB")) + "\n"
+                     + json.dumps(dict(song, song_id="SOB", artist_id="ARA")) + "\n")
+    events = tmp_path / "events.json"
+    events.write_text(json.dumps({"artist": "Band", "song": "Intro", "length": 100.5, "page": "NextSong",
+                                  "ts": 1541105830796, "userId": "1", "sessionId": 1, "itemInSession": 0,
+                                  "level": "free"}) + "\n")
+    conn = db.get_conn()
+    try:
+        workload.load_staging_table(conn, SONGS_TABLE, "songs", str(songs))
+        workload.load_staging_table(conn, LOGS_TABLE, "logs", str(events))
+    finally:
+        conn.close()
+    return db
+
+
+def load_fact(db, table, insert):
+    db.run([SqlQueries.delete_table(table), adapt_sql(SqlQueries.songplays_table_create(table), redshift=False),
+            insert])
+
+
+def test_legacy_and_hash_join_load_the_same_songplays(staged):
+    load_fact(staged, "songplays_legacy", SqlQueries.songplays_table_insert("songplays_legacy", SONGS_TABLE,
+                                                                            LOGS_TABLE))
+    load_fact(staged, "songplays_hash_join", SqlQueries.songplays_table_insert_hash_join("songplays_hash_join",
+                                                                                         SONGS_TABLE, LOGS_TABLE))
+    assert count_rows(staged, "songplays_hash_join") > 0
+    assert staged.get_first(SqlQueries.songplays_table_diff("songplays_legacy", "songplays_hash_join")) == (0, 0)
+    assert count_rows(staged, "songplays_legacy") == count_rows(staged, "songplays_hash_join")
+
+
+def test_match_key_resolves_every_event_hash_join_resolves(staged):
+    staged.run([adapt_sql(SqlQueries.song_events_create("song_events"), redshift=False),
+                adapt_sql(SqlQueries.song_events_insert("song_events", LOGS_TABLE), redshift=False),
+                adapt_sql(SqlQueries.song_match_keys_create("song_match_keys"), redshift=False),
+                adapt_sql(SqlQueries.song_match_keys_insert("song_match_keys", SONGS_TABLE), redshift=False)])
+    load_fact(staged, "songplays_hash_join", SqlQueries.songplays_table_insert_hash_join("songplays_hash_join",
+                                                                                         SONGS_TABLE, "song_events"))
+    load_fact(staged, "songplays_match_key", SqlQueries.songplays_table_insert_match_key("songplays_match_key",
+                                                                                         "song_match_keys",
+                                                                                         "song_events"))
+    only_hash_join, _ = staged.get_first(SqlQueries.table_diff("songplays_hash_join", "songplays_match_key",
+                                                               ["start_time", "user_id", "session_id"]))
+    assert count_rows(staged, "songplays_hash_join") > 0
+    assert only_hash_join == 0
+
+
+def test_hash_join_takes_both_ids_from_the_same_song(shared_song_key):
+    load_fact(shared_song_key, "songplays_hash_join", SqlQueries.songplays_table_insert_hash_join(
+        "songplays_hash_join", SONGS_TABLE, LOGS_TABLE))
+    assert shared_song_key.get_records("SELECT song_id, artist_id FROM songplays_hash_join;") == [("SOA", "ARB")]
+
+
+def test_match_keys_take_both_ids_from_the_same_song(shared_song_key):
+    shared_song_key.run([adapt_sql(SqlQueries.song_match_keys_create("song_match_keys"), redshift=False),
+                         adapt_sql(SqlQueries.song_match_keys_insert("song_match_keys", SONGS_TABLE), redshift=False)])
+    assert shared_song_key.get_records("SELECT song_id, artist_id FROM song_match_keys;") == [("SOA", "ARB")]
+
+
+def test_the_fact_load_adds_ts_to_an_older_songplays_table(monkeypatch, shared_song_key):
+    pytest.importorskip("airflow.models")
+    import operators.load_fact as fact_module
+    from operators import LoadFactOperator
+
+    shared_song_key.run([
+        "CREATE TABLE songplays (songplay_id SERIAL, start_time VARCHAR, user_id INTEGER, level VARCHAR(10), "
+        "song_id VARCHAR(20), artist_id VARCHAR(20), session_id INTEGER, location VARCHAR(200), user_agent TEXT);",
+        "INSERT INTO songplays (start_time, user_id, level, song_id, artist_id, session_id) "
+        "VALUES ('1541030400000', 2, 'free', 'SOA', 'ARB', 2);"
+    ])
+    monkeypatch.setattr(fact_module, "PostgresHook", lambda conn_id: shared_song_key)
+    operator = LoadFactOperator(task_id="load_songplays_fact_table", db_conn_id="redshift", table="songplays",
+                                raw_songs_table=SONGS_TABLE, raw_logs_table=LOGS_TABLE)
+    operator.execute(run_context("2018-11-01", operator.task_id))
+    assert shared_song_key.get_records("SELECT start_time, ts FROM songplays ORDER BY ts;") == [
+        ("1541030400000", 1541030400000), ("1541105830796", 1541105830796)]
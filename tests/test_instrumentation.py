@@ -0,0 +1,135 @@
+"""
+The metrics an instrumented hook publishes: the query_metrics XCom and the StatsD datagrams, caught by a local UDP
+listener.
+"""
+import json
+import socket
+import sqlite3
+
+import pytest
+
+from conftest import run_context
+
+from helpers import SqlQueries, InstrumentedHook, StatsdClient
+from helpers.instrumentation import XCOM_KEY
+
+
+class SqliteHook:
+    """
+    Stands in for a PostgresHook on a sqlite database, which reports the cursor.rowcount of its statements too.
+    """
+
+    postgres_conn_id = "redshift"
+    supports_autocommit = False
+
+    def __init__(self, path):
+        self.path = path
+
+    def get_conn(self):
+        return sqlite3.connect(self.path)
+
+    def get_connection(self, conn_id):
+        class Connection:
+            conn_type = "postgres"
+            host = "localhost"
+        return Connection()
+
+    def get_records(self, sql, parameters=None):
+        conn = self.get_conn()
+        try:
+            return conn.execute(sql, parameters or ()).fetchall()
+        finally:
+            conn.close()
+
+
+@pytest.fixture
+def listener():
+    sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+    sock.bind(("127.0.0.1", 0))
+    sock.settimeout(0.5)
+    yield sock
+    sock.close()
+
+
+def received(sock):
+    """
+    Reads the datagrams sent to the listener until it stays idle.
+    :return: Dictionary with the (value, type) of every metric name.
+    """
+    metrics = {}
+    while True:
+        try:
+            datagram = sock.recv(1024).decode("utf-8")
+        except socket.timeout:
+            return metrics
+        name, rest = datagram.split(":", 1)
+        value, metric_type = rest.split("|")
+        metrics[name] = (int(value), metric_type)
+
+
+def test_statement_durations_and_row_counts_are_sent_to_statsd(listener, tmp_path):
+    statsd = StatsdClient(*listener.getsockname(), prefix="sparkify")
+    db = InstrumentedHook(SqliteHook(str(tmp_path / "plays.db")), "load_plays", statsd=statsd)
+    db.run(["CREATE TABLE plays (id INTEGER);", "INSERT INTO plays VALUES (1), (2), (3);"])
+    assert db.get_records("SELECT id FROM plays;") == [(1,), (2,), (3,)]
+    context = run_context("2018-11-01", "load_plays")
+    db.publish(context)
+
+    metrics = received(listener)
+    assert set(metrics) == {"sparkify.load_plays.total_ms", "sparkify.load_plays.00_create.duration_ms",
+                            "sparkify.load_plays.01_insert.duration_ms", "sparkify.load_plays.01_insert.rows",
+                            "sparkify.load_plays.02_select.duration_ms", "sparkify.load_plays.02_select.rows"}
+    assert metrics["sparkify.load_plays.01_insert.rows"] == (3, "g")
+    assert metrics["sparkify.load_plays.02_select.rows"] == (3, "g")
+    durations = {name: value for name, (value, metric_type) in metrics.items() if metric_type == "ms"}
+    assert len(durations) == 4 and all(value >= 0 for value in durations.values())
+    assert durations["sparkify.load_plays.total_ms"] >= max(durations.values()) - 1
+
+    payload = context["ti"].xcoms[("load_plays", XCOM_KEY)]
+    assert [statement["label"] for statement in payload["statements"]] == ["00_create", "01_insert", "02_select"]
+    assert [statement["rows"] for statement in payload["statements"]][1:] == [3, 3]
+
+
+def test_unreachable_statsd_does_not_fail_the_task():
+    StatsdClient("256.0.0.1").send([("load_plays.total_ms", 1, "ms")])
+
+
+def test_operators_send_their_metrics_with_instrument(monkeypatch, listener, db, tmp_path):
+    pytest.importorskip("airflow.models")
+    import workload
+    import operators.load_dimension as dimension_module
+    from operators import LoadDimensionOperator
+
+    host, port = listener.getsockname()
+    monkeypatch.setenv("AIRFLOW__SCHEDULER__STATSD_ON", "True")
+    monkeypatch.setenv("AIRFLOW__SCHEDULER__STATSD_HOST", host)
+    monkeypatch.setenv("AIRFLOW__SCHEDULER__STATSD_PORT", str(port))
+    monkeypatch.setenv("AIRFLOW__SCHEDULER__STATSD_PREFIX", "sparkify")
+    monkeypatch.setattr(dimension_module, "PostgresHook", lambda conn_id: db)
+    events = tmp_path / "events.json"
+    events.write_text("\n".join(json.dumps({"userId": str(user_id), "firstName": "A", "lastName": "B",
+                                            "gender": "F", "level": "free", "ts": 1000 + user_id,
+                                            "sessionId": user_id, "itemInSession": 0, "page": "NextSong"})
+                                for user_id in (1, 2)) + "\n")
+    conn = db.get_conn()
+    try:
+        workload.load_staging_table(conn, "logs_raw_data", "logs", str(events))
+    finally:
+        conn.close()
+
+    operator = LoadDimensionOperator(task_id="create_and_populate_dim_user", db_conn_id="redshift",
+                                     table="dimension_user", raw_table="logs_raw_data",
+                                     create_func=SqlQueries.dimension_user_create,
+                                     insert_func=SqlQueries.dimension_user_insert_latest, delete_first=True,
+                                     instrument=True)
+    context = run_context("2018-11-01", operator.task_id)
+    operator.execute(context)
+
+    metrics = received(listener)
+    prefix = "sparkify.create_and_populate_dim_user"
+    assert set(metrics) == {f"{prefix}.total_ms", f"{prefix}.00_drop.duration_ms", f"{prefix}.01_create.duration_ms",
+                            f"{prefix}.02_insert.duration_ms", f"{prefix}.02_insert.rows"}
+    assert metrics[f"{prefix}.02_insert.rows"] == (2, "g")
+    assert all(metric_type == "ms" for name, (_, metric_type) in metrics.items() if name.endswith("_ms"))
+    payload = context["ti"].xcoms[(operator.task_id, XCOM_KEY)]
+    assert [statement["rows"] for statement in payload["statements"]][2] == 2
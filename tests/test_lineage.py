@@ -0,0 +1,52 @@
+"""
+Dependencies inferred from the table lineage of the specs, and the critical path of the sparkify DAG.
+"""
+import importlib
+
+import pytest
+
+from helpers import infer_dependencies, critical_path
+
+ROLLUPS = ["update_rollup_daily_artist_plays", "update_rollup_daily_level_plays", "update_rollup_daily_song_plays",
+           "update_rollup_hourly_concurrency"]
+
+
+def spec(task_id, table, sources=()):
+    return {"task_id": task_id, "table": table, "sources": list(sources), "operator": None}
+
+
+def test_implied_dependencies_are_dropped():
+    specs = [spec("stage", "raw", ["s3"]), spec("extract", "events", ["raw"]),
+             spec("fact", "facts", ["raw", "events"]), spec("report", None, ["facts", "raw"])]
+    assert infer_dependencies(specs) == {"stage": set(), "extract": {"stage"}, "fact": {"extract"},
+                                         "report": {"fact"}}
+    assert critical_path(infer_dependencies(specs)) == ["stage", "extract", "fact", "report"]
+
+
+def test_cycles_are_rejected():
+    with pytest.raises(ValueError):
+        infer_dependencies([spec("a", "x", ["y"]), spec("b", "y", ["x"])])
+
+
+def test_sparkify_graph_and_critical_path(monkeypatch):
+    pytest.importorskip("airflow.models")
+    monkeypatch.delenv("SPARKIFY_STAGING_ROOT", raising=False)
+    dag_module = importlib.reload(importlib.import_module("stage_sparkify_data_dag"))
+    dependencies = infer_dependencies(dag_module.table_specs)
+    assert dependencies == {
+        "stage_songs_into_db": set(),
+        "stage_logs_into_db": set(),
+        "extract_song_events": {"stage_logs_into_db"},
+        "create_and_populate_facts_table": {"stage_songs_into_db", "extract_song_events"},
+        "create_and_populate_dim_song": {"stage_songs_into_db"},
+        "create_and_populate_dim_artist": {"stage_songs_into_db"},
+        "create_and_populate_dim_time": {"extract_song_events"},
+        "create_and_populate_dim_user": {"extract_song_events"},
+        **{rollup: {"create_and_populate_facts_table"} for rollup in ROLLUPS},
+        "data_quality_check": {"create_and_populate_facts_table", "create_and_populate_dim_song",
+                               "create_and_populate_dim_artist", "create_and_populate_dim_time",
+                               "create_and_populate_dim_user"},
+        "table_maintenance": {"data_quality_check"} | set(ROLLUPS),
+    }
+    assert critical_path(dependencies) == ["stage_logs_into_db", "extract_song_events", "create_and_populate_dim_time",
+                                           "data_quality_check", "table_maintenance"]
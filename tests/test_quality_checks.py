@@ -0,0 +1,55 @@
+"""
+The approximate unique checks: a clear estimate is trusted, an ambiguous one is escalated to the exact count.
+"""
+from helpers import default_checks, run_checks
+
+CHECK = {"type": "unique", "table": "dimension_user", "column": "user_id", "approximate": True,
+         "max_duplicate_ratio": 0.05}
+
+
+def run(check, keys):
+    queries = []
+
+    def get_records(query):
+        queries.append(query)
+        return [("unique:dimension_user.user_id", len(set(keys)), len(keys))]
+
+    result, = run_checks(get_records, [check], redshift=False, stream_values=lambda query: iter(keys))
+    return result, queries
+
+
+def test_a_clean_estimate_passes_without_the_exact_count():
+    result, queries = run(CHECK, [str(key) for key in range(20000)])
+    assert result.passed
+    assert queries == []
+
+
+def test_an_estimate_far_below_the_threshold_fails_without_the_exact_count():
+    result, queries = run(CHECK, [str(key % 10000) for key in range(20000)])
+    assert not result.passed
+    assert queries == []
+
+
+def test_an_ambiguous_estimate_is_escalated_to_the_exact_count():
+    result, queries = run(CHECK, [str(key % 19000) for key in range(20000)])
+    assert result.passed
+    assert len(queries) == 1 and "COUNT(DISTINCT user_id)" in queries[0]
+
+
+def test_zero_tolerance_fails_fast_and_confirms_a_pass_with_the_exact_count():
+    check = {"type": "unique", "table": "dimension_user", "column": "user_id", "approximate": True}
+    result, queries = run(check, [str(key % 10000) for key in range(20000)])
+    assert not result.passed
+    assert queries == []
+    result, queries = run(check, [str(key) for key in range(20000)])
+    assert result.passed
+    assert len(queries) == 1 and "COUNT(DISTINCT user_id)" in queries[0]
+    result, queries = run(check, [str(key % 19999) for key in range(20000)])
+    assert not result.passed
+    assert len(queries) == 1
+
+
+def test_default_checks_keep_zero_tolerance_when_approximate():
+    assert [check.get("approximate") for check in default_checks({"dimension_user": "user_id"})] == [None, None]
+    unique, _ = default_checks({"dimension_user": "user_id"}, approximate=True)
+    assert unique == {"type": "unique", "table": "dimension_user", "column": "user_id", "approximate": True}
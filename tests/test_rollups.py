@@ -0,0 +1,32 @@
+"""
+The incremental rollups against their full recompute, on a local Postgres.
+"""
+import datetime
+import random
+
+from conftest import count_rows
+
+from helpers import SqlQueries
+
+
+def test_incremental_rollups_match_the_full_recompute(db):
+    import rollup_benchmark
+    conn = db.get_conn()
+    try:
+        rollup_benchmark.create_tables(conn)
+        rollup_benchmark.load_days(conn, random.Random(0), datetime.datetime(2018, 11, 1), days=3, plays=500,
+                                   users=50, songs=200, hit_rate=0.7)
+        results = rollup_benchmark.compare_full(conn)
+    finally:
+        conn.close()
+    assert count_rows(db, rollup_benchmark.FACT_TABLE) == 1500
+    for table, result in results.items():
+        assert count_rows(db, table) > 0
+        assert (result["only_incremental"], result["only_full_recompute"]) == (0, 0), table
+
+
+def test_rollups_filter_the_sorted_ts_column():
+    sql = SqlQueries.rollup_daily_song_insert("rollup", "songplays", (1541030400000, 1541116800000))
+    assert "ts >= 1541030400000 AND ts < 1541116800000" in sql
+    assert "CAST(start_time" not in sql
+    assert "SORTKEY(ts)" in SqlQueries.songplays_table_create("songplays")
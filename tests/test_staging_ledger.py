@@ -0,0 +1,96 @@
+"""
+Incremental staging against moto s3 and a local Postgres: the ledger decides which files a run copies.
+"""
+import glob
+import json
+import os
+
+import pytest
+
+from conftest import RESOURCES, count_rows, run_context
+
+pytest.importorskip("airflow.models")
+moto = pytest.importorskip("moto")
+boto3 = pytest.importorskip("boto3")
+
+from helpers import SqlQueries, adapt_sql  # noqa: E402
+import operators.stage_redshift_operator as stage_module  # noqa: E402
+
+BUCKET = "sparkify-test"
+PREFIX = "song_data/"
+LEDGER = "staging_loaded_files"
+
+
+@pytest.fixture
+def s3_client(monkeypatch):
+    mock = getattr(moto, "mock_aws", None) or moto.mock_s3
+    with mock():
+        monkeypatch.setenv("AWS_ACCESS_KEY_ID", "testing")
+        monkeypatch.setenv("AWS_SECRET_ACCESS_KEY", "testing")
+        client = boto3.client("s3", region_name="us-east-1")
+        client.create_bucket(Bucket=BUCKET)
+        yield client
+
+
+@pytest.fixture
+def song_files(s3_client):
+    paths = sorted(glob.glob(os.path.join(RESOURCES, "song_data", "**", "*.json"), recursive=True))[:10]
+    keys = []
+    for i, path in enumerate(paths):
+        key = f"{PREFIX}{i:03d}.json"
+        with open(path, "rb") as f:
+            s3_client.put_object(Bucket=BUCKET, Key=key, Body=f.read())
+        keys.append(key)
+    return keys
+
+
+@pytest.fixture
+def staging_operator(monkeypatch, db, s3_client):
+    class S3Hook:
+        def __init__(self, aws_conn_id=None):
+            pass
+
+        def get_conn(self):
+            return s3_client
+
+    monkeypatch.setattr(stage_module, "PostgresHook", lambda conn_id: db)
+    monkeypatch.setattr(stage_module, "S3Hook", S3Hook)
+    return stage_module.RedshiftStagingOperator(task_id="stage_songs_into_db", db_conn_id="redshift",
+                                                aws_credentials_id="aws_credentials", table="songs_raw_data",
+                                                s3_bucket=BUCKET, s3_key=PREFIX, staging_type="songs",
+                                                incremental=True, ledger_table=LEDGER)
+
+
+def ledger_etags(db):
+    return {key: etag for key, etag, _ in db.get_records(SqlQueries.staging_ledger_select(LEDGER, "songs_raw_data"))}
+
+
+def test_ledger_copies_only_new_or_changed_files(db, s3_client, song_files, staging_operator):
+    staging_operator.execute(run_context("2018-11-01", staging_operator.task_id))
+    assert count_rows(db, "songs_raw_data") == len(song_files)
+    ledger = ledger_etags(db)
+    assert sorted(ledger) == sorted(f"s3://{BUCKET}/{key}" for key in song_files)
+
+    staging_operator.execute(run_context("2018-11-02", staging_operator.task_id))
+    assert count_rows(db, "songs_raw_data") == len(song_files)
+
+    changed = json.loads(s3_client.get_object(Bucket=BUCKET, Key=song_files[0])["Body"].read())
+    changed["title"] = changed["title"] + " (Remastered)"
+    s3_client.put_object(Bucket=BUCKET, Key=song_files[0], Body=json.dumps(changed).encode("utf-8"))
+    staging_operator.execute(run_context("2018-11-03", staging_operator.task_id))
+    assert count_rows(db, "songs_raw_data") == len(song_files)
+    assert db.get_first("SELECT COUNT(*) FROM songs_raw_data WHERE title = %s;", (changed["title"],))[0] == 1
+    assert db.get_first("SELECT COUNT(DISTINCT load_key) FROM songs_raw_data;")[0] == 1
+    ledger_after = ledger_etags(db)
+    assert ledger_after[f"s3://{BUCKET}/{song_files[0]}"] != ledger[f"s3://{BUCKET}/{song_files[0]}"]
+    assert len(ledger_after) == len(song_files)
+
+
+def test_tables_created_before_the_load_keys_are_migrated(db, song_files, staging_operator):
+    db.run(["CREATE TABLE staging_loaded_files (target_table VARCHAR(256) NOT NULL, s3_key VARCHAR(1024) NOT NULL, "
+            "etag VARCHAR(64) NOT NULL, size BIGINT, loaded_at TIMESTAMP);",
+            adapt_sql(SqlQueries.staging_songs_table_create("songs_raw_data"), redshift=False)])
+    staging_operator.execute(run_context("2018-11-01", staging_operator.task_id))
+    assert count_rows(db, "songs_raw_data") == len(song_files)
+    assert db.get_first("SELECT COUNT(*) FROM songs_raw_data WHERE load_key IS NOT NULL;")[0] == len(song_files)
+    assert db.get_first(f"SELECT COUNT(*) FROM {LEDGER} WHERE load_key IS NOT NULL;")[0] == len(song_files)
@@ -0,0 +1,24 @@
+"""
+Sampling of the VARCHAR widths of the staging tables.
+"""
+from helpers import STAGING_SCHEMAS, sample_widths, record_fields
+
+
+def widths(schema):
+    return {column.name: column.width for column in schema.columns if column.width}
+
+
+def test_sampled_widths_never_go_below_the_registry():
+    schema = STAGING_SCHEMAS["logs"]
+    records = [{"artist": "A", "auth": "In", "firstName": "Al", "gender": "M", "level": "free",
+                "location": "X", "method": "PUT", "page": "NextSong", "song": "S", "userAgent": "U"}] * 10
+    sampled = sample_widths(schema, records, record_fields("logs"))
+    assert widths(sampled) == widths(schema)
+
+
+def test_sampled_widths_grow_past_the_registry():
+    schema = STAGING_SCHEMAS["songs"]
+    records = [{"title": "t" * 600, "artist_name": "Band"}]
+    sampled = widths(sample_widths(schema, records, record_fields("songs")))
+    assert sampled["title"] == 2048
+    assert sampled["artist_name"] == widths(schema)["artist_name"]
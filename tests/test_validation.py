@@ -0,0 +1,51 @@
+"""
+Validation of the log records against the widths the staging table is created with.
+"""
+import json
+import os
+
+import pytest
+
+from conftest import RESOURCES, run_context
+
+from helpers import STAGING_SCHEMAS, WIDTHS_KEY, apply_widths, record_errors, record_fields
+
+LOG_FILE = os.path.join(RESOURCES, "log-data", "2018-11-01-events.json")
+
+
+def test_records_are_checked_against_the_widths_of_the_table():
+    schema = STAGING_SCHEMAS["logs"]
+    line = json.dumps({"location": "x" * 300, "ts": 1541105830796})
+    assert record_errors(line, schema.columns, record_fields("logs")) == ["width:location"]
+    widened = apply_widths(schema, {"location": 512})
+    assert record_errors(line, widened.columns, record_fields("logs")) == []
+
+
+def test_staging_creates_the_table_with_the_validated_widths(monkeypatch, tmp_path):
+    pytest.importorskip("airflow.models")
+    from airflow.models import DAG
+    import operators.validate_records as validate_module
+    from operators import ValidateRecordsOperator, RedshiftStagingOperator
+
+    class PostgresHook:
+        def __init__(self, conn_id):
+            pass
+
+        def get_records(self, sql, parameters=None):
+            return []
+
+    monkeypatch.setattr(validate_module, "PostgresHook", PostgresHook)
+    dag = DAG("validation_test", start_date=run_context("2018-11-01")["execution_date"])
+    validate = ValidateRecordsOperator(task_id="validate_logs", dag=dag, source=LOG_FILE,
+                                       staging_prefix=str(tmp_path / "valid") + "/",
+                                       quarantine_prefix=str(tmp_path / "quarantine") + "/", staging_type="logs",
+                                       table="logs_raw_data", batched=True, sample_size=1000, ts_slack_hours=None,
+                                       slices=1, workers=1)
+    stage = RedshiftStagingOperator(task_id="stage_logs_into_db", dag=dag, table="logs_raw_data",
+                                    staging_type="logs", batched=True, sample_size=1000)
+    validate >> stage
+    xcoms = {}
+    validate.execute(run_context("2018-11-01", validate.task_id, xcoms))
+    widths = xcoms[(validate.task_id, WIDTHS_KEY)]
+    assert all(widths[column.name] >= column.width for column in STAGING_SCHEMAS["logs"].columns if column.width)
+    assert stage.validated_widths(run_context("2018-11-01", stage.task_id, xcoms)) == widths